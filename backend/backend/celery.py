@@ -2,13 +2,15 @@ from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
 from celery import current_app
-from celery.signals import after_task_publish, celeryd_init
+from celery.signals import after_task_publish, celeryd_init, worker_init, worker_process_shutdown
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings.prod')
 
 from django.conf import settings
 
+from libs.metrics import start_metrics_server, mark_process_dead
+
 app = Celery('backend')
 
 # Using a string here means the worker doesn't have to serialize
@@ -32,6 +34,24 @@ def setup_log_format(sender, conf, **kwargs):
     ).format(sender)
 
 
+@worker_init.connect
+def setup_metrics_server(sender=None, **kwargs):
+    if settings.METRICS_ENABLED:
+        start_metrics_server(settings.WORKER_METRICS_PORT)
+
+
+@worker_init.connect
+def register_control_commands(sender=None, **kwargs):
+    # remote control commands of the compute workers ({ORG_NAME}.worker), run in their main process
+    if sender is not None and sender.hostname.endswith('.worker'):
+        import substrapp.tasks.prefetch  # noqa: F401
+
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid=None, **kwargs):
+    mark_process_dead(pid)
+
+
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
     from substrapp.tasks.tasks import (prepare_training_task,
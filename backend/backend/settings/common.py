@@ -96,8 +96,15 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'libs.health_check_middleware.HealthCheckMiddleware',
+    'libs.metrics_middleware.MetricsMiddleware',
 ]
 
+# Prometheus metrics, served on /metrics by the server and on WORKER_METRICS_PORT by the workers
+METRICS_ENABLED = to_bool(os.environ.get('METRICS_ENABLED', False))
+WORKER_METRICS_PORT = int(os.environ.get('WORKER_METRICS_PORT', 8001))
+# Health and metrics of the events service, see events.server
+EVENTS_SERVER_PORT = int(os.environ.get('EVENTS_SERVER_PORT', 8000))
+
 
 DJANGO_LOG_SQL_QUERIES = to_bool(os.environ.get('DJANGO_LOG_SQL_QUERIES', 'True'))
 if DJANGO_LOG_SQL_QUERIES:
@@ -139,6 +146,19 @@ DATABASES = {
     }
 }
 
+# Caches
+# The ledger cache must be shared by all the backend processes (server, workers, events)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'ledger': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'ledger_cache',
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -202,6 +222,12 @@ TASK = {
     'KANIKO_MIRROR': to_bool(os.environ.get('KANIKO_MIRROR', False)),
     'KANIKO_IMAGE': os.environ.get('KANIKO_IMAGE'),
     'COMPUTE_REGISTRY': os.environ.get('COMPUTE_REGISTRY'),
+    'PRIORITY_ENABLED': to_bool(os.environ.get('TASK_PRIORITY_ENABLED', False)),
+    'PREFETCH_ENABLED': to_bool(os.environ.get('TASK_PREFETCH_ENABLED', False)),
+    'PREFETCH_CONCURRENCY': int(os.environ.get('TASK_PREFETCH_CONCURRENCY', 2)),
+    'PREFETCH_CACHE_MAX_SIZE': int(os.environ.get('TASK_PREFETCH_CACHE_MAX_SIZE', 10 * 1024 ** 3)),
+    'MATERIALS_CONCURRENCY': int(os.environ.get('TASK_MATERIALS_CONCURRENCY', 4)),
+    'MODELS_FETCH_CONCURRENCY': int(os.environ.get('TASK_MODELS_FETCH_CONCURRENCY', 8)),
 }
 
 CELERY_ACCEPT_CONTENT = ['application/json']
@@ -212,6 +238,11 @@ CELERY_TASK_MAX_RETRIES = 5
 CELERY_TASK_RETRY_DELAY_SECONDS = 2
 CELERY_WORKER_CONCURRENCY = int(os.environ.get('CELERY_WORKER_CONCURRENCY', 1))
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'amqp://localhost:5672//'),
+# Priority queues of the tuple tasks, see substrapp.tasks.priority. A worker prefetching several tasks
+# would run them before tasks of higher priority published later.
+if TASK['PRIORITY_ENABLED']:
+    CELERY_TASK_QUEUE_MAX_PRIORITY = 9
+    CELERY_WORKER_PREFETCH_MULTIPLIER = 1
 
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
 
@@ -1,6 +1,8 @@
 import os
 import json
 
+from ..common import to_bool
+
 LEDGER_CHANNELS = {
     channel: chaincode
     for channels in json.loads(os.getenv('LEDGER_CHANNELS'))
@@ -23,9 +25,52 @@ LEDGER_CLIENT_CERT_PATH = '/var/hyperledger/msp/signcerts/cert.pem'
 
 LEDGER_SYNC_ENABLED = True
 LEDGER_CALL_RETRY = True
+# Wait for the commit of synchronous invokes on one shared block stream, see substrapp.ledger.commit_tracker
+LEDGER_COMMIT_TRACKER_ENABLED = to_bool(os.getenv('LEDGER_COMMIT_TRACKER_ENABLED', True))
 LEDGER_WAIT_FOR_EVENT_TIMEOUT_SECONDS = int(os.getenv('LEDGER_WAIT_FOR_EVENT_TIMEOUT_SECONDS'))
 LEDGER_INVOKE_STRATEGY = os.getenv('LEDGER_INVOKE_STRATEGY')
 LEDGER_QUERY_STRATEGY = os.getenv('LEDGER_QUERY_STRATEGY')
+# With the ADAPTIVE query strategy, see substrapp.ledger.peer_selection
+LEDGER_QUERY_HEDGING_ENABLED = to_bool(os.getenv('LEDGER_QUERY_HEDGING_ENABLED', False))
+LEDGER_QUERY_HEDGING_PERCENTILE = int(os.getenv('LEDGER_QUERY_HEDGING_PERCENTILE', 95))
+
+LEDGER_CONNECTION_HEALTH_CHECK_INTERVAL_SECONDS = int(os.getenv('LEDGER_CONNECTION_HEALTH_CHECK_INTERVAL_SECONDS', 30))
+LEDGER_CONNECTION_HEALTH_CHECK_TIMEOUT_SECONDS = int(os.getenv('LEDGER_CONNECTION_HEALTH_CHECK_TIMEOUT_SECONDS', 10))
+LEDGER_DISCOVERY_TTL_SECONDS = int(os.getenv('LEDGER_DISCOVERY_TTL_SECONDS', 300))
+LEDGER_DISCOVERY_TIMEOUT_SECONDS = int(os.getenv('LEDGER_DISCOVERY_TIMEOUT_SECONDS', 30))
+LEDGER_MAX_CONCURRENT_QUERIES = int(os.getenv('LEDGER_MAX_CONCURRENT_QUERIES', 10))
+
+# Retry policy of ledger calls, see substrapp.ledger.retry
+LEDGER_RETRY_MAX_DELAY_SECONDS = int(os.getenv('LEDGER_RETRY_MAX_DELAY_SECONDS', 30))
+LEDGER_RETRY_BUDGET_MAX_TOKENS = int(os.getenv('LEDGER_RETRY_BUDGET_MAX_TOKENS', 100))
+LEDGER_RETRY_BUDGET_TOKEN_RATIO = float(os.getenv('LEDGER_RETRY_BUDGET_TOKEN_RATIO', 0.1))
+LEDGER_CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv('LEDGER_CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5))
+LEDGER_CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS = int(os.getenv('LEDGER_CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS', 30))
+
+# Read-through cache of ledger queries, see substrapp.ledger.cache
+LEDGER_CACHE_ENABLED = to_bool(os.getenv('LEDGER_CACHE_ENABLED', False))
+# Per chaincode function TTL overrides, e.g. '{"queryAlgos": 10}'
+LEDGER_CACHE_TTL_SECONDS = json.loads(os.getenv('LEDGER_CACHE_TTL_SECONDS', '{}'))
+
+# Copy of the ledger assets in the database, maintained by the events app, see substrapp.ledger.mirror
+LEDGER_MIRROR_ENABLED = to_bool(os.getenv('LEDGER_MIRROR_ENABLED', False))
+# Lists are read from the ledger while the mirror is behind the ledger by more blocks, or while the events
+# app has not reported the last block of the ledger for more seconds
+LEDGER_MIRROR_MAX_LAG_BLOCKS = int(os.getenv('LEDGER_MIRROR_MAX_LAG_BLOCKS', 10))
+LEDGER_MIRROR_MAX_LAG_SECONDS = int(os.getenv('LEDGER_MIRROR_MAX_LAG_SECONDS', 60))
+
+# Blocks replayed before the events checkpoint on (re)connection, see events.checkpoint
+LEDGER_EVENTS_CHECKPOINT_OVERLAP_BLOCKS = int(os.getenv('LEDGER_EVENTS_CHECKPOINT_OVERLAP_BLOCKS', 10))
+# Exponential backoff of the reconnections to a channel event hub, see events.service
+LEDGER_EVENTS_RECONNECT_MIN_SECONDS = float(os.getenv('LEDGER_EVENTS_RECONNECT_MIN_SECONDS', 1))
+LEDGER_EVENTS_RECONNECT_MAX_SECONDS = float(os.getenv('LEDGER_EVENTS_RECONNECT_MAX_SECONDS', 60))
+# Queue between the reception and the dispatch of the chaincode events, see events.dispatch_queue
+LEDGER_EVENTS_QUEUE_MAX_SIZE = int(os.getenv('LEDGER_EVENTS_QUEUE_MAX_SIZE', 100))
+LEDGER_EVENTS_QUEUE_SPILL_DIR = os.getenv('LEDGER_EVENTS_QUEUE_SPILL_DIR', '')
+
+# Serialization of the invokes writing the same compute plan or data manager, see substrapp.ledger.locks
+LEDGER_INVOKE_LOCK_ENABLED = to_bool(os.getenv('LEDGER_INVOKE_LOCK_ENABLED', False))
+LEDGER_INVOKE_LOCK_TIMEOUT_SECONDS = int(os.getenv('LEDGER_INVOKE_LOCK_TIMEOUT_SECONDS', 60))
 
 LEDGER_GRPC_MAX_SEND_MESSAGE_LENGTH = -1
 LEDGER_GRPC_MAX_RECEIVE_MESSAGE_LENGTH = -1
@@ -6,5 +6,7 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django_celery_results',
     'rest_framework',
+    # ledger mirror and events checkpoints
+    'substrapp',
     'events'
 ]
@@ -0,0 +1,57 @@
+"""Checkpoints of the events processed per channel.
+
+The events of a channel are replayed from its checkpoint after a restart or a reconnection, instead of
+from the first block. Some blocks before the checkpoint (LEDGER_EVENTS_CHECKPOINT_OVERLAP_BLOCKS) are
+replayed too, as a safety margin: replayed events are skipped since their tasks already exist.
+"""
+import logging
+
+from django.conf import settings
+
+from events import metrics as events_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelCheckpoint(object):
+    """Checkpoint and lag of the events of one channel."""
+
+    def __init__(self, channel_name):
+        self.channel_name = channel_name
+        self.block_number = None
+        self.head = None
+
+    def load(self):
+        from substrapp.models import EventCheckpoint
+        checkpoint = EventCheckpoint.objects.filter(channel=self.channel_name).first()
+        self.block_number = None if checkpoint is None else checkpoint.block_number
+        return self.block_number
+
+    def get_start_block(self):
+        """Return the first block to replay, from the persisted checkpoint."""
+        block_number = self.load()
+        if block_number is None:
+            return 0
+        return max(0, block_number + 1 - settings.LEDGER_EVENTS_CHECKPOINT_OVERLAP_BLOCKS)
+
+    def set_head(self, block_number):
+        if self.head is None or block_number > self.head:
+            self.head = block_number
+        self._observe_lag()
+
+    def save(self, block_number):
+        """Record that the events of the blocks up to `block_number` have been processed."""
+        from substrapp.models import EventCheckpoint
+
+        # replayed blocks never move the checkpoint back
+        if self.block_number is not None and block_number <= self.block_number:
+            return
+
+        EventCheckpoint.objects.update_or_create(channel=self.channel_name, defaults={'block_number': block_number})
+        self.block_number = block_number
+        events_metrics.CHECKPOINT_BLOCK.labels(channel=self.channel_name).set(block_number)
+        self._observe_lag()
+
+    def _observe_lag(self):
+        if self.head is not None and self.block_number is not None:
+            events_metrics.LAG_BLOCKS.labels(channel=self.channel_name).set(max(0, self.head - self.block_number))
@@ -0,0 +1,295 @@
+"""Dispatch of the chaincode events of a block to the workers.
+
+The events of a block are handled together: the tasks of the relevant assets are collected, the ones
+which already exist are found with a single query to the result backend, and the new ones are published
+on a single broker connection.
+
+The outcome of each asset of the events (see OUTCOMES) and the processing times by event type are
+returned in a DispatchStats and exported as metrics.
+
+With TASK_PREFETCH_ENABLED, the workers are also requested to prefetch the inputs of the tuples of the
+compute plans (see substrapp.tasks.prefetch).
+"""
+import collections
+import json
+import logging
+import time
+
+from celery.result import AsyncResult
+from django.conf import settings
+
+from backend.celery import app
+from substrapp.tasks import asset_cache
+from substrapp.tasks import priority as task_priority
+from substrapp.tasks.prefetch import request_prefetch
+from substrapp.tasks.tasks import prepare_tuple, on_compute_plan
+from substrapp.utils import get_owner
+
+from events import metrics as events_metrics
+
+logger = logging.getLogger(__name__)
+
+ENQUEUED = 'enqueued'
+SKIPPED_EXISTING = 'skipped_existing'
+SKIPPED_DUPLICATE = 'skipped_duplicate'
+SKIPPED_NOT_OWNER = 'skipped_not_owner'
+SKIPPED_STATUS = 'skipped_status'
+INVALID_TRANSACTION = 'invalid_transaction'
+
+OUTCOMES = (ENQUEUED, SKIPPED_EXISTING, SKIPPED_DUPLICATE, SKIPPED_NOT_OWNER, SKIPPED_STATUS, INVALID_TRANSACTION)
+
+
+class DispatchStats(object):
+    """Outcomes and processing times of the events of a block, by event type."""
+
+    def __init__(self):
+        self.outcomes = collections.Counter()
+        self.durations = collections.defaultdict(float)
+        self.duration = 0
+
+    def add(self, event_type, outcome, duration=0):
+        self.outcomes[(event_type, outcome)] += 1
+        self.durations[event_type] += duration
+
+    def count(self, outcome):
+        return sum(n for (_, o), n in self.outcomes.items() if o == outcome)
+
+    def observe(self, channel_name):
+        for (event_type, outcome), n in self.outcomes.items():
+            events_metrics.DISPATCH_OUTCOMES.labels(
+                channel=channel_name, event_type=event_type, outcome=outcome).inc(n)
+        for event_type, duration in self.durations.items():
+            events_metrics.EVENT_TYPE_DURATION.labels(channel=channel_name, event_type=event_type).observe(duration)
+        events_metrics.BLOCK_DURATION.labels(channel=channel_name).observe(self.duration)
+
+    def as_dict(self):
+        return {
+            'outcomes': {outcome: self.count(outcome) for outcome in OUTCOMES if self.count(outcome)},
+            'durations': dict(self.durations),
+            'duration': self.duration,
+        }
+
+
+def tuple_get_worker(event_type, asset):
+    if event_type == 'aggregatetuple':
+        return asset['worker']
+    return asset['dataset']['worker']
+
+
+def get_tuple_task(channel_name, owner, tx_status, event_type, asset, dependencies=None):
+    """Return `(outcome, task)` for a tuple event.
+
+    `task` is the `(task_id, signature)` of the task preparing the tuple, or None if there is nothing to do,
+    with the reason as `outcome`. `dependencies` are the `(children counts, last rank)` of the compute plans by
+    key, for the priority of the task.
+    """
+    key = asset['key']
+    status = asset['status']
+
+    if tx_status != 'VALID':
+        logger.error(
+            f'Failed transaction on task {key}: type={event_type}'
+            f' status={status} with tx status: {tx_status}')
+        return INVALID_TRANSACTION, None
+
+    logger.info(f'Processing task {key}: type={event_type} status={status}')
+
+    if status != 'todo':
+        return SKIPPED_STATUS, None
+
+    if event_type is None:
+        return SKIPPED_STATUS, None
+
+    tuple_owner = tuple_get_worker(event_type, asset)
+
+    if tuple_owner != owner:
+        logger.info(f'Skipping task {key}: owner does not match'
+                    f' ({tuple_owner} vs {owner})')
+        return SKIPPED_NOT_OWNER, None
+
+    children_count, last_rank = 0, 0
+    if dependencies and asset.get('compute_plan_key') in dependencies:
+        children_counts, last_rank = dependencies[asset['compute_plan_key']]
+        children_count = children_counts[key]
+    priority = task_priority.get_tuple_priority(event_type, asset, children_count, last_rank)
+    return None, (key, prepare_tuple.signature((channel_name, asset, event_type, priority), priority=priority))
+
+
+def get_compute_plan_task(channel_name, tx_id, tx_status, asset):
+    """Return `(outcome, task)` for a compute plan event, as `get_tuple_task`."""
+    key = asset['compute_plan_key']
+
+    # Currently, we received this event on done, failed and canceled status
+    # We apply the same behavior for those three status.
+    # In the future, we can apply a conditional strategy based on the status.
+    status = asset['status']
+
+    if tx_status != 'VALID':
+        logger.error(
+            f'Failed transaction on cleaning task {key}: type=computePlan'
+            f' status={status} with tx status: {tx_status}')
+        return INVALID_TRANSACTION, None
+
+    logger.info(f'Processing cleaning task {key}: type=computePlan status={status}')
+
+    return None, (f'{key}_{tx_id}', on_compute_plan.signature((channel_name, asset, )))
+
+
+def get_prefetch_request(owner, tx_status, event_type, asset):
+    """Return `(compute_plan_key, request)` to prefetch the inputs of a tuple event, None if there are none.
+
+    The inputs of the waiting or todo tuples of the node are prefetched, and the out models of the done
+    training tuples, inputs of the next round.
+    """
+    compute_plan_key = asset.get('compute_plan_key')
+    if tx_status != 'VALID' or not compute_plan_key or event_type is None:
+        return None
+
+    status = asset['status']
+    if status in ('waiting', 'todo') and tuple_get_worker(event_type, asset) == owner:
+        return compute_plan_key, {'tuple_type': event_type, 'tuple': asset}
+    if status == 'done' and event_type in task_priority.TRAINING_TUPLE_TYPES:
+        return compute_plan_key, {'model': asset['key']}
+    return None
+
+
+def get_tasks(channel_name, events, stats=None, prefetch=None):
+    """Return the tasks of the chaincode `events` of a block, as `(event_type, signature)` by task id.
+
+    `events` are the chaincode events as passed by fabric-sdk-py with `as_array`. The outcome of the
+    assets without task is added to `stats`, their prefetch requests to `prefetch` if set.
+    """
+    stats = stats if stats is not None else DispatchStats()
+    owner = get_owner()
+    tasks = {}
+
+    payloads = [json.loads(event['chaincode_event']['payload']) for event in events]
+    dependencies = None
+    if task_priority.is_enabled():
+        # the children of a tuple may be created in the same block
+        dependencies = task_priority.record_plan_dependencies(channel_name, [
+            (event_type, asset)
+            for event, payload in zip(events, payloads) if event['tx_status'] == 'VALID'
+            for event_type, assets in payload.items() if event_type in task_priority.TRAINING_TUPLE_TYPES
+            for asset in assets or [] if asset.get('compute_plan_key')
+        ])
+
+    for event, payload in zip(events, payloads):
+        for event_type, assets in payload.items():
+            if not assets:
+                continue
+
+            for asset in assets:
+                ts = time.time()
+                events_metrics.EVENTS_PROCESSED.labels(channel=channel_name, event_type=event_type).inc()
+
+                if event_type == 'compute_plan':
+                    outcome, task = get_compute_plan_task(channel_name, event['tx_id'], event['tx_status'], asset)
+                else:
+                    outcome, task = get_tuple_task(channel_name, owner, event['tx_status'], event_type, asset,
+                                                   dependencies)
+                    if prefetch is not None:
+                        request = get_prefetch_request(owner, event['tx_status'], event_type, asset)
+                        if request is not None:
+                            prefetch.append(request)
+
+                if task is not None:
+                    task_id, signature = task
+                    # the first event of a block wins, as with one task per event
+                    if task_id in tasks:
+                        outcome = SKIPPED_DUPLICATE
+                    else:
+                        tasks[task_id] = (event_type, signature)
+
+                stats.durations[event_type] += time.time() - ts
+                if outcome is not None:
+                    stats.add(event_type, outcome)
+
+    return tasks
+
+
+def get_existing_task_ids(task_ids):
+    """Return the task ids which already have a state in the result backend (i.e. are not PENDING)."""
+    if not task_ids:
+        return set()
+
+    from django_celery_results.backends import DatabaseBackend
+    from django_celery_results.models import TaskResult
+
+    if isinstance(app.backend, DatabaseBackend):
+        return set(TaskResult.objects.filter(task_id__in=task_ids).values_list('task_id', flat=True))
+
+    return {task_id for task_id in task_ids if AsyncResult(task_id).state != 'PENDING'}
+
+
+def publish(tasks, stats=None):
+    """Publish the `tasks` (by task id) on the worker queue of the node, on a single broker connection."""
+    stats = stats if stats is not None else DispatchStats()
+    worker_queue = f"{settings.ORG_NAME}.worker"
+    with app.producer_or_acquire() as producer:
+        for task_id, (event_type, signature) in tasks.items():
+            ts = time.time()
+            signature.apply_async(task_id=task_id, queue=worker_queue, producer=producer)
+            stats.add(event_type, ENQUEUED, time.time() - ts)
+
+
+def publish_prefetch(channel_name, prefetch):
+    """Send the `prefetch` requests of a block to the worker of their compute plan.
+
+    The requests of the compute plans without a tuple started on the node yet go to all the compute workers, except
+    for the models: the node may not take part in the next round.
+    """
+    from substrapp.models import ComputePlanWorker
+
+    compute_plan_keys = {compute_plan_key for compute_plan_key, _ in prefetch}
+    workers = dict(ComputePlanWorker.objects
+                   .filter(compute_plan_key__in=compute_plan_keys)
+                   .values_list('compute_plan_key', 'worker'))
+
+    requests = collections.defaultdict(list)
+    for compute_plan_key, request in prefetch:
+        worker = workers.get(compute_plan_key)
+        if worker is None and 'model' in request:
+            continue
+        requests[worker].append(request)
+
+    for worker, worker_requests in requests.items():
+        try:
+            request_prefetch(channel_name, worker_requests, worker)
+        except Exception as e:
+            # the tuples download their inputs themselves
+            logger.warning(f'Cannot request the prefetch of {len(worker_requests)} inputs: {e}')
+            continue
+        for request in worker_requests:
+            kind = 'model' if 'model' in request else 'tuple'
+            events_metrics.PREFETCH_REQUESTS.labels(channel=channel_name, kind=kind).inc()
+
+
+def dispatch_events(channel_name, events):
+    """Publish the new tasks of the chaincode events of a block. Return the DispatchStats of the block."""
+    stats = DispatchStats()
+    if not events:
+        return stats
+
+    ts = time.time()
+    block_number = events[0]['block_num']
+
+    prefetch = [] if asset_cache.is_enabled() else None
+    tasks = get_tasks(channel_name, events, stats, prefetch)
+    existing_task_ids = get_existing_task_ids(list(tasks))
+    new_tasks = {}
+    for task_id, (event_type, signature) in tasks.items():
+        if task_id in existing_task_ids:
+            logger.info(f'Skipping task {task_id}: already exists. Info: block_number={block_number}')
+            stats.add(event_type, SKIPPED_EXISTING)
+        else:
+            new_tasks[task_id] = (event_type, signature)
+    publish(new_tasks, stats)
+    if prefetch:
+        publish_prefetch(channel_name, prefetch)
+
+    stats.duration = time.time() - ts
+    stats.observe(channel_name)
+    logger.info(f'Block {block_number} of {channel_name}: {len(events)} events, {len(new_tasks)} tasks published'
+                f' in {stats.duration * 1000:.2f} ms ({len(events) / max(stats.duration, 1e-6):.0f} events/s)')
+    return stats
@@ -0,0 +1,128 @@
+"""Bounded queue between the reception of the chaincode events of a channel and their dispatch.
+
+The events of a block are put in the queue by the channel event hub callback and dispatched by worker
+coroutines, so a slow broker or result backend does not stall the gRPC stream. When the queue is full,
+the stream of the channel is not read until a block is dispatched (backpressure): the peer waits
+instead of the connection timing out.
+
+If a spill directory is configured (LEDGER_EVENTS_QUEUE_SPILL_DIR), the blocks exceeding the size of
+the queue are written to a temporary file instead, and read back in order. The spill file does not
+survive the process: after a restart, the blocks are replayed from the events checkpoint.
+"""
+import asyncio
+import collections
+import logging
+import os
+import pickle
+import tempfile
+import time
+
+from events import metrics as events_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SpillFile(object):
+    """FIFO of pickled items in an anonymous temporary file."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.read_position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, item):
+        self.file.seek(0, os.SEEK_END)
+        pickle.dump(item, self.file)
+        self.size += 1
+
+    def popleft(self):
+        self.file.seek(self.read_position)
+        item = pickle.load(self.file)
+        self.read_position = self.file.tell()
+        self.size -= 1
+        if not self.size:
+            # reuse the disk space once drained
+            self.file.seek(0)
+            self.file.truncate()
+            self.read_position = 0
+        return item
+
+    def close(self):
+        self.file.close()
+
+
+class DispatchQueue(object):
+    """Queue of the blocks of a channel to dispatch, bounded to `maxsize` blocks in memory.
+
+    Must only be used from the event loop of the events service.
+    """
+
+    def __init__(self, channel_name, maxsize, spill_dir=None):
+        self.channel_name = channel_name
+        self.maxsize = maxsize
+        self.items = collections.deque()
+        self.spill = SpillFile(spill_dir) if spill_dir else None
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+
+    def qsize(self):
+        return len(self.items) + (len(self.spill) if self.spill else 0)
+
+    def full(self):
+        # with a spill file, the queue only fills up the disk
+        return self.spill is None and len(self.items) >= self.maxsize
+
+    def put_nowait(self, item):
+        # once spilled, the items go through the spill file to keep their order
+        if self.spill is not None and (len(self.spill) or len(self.items) >= self.maxsize):
+            self.spill.append(item)
+            events_metrics.QUEUE_SPILLED.labels(channel=self.channel_name).inc()
+        else:
+            self.items.append(item)
+        self._update()
+
+    async def get(self):
+        while not self.items:
+            await self.not_empty.wait()
+        item = self.items.popleft()
+        while self.spill and len(self.items) < self.maxsize:
+            self.items.append(self.spill.popleft())
+        self._update()
+        return item
+
+    async def wait_not_full(self):
+        """Wait until the queue can take an item, return the time waited."""
+        if not self.full():
+            return 0
+        ts = time.time()
+        logger.warning(f'Events queue of {self.channel_name} full ({self.qsize()} blocks): pausing the stream')
+        await self.not_full.wait()
+        elaps = time.time() - ts
+        events_metrics.QUEUE_BACKPRESSURE.labels(channel=self.channel_name).inc(elaps)
+        return elaps
+
+    async def throttle(self, stream):
+        """Iterate over `stream`, without reading the next message while the queue is full."""
+        async for message in stream:
+            yield message
+            await self.wait_not_full()
+
+    def _update(self):
+        if self.items:
+            self.not_empty.set()
+        else:
+            self.not_empty.clear()
+        if self.full():
+            self.not_full.clear()
+        else:
+            self.not_full.set()
+        events_metrics.QUEUE_SIZE.labels(channel=self.channel_name).set(self.qsize())
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
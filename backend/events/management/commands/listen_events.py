@@ -0,0 +1,32 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from events.server import start_events_server
+from events.service import EventsService
+
+
+class Command(BaseCommand):
+    help = 'Listen to the events of the channels of the node and dispatch their tasks to the workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--channel', action='append', dest='channels',
+                            help='Channel to listen to, all the channels of the node by default. Can be repeated.')
+        parser.add_argument('--port', type=int, default=settings.EVENTS_SERVER_PORT,
+                            help='Port of the health and metrics endpoints.')
+
+    def handle(self, *args, **options):
+        # the gRPC channel of the peer is bound to the event loop of its creation
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            service = EventsService(options['channels'])
+            service.create_listeners()
+
+            start_events_server(service, options['port'])
+            self.stdout.write(f'Listening to the events of {", ".join(service.channel_names)}')
+
+            loop.run_until_complete(service.run())
+        finally:
+            loop.close()
@@ -0,0 +1,116 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Gauges of the events process only, see libs.metrics for the multiprocess mode
+CHECKPOINT_BLOCK = Gauge(
+    'events_checkpoint_block',
+    'Last block whose events have been processed',
+    ['channel'],
+    multiprocess_mode='max',
+)
+
+LAG_BLOCKS = Gauge(
+    'events_lag_blocks',
+    'Blocks between the last block received from the peer (or the ledger height on connection) and the checkpoint',
+    ['channel'],
+    multiprocess_mode='liveall',
+)
+
+EVENTS_PROCESSED = Counter(
+    'events_processed_total',
+    'Assets of the chaincode events processed, by event type',
+    ['channel', 'event_type'],
+)
+
+CHANNEL_CONNECTED = Gauge(
+    'events_channel_connected',
+    'Whether the channel event hub is connected and receiving blocks',
+    ['channel'],
+    multiprocess_mode='liveall',
+)
+
+RECONNECTIONS = Counter(
+    'events_reconnections_total',
+    'Reconnections to the channel event hub after a failure',
+    ['channel'],
+)
+
+QUEUE_SIZE = Gauge(
+    'events_queue_blocks',
+    'Blocks with chaincode events waiting to be dispatched, spilled ones included',
+    ['channel'],
+    multiprocess_mode='liveall',
+)
+
+QUEUE_SPILLED = Counter(
+    'events_queue_spilled_total',
+    'Blocks written to the spill file of the dispatch queue',
+    ['channel'],
+)
+
+QUEUE_BACKPRESSURE = Counter(
+    'events_queue_backpressure_seconds_total',
+    'Time the stream of the channel event hub was not read because the dispatch queue was full',
+    ['channel'],
+)
+
+QUEUE_WAIT = Histogram(
+    'events_queue_wait_seconds',
+    'Time spent by the blocks in the dispatch queue',
+    ['channel'],
+    buckets=LATENCY_BUCKETS,
+)
+
+DISPATCH_ERRORS = Counter(
+    'events_dispatch_errors_total',
+    'Failed dispatches of the chaincode events of a block, retried',
+    ['channel'],
+)
+
+BLOCK_NUMBER = Gauge(
+    'events_block_number',
+    'Last block received from the channel event hub',
+    ['channel'],
+    multiprocess_mode='max',
+)
+
+BLOCK_TIMESTAMP = Gauge(
+    'events_block_timestamp_seconds',
+    'Timestamp of the last block received from the channel event hub (of its first transaction)',
+    ['channel'],
+    multiprocess_mode='max',
+)
+
+DISPATCH_LATENCY = Histogram(
+    'events_dispatch_latency_seconds',
+    'Time from the timestamp of a block to the tasks of its events being published',
+    ['channel'],
+    buckets=LATENCY_BUCKETS,
+)
+
+BLOCK_DURATION = Histogram(
+    'events_block_processing_seconds',
+    'Processing time of the chaincode events of a block, until its tasks are published',
+    ['channel'],
+    buckets=LATENCY_BUCKETS,
+)
+
+EVENT_TYPE_DURATION = Histogram(
+    'events_event_type_processing_seconds',
+    'Processing time of the assets of a block, by event type',
+    ['channel', 'event_type'],
+    buckets=LATENCY_BUCKETS,
+)
+
+DISPATCH_OUTCOMES = Counter(
+    'events_dispatch_outcomes_total',
+    'Assets of the chaincode events by dispatch outcome (enqueued, skipped, ...), see events.dispatch',
+    ['channel', 'event_type', 'outcome'],
+)
+
+PREFETCH_REQUESTS = Counter(
+    'events_prefetch_requests_total',
+    'Requests to the workers to prefetch the inputs of a tuple or a model, see substrapp.tasks.prefetch',
+    ['channel', 'kind'],
+)
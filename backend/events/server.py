@@ -0,0 +1,61 @@
+"""HTTP server of the events service, for its probes and the scraping of its metrics.
+
+- /health: state of the listener of each channel, 503 if a channel event hub is not connected
+- /status: lag, last dispatch and dispatch outcomes of each channel
+- /metrics: prometheus metrics of the service, if METRICS_ENABLED
+"""
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from django.conf import settings
+
+from libs.metrics import generate_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class EventsRequestHandler(BaseHTTPRequestHandler):
+
+    service = None
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+
+        if path == '/health':
+            health = self.service.get_health()
+            status = 200 if health['healthy'] else 503
+            self.send_content(status, json.dumps(health).encode(), 'application/json')
+        elif path == '/status':
+            self.send_content(200, json.dumps(self.service.get_status()).encode(), 'application/json')
+        elif path == '/metrics' and settings.METRICS_ENABLED:
+            content, content_type = generate_metrics()
+            self.send_content(200, content, content_type)
+        else:
+            self.send_content(404, b'', 'text/plain')
+
+    def send_content(self, status, content, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # probes and scrapes would flood the logs
+        logger.debug(format, *args)
+
+
+class EventsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_events_server(service, port):
+    """Serve the health, the status and the metrics of `service` on `port` from a daemon thread."""
+    handler = type('Handler', (EventsRequestHandler, ), {'service': service})
+    server = EventsServer(('', port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
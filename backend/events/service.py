@@ -0,0 +1,414 @@
+"""Events service: a single process listening to the events of all the channels of the node.
+
+Every channel has its own listener on the event loop of the service, sharing the client, the peer and its
+gRPC channel. When the stream of a channel fails, its listener reconnects with an exponential backoff,
+without affecting the other channels. The state of the listeners is reported by `EventsService.get_health`.
+
+The chaincode events of a block are dispatched by a worker coroutine of the listener, through a bounded
+queue (see events.dispatch_queue). The blocks of a channel are dispatched one at a time, in order: the
+tasks of a block (e.g. `prepare_tuple`) are published before the ones of the next block (e.g.
+`on_compute_plan`). The checkpoint of a channel is the last block before the first one still to dispatch.
+
+The database work of the blocks (ledger cache invalidation, checkpoint, ledger mirror) is done by threads,
+not to block the loop shared by the listeners.
+"""
+import asyncio
+import collections
+import datetime
+import glob
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django import db
+from django.conf import settings
+
+from hfc.fabric import Client
+from hfc.fabric.peer import Peer
+from hfc.fabric.user import create_user
+from hfc.util.keyvaluestore import FileKeyValueStore
+
+from substrapp.ledger import cache as ledger_cache
+from substrapp.ledger import indexer as ledger_indexer
+from substrapp.ledger import mirror as ledger_mirror
+from substrapp.ledger.connection import ledger_grpc_options
+from substrapp.ledger.debug_tools import get_ledger_height
+
+from events import metrics as events_metrics
+from events.checkpoint import ChannelCheckpoint
+from events.dispatch import OUTCOMES, dispatch_events
+from events.dispatch_queue import DispatchQueue
+
+logger = logging.getLogger(__name__)
+
+LEDGER_HEIGHT_TIMEOUT_SECONDS = 10
+# attempts to apply a block to the ledger mirror
+MIRROR_BLOCK_ATTEMPTS = 5
+
+
+def get_block_timestamp(block):
+    """Return the timestamp of `block`, as decoded by fabric-sdk-py, None if unknown.
+
+    Fabric blocks have no timestamp of their own: this is the one of their first transaction.
+    """
+    try:
+        timestamp = block['data']['data'][0]['payload']['header']['channel_header']['timestamp']
+        date = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    return date.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _invalidate_block(channel_name, block):
+    # the thread of the executor keeps its database connection between blocks
+    db.close_old_connections()
+    ledger_cache.invalidate_block(channel_name, block)
+
+
+def _apply_block(channel_name, block):
+    block_number = block['header']['number']
+    backoff = Backoff(settings.LEDGER_EVENTS_RECONNECT_MIN_SECONDS, settings.LEDGER_EVENTS_RECONNECT_MAX_SECONDS)
+    for attempt in range(1, MIRROR_BLOCK_ATTEMPTS + 1):
+        # the thread of the executor keeps its database connection between blocks
+        db.close_old_connections()
+        try:
+            ledger_indexer.apply_block(channel_name, block)
+            return
+        except Exception as e:
+            logger.exception(f'Ledger mirror of {channel_name} failed on block {block_number}'
+                             f' (attempt {attempt}/{MIRROR_BLOCK_ATTEMPTS}): {e}')
+        if attempt < MIRROR_BLOCK_ATTEMPTS:
+            # the next blocks wait: they are applied in order
+            time.sleep(backoff.next())
+    # the mirror is indexed again on the next block, which does not follow the last block applied
+    logger.error(f'Ledger mirror of {channel_name} skipped block {block_number}')
+
+
+def _set_mirror_head(channel_name, head_block_number):
+    db.close_old_connections()
+    try:
+        ledger_mirror.set_head(channel_name, head_block_number)
+    except Exception as e:
+        logger.exception(f'Cannot record the head of the ledger mirror of {channel_name}: {e}')
+
+
+def _dispatch_events(channel_name, events):
+    # the threads of the executor keep their database connection between blocks
+    db.close_old_connections()
+    return dispatch_events(channel_name, events)
+
+
+class Backoff(object):
+    """Exponential backoff with jitter, between `base` and `maximum` seconds."""
+
+    def __init__(self, base, maximum):
+        self.base = base
+        self.maximum = maximum
+        self.attempts = 0
+
+    def next(self):
+        delay = min(self.maximum, self.base * 2 ** self.attempts)
+        self.attempts += 1
+        # listeners failing together (e.g. on a peer restart) do not reconnect together
+        return delay * random.uniform(0.5, 1)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class ChannelListener(object):
+    """Listener of the events of one channel."""
+
+    def __init__(self, channel_name, channel, peer, requestor):
+        self.channel_name = channel_name
+        self.channel = channel
+        self.peer = peer
+        self.requestor = requestor
+
+        self.checkpoint = ChannelCheckpoint(self.channel_name)
+        self.queue = None
+        # cache invalidations and checkpoints, in the order of the blocks
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'events-{channel_name}')
+        # the blocks are applied to the ledger mirror in order, by a single thread: the initial index and
+        # the queries of the written assets do not block the loop
+        self.mirror_executor = None
+        # blocks put in the queue and not dispatched yet
+        self.pending = collections.Counter()
+        self.backoff = Backoff(settings.LEDGER_EVENTS_RECONNECT_MIN_SECONDS,
+                               settings.LEDGER_EVENTS_RECONNECT_MAX_SECONDS)
+
+        self.connected = False
+        self.last_block = None
+        self.last_block_at = None
+        self.last_block_timestamp = None
+        self.last_dispatch = None
+        self.outcomes = collections.Counter()
+        self.last_error = None
+        self.reconnections = 0
+
+    def on_channel_events(self, events):
+        block_number = events[0]['block_num']
+        self.pending[block_number] += 1
+        self.queue.put_nowait((block_number, events, time.time(), self.last_block_timestamp))
+
+    def on_channel_block(self, block):
+        block_number = block['header']['number']
+
+        if not self.connected:
+            logger.info(f'Connected to Channel Event Hub ({self.channel_name})')
+            self.connected = True
+            self.backoff.reset()
+            events_metrics.CHANNEL_CONNECTED.labels(channel=self.channel_name).set(1)
+        self.last_block = block_number
+        self.last_block_at = time.time()
+        self.last_block_timestamp = get_block_timestamp(block)
+        events_metrics.BLOCK_NUMBER.labels(channel=self.channel_name).set(block_number)
+        if self.last_block_timestamp is not None:
+            events_metrics.BLOCK_TIMESTAMP.labels(channel=self.channel_name).set(self.last_block_timestamp)
+
+        self.checkpoint.set_head(block_number)
+
+        self.executor.submit(_invalidate_block, self.channel_name, block)
+        if ledger_mirror.is_enabled():
+            if self.mirror_executor is None:
+                self.mirror_executor = ThreadPoolExecutor(max_workers=1,
+                                                          thread_name_prefix=f'mirror-{self.channel_name}')
+            self.mirror_executor.submit(_apply_block, self.channel_name, block)
+            # not by the mirror thread: a mirror stuck on a block falls behind the head
+            self.executor.submit(_set_mirror_head, self.channel_name, self.checkpoint.head)
+
+        # the chaincode events of a block are processed after its block event: the previous block is done,
+        # even if it had no chaincode events
+        self.save_checkpoint(block_number - 1)
+
+    def save_checkpoint(self, block_number):
+        """Save `block_number` as checkpoint, or the block before the first one still to dispatch."""
+        if self.pending:
+            block_number = min(block_number, min(self.pending) - 1)
+        if block_number < 0:
+            return
+        self.executor.submit(self._save_checkpoint, block_number)
+
+    def _get_start_block(self):
+        db.close_old_connections()
+        return self.checkpoint.get_start_block()
+
+    def _save_checkpoint(self, block_number):
+        db.close_old_connections()
+        try:
+            self.checkpoint.save(block_number)
+        except Exception as e:
+            logger.exception(f'Cannot save the events checkpoint of {self.channel_name}: {e}')
+
+    async def dispatch_worker(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            block_number, events, received_at, block_timestamp = await self.queue.get()
+            events_metrics.QUEUE_WAIT.labels(channel=self.channel_name).observe(time.time() - received_at)
+
+            # a failed dispatch (e.g. broker unavailable) is retried: meanwhile the queue fills up and the
+            # stream is paused
+            backoff = Backoff(settings.LEDGER_EVENTS_RECONNECT_MIN_SECONDS,
+                              settings.LEDGER_EVENTS_RECONNECT_MAX_SECONDS)
+            while True:
+                try:
+                    stats = await loop.run_in_executor(None, _dispatch_events, self.channel_name, events)
+                except Exception as e:
+                    delay = backoff.next()
+                    events_metrics.DISPATCH_ERRORS.labels(channel=self.channel_name).inc()
+                    logger.exception(f'Dispatch of block {block_number} of {self.channel_name} failed: {e},'
+                                     f' retrying in {delay:.1f}s')
+                    await asyncio.sleep(delay)
+                else:
+                    break
+
+            self.on_block_dispatched(block_number, block_timestamp, stats)
+            self.pending[block_number] -= 1
+            if not self.pending[block_number]:
+                del self.pending[block_number]
+            self.save_checkpoint(self.last_block)
+
+    def on_block_dispatched(self, block_number, block_timestamp, stats):
+        dispatched_at = time.time()
+        latency = None
+        if block_timestamp is not None:
+            latency = max(0, dispatched_at - block_timestamp)
+            events_metrics.DISPATCH_LATENCY.labels(channel=self.channel_name).observe(latency)
+
+        self.outcomes.update({outcome: stats.count(outcome) for outcome in OUTCOMES})
+        self.last_dispatch = {
+            'block': block_number,
+            'block_timestamp': block_timestamp,
+            'dispatched_at': dispatched_at,
+            'latency': latency,
+            **stats.as_dict(),
+        }
+
+    def on_disconnected(self, error):
+        self.connected = False
+        self.last_error = error
+        self.reconnections += 1
+        events_metrics.CHANNEL_CONNECTED.labels(channel=self.channel_name).set(0)
+        events_metrics.RECONNECTIONS.labels(channel=self.channel_name).inc()
+
+    async def update_head(self):
+        """Query the last block of the ledger, return whether it succeeded."""
+        try:
+            # queried from a thread: the loop is shared by the listeners of all the channels
+            height = await asyncio.wait_for(
+                asyncio.get_event_loop().run_in_executor(
+                    None, get_ledger_height, self.channel_name, LEDGER_HEIGHT_TIMEOUT_SECONDS),
+                LEDGER_HEIGHT_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.warning(f'Cannot get the ledger height of {self.channel_name}: {e}')
+            return False
+        self.checkpoint.set_head(height - 1)
+        return True
+
+    async def mirror_heartbeat(self):
+        # the ledger mirror is used while its head is reported, even when no block is committed
+        while True:
+            await asyncio.sleep(ledger_mirror.get_max_lag_seconds() / 3)
+            if await self.update_head():
+                self.executor.submit(_set_mirror_head, self.channel_name, self.checkpoint.head)
+
+    async def listen(self):
+        channel_event_hub = self.channel.newChannelEventHub(self.peer, self.requestor)
+
+        # Replay the blocks from the checkpoint if the channel event hub was disconnected during
+        # events emission
+        # read from a thread, as the ledger height: the loop is shared by the listeners of all the channels
+        start = await asyncio.get_event_loop().run_in_executor(self.executor, self._get_start_block)
+        await self.update_head()
+
+        # the stream is read through the dispatch queue, for its backpressure, instead of by the coroutine
+        # returned by connect
+        channel_event_hub.connect(start=start, filtered=False).close()
+
+        # all the chaincode events of a block at once
+        channel_event_hub.registerChaincodeEvent(
+            settings.LEDGER_CHANNELS[self.channel_name]['chaincode']['name'],
+            'chaincode-updates',
+            as_array=True,
+            onEvent=self.on_channel_events)
+
+        # every committed invoke, including from other nodes, invalidates the ledger cache
+        channel_event_hub.registerBlockEvent(
+            unregister=False,
+            onEvent=self.on_channel_block)
+
+        logger.info(f'Connect to Channel Event Hub ({self.channel_name}) from block {start}')
+        await channel_event_hub.handle_stream(self.queue.throttle(channel_event_hub.stream))
+
+    async def run(self):
+        self.queue = DispatchQueue(self.channel_name, settings.LEDGER_EVENTS_QUEUE_MAX_SIZE,
+                                   settings.LEDGER_EVENTS_QUEUE_SPILL_DIR or None)
+        # a single worker: the blocks are dispatched in order
+        worker = asyncio.ensure_future(self.dispatch_worker())
+        heartbeat = asyncio.ensure_future(self.mirror_heartbeat()) if ledger_mirror.is_enabled() else None
+
+        try:
+            # grpc may close the stream of the channel event hub at any time: reconnect until the service stops
+            while True:
+                try:
+                    await self.listen()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    error = f'{type(e).__name__}: {e}'
+                else:
+                    error = 'stream closed'
+
+                self.on_disconnected(error)
+                delay = self.backoff.next()
+                logger.error(f'Channel Event Hub failed for {self.channel_name} ({error}):'
+                             f' re-connecting in {delay:.1f}s')
+                await asyncio.sleep(delay)
+        finally:
+            worker.cancel()
+            if heartbeat is not None:
+                heartbeat.cancel()
+            self.queue.close()
+            self.executor.shutdown(wait=False)
+            if self.mirror_executor is not None:
+                self.mirror_executor.shutdown(wait=False)
+                self.mirror_executor = None
+
+    def get_health(self):
+        return {
+            'connected': self.connected,
+            'last_block': self.last_block,
+            'last_block_at': self.last_block_at,
+            'checkpoint': self.checkpoint.block_number,
+            'queued_blocks': self.queue.qsize() if self.queue is not None else 0,
+            'last_error': self.last_error,
+            'reconnections': self.reconnections,
+        }
+
+    def get_status(self):
+        head = self.checkpoint.head
+        checkpoint = self.checkpoint.block_number
+        # called from the threads of the HTTP server: copied in one step
+        pending = list(self.pending)
+        outcomes = dict(self.outcomes)
+        return {
+            **self.get_health(),
+            'head': head,
+            'lag_blocks': max(0, head - checkpoint) if head is not None and checkpoint is not None else None,
+            'last_block_timestamp': self.last_block_timestamp,
+            'pending_blocks': sorted(pending),
+            'last_dispatch': self.last_dispatch,
+            'outcomes': {outcome: n for outcome, n in outcomes.items() if n},
+        }
+
+
+class EventsService(object):
+    """Listeners of the events of all the channels, on a single event loop."""
+
+    def __init__(self, channel_names=None):
+        self.channel_names = list(channel_names or settings.LEDGER_CHANNELS)
+        self.listeners = {}
+
+    def create_listeners(self):
+        client = Client()
+
+        peer = Peer(name=settings.LEDGER_PEER_NAME)
+        peer.init_with_bundle({
+            'url': f'{settings.LEDGER_PEER_HOST}:{settings.LEDGER_PEER_PORT}',
+            'grpcOptions': ledger_grpc_options(settings.LEDGER_PEER_HOST),
+            'tlsCACerts': {'path': settings.LEDGER_PEER_TLS_CA_CERTS},
+            'clientKey': {'path': settings.LEDGER_PEER_TLS_CLIENT_KEY},
+            'clientCert': {'path': settings.LEDGER_PEER_TLS_CLIENT_CERT},
+        })
+
+        requestor = create_user(
+            name=f'{settings.LEDGER_USER_NAME}_events',
+            org=settings.ORG_NAME,
+            state_store=FileKeyValueStore(settings.LEDGER_CLIENT_STATE_STORE),
+            msp_id=settings.LEDGER_MSP_ID,
+            key_path=glob.glob(settings.LEDGER_CLIENT_KEY_PATH)[0],
+            cert_path=settings.LEDGER_CLIENT_CERT_PATH
+        )
+
+        for channel_name in self.channel_names:
+            channel = client.new_channel(channel_name)
+            self.listeners[channel_name] = ChannelListener(channel_name, channel, peer, requestor)
+
+    async def run(self):
+        if not self.listeners:
+            self.create_listeners()
+        await asyncio.gather(*(listener.run() for listener in self.listeners.values()))
+
+    def get_health(self):
+        channels = {name: listener.get_health() for name, listener in self.listeners.items()}
+        return {
+            'healthy': bool(channels) and all(channel['connected'] for channel in channels.values()),
+            'channels': channels,
+        }
+
+    def get_status(self):
+        return {
+            **self.get_health(),
+            'channels': {name: listener.get_status() for name, listener in self.listeners.items()},
+        }
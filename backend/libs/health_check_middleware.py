@@ -1,6 +1,6 @@
 from django.conf import settings
 from django.http import HttpResponse
-from substrapp.ledger.connection import get_hfc
+from substrapp.ledger.connection import get_connection
 
 
 class HealthCheckMiddleware(object):
@@ -34,7 +34,7 @@ class HealthCheckMiddleware(object):
 def validate_channels():
     # Check ledger connection for each channel
     for channel_name, channel in settings.LEDGER_CHANNELS.items():
-        with get_hfc(channel_name) as (loop, client, user):
-            # if channel_name starts with 'solo-' channel name is include channel['restricted']
-            # get_hfc will throw if the solo channel has more than 1 member
-            pass
+        # if channel_name starts with 'solo-' channel name is include channel['restricted']
+        # get_connection will throw if the solo channel has more than 1 member
+        connection = get_connection(channel_name)
+        connection.check()
@@ -0,0 +1,40 @@
+"""Prometheus metrics exposition.
+
+uwsgi and celery run several processes. When the `prometheus_multiproc_dir` environment variable is set,
+each process writes its metrics in this directory and every scrape aggregates all of them. The directory
+must be emptied when the server or the worker (re)starts.
+"""
+import os
+
+from prometheus_client import CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, start_http_server
+from prometheus_client import multiprocess
+
+MULTIPROCESS_DIR_ENV = 'prometheus_multiproc_dir'
+
+
+def is_multiprocess():
+    return bool(os.environ.get(MULTIPROCESS_DIR_ENV))
+
+
+def get_registry():
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def generate_metrics():
+    """Return `(content, content_type)` of the metrics of the current process, or of all of them."""
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port):
+    """Serve the metrics on `port` from a daemon thread, for processes without an HTTP server."""
+    start_http_server(port, registry=get_registry())
+
+
+def mark_process_dead(pid):
+    """Remove the live metrics (gauges) of a stopped process."""
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
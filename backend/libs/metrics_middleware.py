@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.http import HttpResponse
+
+from libs.metrics import generate_metrics
+
+
+class MetricsMiddleware(object):
+    """Serve the Prometheus metrics on /metrics, before authentication."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method == "GET" and request.path == "/metrics" and settings.METRICS_ENABLED:
+            return self.metrics(request)
+        return self.get_response(request)
+
+    def metrics(self, request):
+        content, content_type = generate_metrics()
+        return HttpResponse(content, content_type=content_type)
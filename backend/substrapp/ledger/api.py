@@ -1,3 +1,6 @@
+import asyncio
+import contextlib
+import copy
 import functools
 import json
 import logging
@@ -6,16 +9,28 @@ import time
 from uuid import UUID
 from django.conf import settings
 from grpc import RpcError
-from substrapp.ledger.connection import get_hfc
+from substrapp.ledger import cache as ledger_cache
+from substrapp.ledger import locks as ledger_locks
+from substrapp.ledger import metrics as ledger_metrics
+from substrapp.ledger import mirror as ledger_mirror
+from substrapp.ledger import retry
+from substrapp.ledger.commit_tracker import invoke_and_wait
+from substrapp.ledger.connection import get_connection, get_current_connection, invalidate_discovery
 from substrapp.ledger.exceptions import (raise_for_status, LedgerForbidden, LedgerTimeout, LedgerMVCCError,
                                          LedgerInvalidResponse, LedgerUnavailable, LedgerPhantomReadConflictError,
                                          LedgerEndorsementPolicyFailure, LedgerStatusError, LedgerError,
                                          LedgerAssetNotFound)
+from substrapp.ledger.peer_selection import get_peer_selector
 
 logger = logging.getLogger(__name__)
 
 
 def retry_on_error(delay=1, nbtries=15, backoff=2, exceptions=None):
+    """Retry the decorated function on ledger errors, see `substrapp.ledger.retry` for the policy.
+
+    The n-th retry waits a random delay between 0 and `delay * backoff ** (n - 1)` seconds
+    (capped by LEDGER_RETRY_MAX_DELAY_SECONDS). `nbtries` is the maximum number of calls.
+    """
     exceptions = exceptions or []
     exceptions_to_retry = [
         LedgerMVCCError,
@@ -32,37 +47,63 @@ def retry_on_error(delay=1, nbtries=15, backoff=2, exceptions=None):
     exceptions_to_retry = tuple(exceptions_to_retry)
 
     def _retry(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def _async_wrapper(*args, **kwargs):
+                if not settings.LEDGER_CALL_RETRY:
+                    return await fn(*args, **kwargs)
+
+                attempt = 0
+                while True:
+                    attempt += 1
+                    try:
+                        response = await fn(*args, **kwargs)
+                    except exceptions_to_retry as e:
+                        if not retry.decide(fn.__name__, e, attempt, nbtries):
+                            raise
+                        _delay = retry.get_backoff_delay(attempt, delay, backoff)
+                        logger.warning(f'Function {fn.__name__} failed ({type(e)}): {e} retrying in {_delay:.2f}s')
+                        await asyncio.sleep(_delay)
+                    else:
+                        retry.on_success()
+                        return response
+
+            return _async_wrapper
+
         @functools.wraps(fn)
         def _wrapper(*args, **kwargs):
             if not settings.LEDGER_CALL_RETRY:
                 return fn(*args, **kwargs)
 
-            _delay = delay
-            _nbtries = nbtries
-            _backoff = backoff
-
+            attempt = 0
             while True:
+                attempt += 1
                 try:
-                    return fn(*args, **kwargs)
+                    response = fn(*args, **kwargs)
                 except exceptions_to_retry as e:
-                    _nbtries -= 1
-                    if not _nbtries:
+                    if not retry.decide(fn.__name__, e, attempt, nbtries):
                         raise
-                    _delay += _backoff
+                    _delay = retry.get_backoff_delay(attempt, delay, backoff)
+                    logger.warning(f'Function {fn.__name__} failed ({type(e)}): {e} retrying in {_delay:.2f}s')
                     time.sleep(_delay)
-                    logger.warning(f'Function {fn.__name__} failed ({type(e)}): {e} retrying in {_delay}s')
+                else:
+                    retry.on_success()
+                    return response
 
         return _wrapper
     return _retry
 
 
-def _get_endorsing_peers(strategy, current_peer, all_peers):
+def _get_endorsing_peers(strategy, current_peer, all_peers, channel_name=None):
     if strategy == 'SELF':
         return [current_peer]
     if strategy == 'ALL':
         return all_peers
+    if strategy == 'ADAPTIVE' and channel_name is not None:
+        # From the best to the worst peer, only the first one (and the second one when hedging) is called
+        return get_peer_selector(channel_name).rank(all_peers, preferred=current_peer)
 
-    raise Exception(f'strategy should either be "SELF" or "ALL", "{strategy}" given')
+    raise Exception(f'strategy should either be "SELF", "ALL" or "ADAPTIVE" (queries only), "{strategy}" given')
 
 
 def get_invoke_endorsing_peers(current_peer, all_peers):
@@ -73,14 +114,71 @@ def get_invoke_endorsing_peers(current_peer, all_peers):
     )
 
 
-def get_query_endorsing_peers(current_peer, all_peers):
+def get_query_endorsing_peers(current_peer, all_peers, channel_name=None):
     return _get_endorsing_peers(
         strategy=settings.LEDGER_QUERY_STRATEGY,
         current_peer=current_peer,
-        all_peers=all_peers
+        all_peers=all_peers,
+        channel_name=channel_name
     )
 
 
+def _peer_answered(error):
+    """Return whether a chaincode call error holds the ProposalResponse of a peer (e.g. a 404)."""
+    return bool(error.args) and isinstance(error.args[0], list) and \
+        all(hasattr(r, 'response') for r in error.args[0])
+
+
+async def _query_peer(client, channel_name, params, peer):
+    selector = get_peer_selector(channel_name)
+    loop = asyncio.get_event_loop()
+    ts = loop.time()
+    try:
+        response = await client.chaincode_query(**dict(params, peers=[peer]))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        selector.record(peer, loop.time() - ts, error=not _peer_answered(e))
+        raise
+    selector.record(peer, loop.time() - ts)
+    return response
+
+
+async def _adaptive_query(client, channel_name, params):
+    """Query the best ranked peer, and the second one too if the first is slower than usual."""
+    peers = params['peers']
+    primary = asyncio.ensure_future(_query_peer(client, channel_name, params, peers[0]))
+
+    delay = None
+    if settings.LEDGER_QUERY_HEDGING_ENABLED and len(peers) > 1:
+        delay = get_peer_selector(channel_name).hedge_delay(peers[0], settings.LEDGER_QUERY_HEDGING_PERCENTILE)
+    if delay is None:
+        return await primary
+
+    done, _ = await asyncio.wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+
+    hedge = asyncio.ensure_future(_query_peer(client, channel_name, params, peers[1]))
+    names = {primary: 'primary', hedge: 'hedge'}
+    pending = {primary, hedge}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                # An error answered by the peer is as good as a result
+                if error is None or _peer_answered(error):
+                    ledger_metrics.QUERY_HEDGES.labels(channel=channel_name, winner=names[task]).inc()
+                    return task.result()
+        ledger_metrics.QUERY_HEDGES.labels(channel=channel_name, winner='none').inc()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
 class UUIDEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, UUID):
@@ -89,104 +187,142 @@ class UUIDEncoder(json.JSONEncoder):
 
 
 def _call_ledger(channel_name, call_type, fcn, args=None, kwargs=None):
+    connection = get_connection(channel_name)
+    return connection.run(_call_ledger_async(channel_name, call_type, fcn, args=args, kwargs=kwargs))
 
-    with get_hfc(channel_name) as (loop, client, user):
-        if not args:
-            args = []
-        else:
-            args = [json.dumps(args, cls=UUIDEncoder)]
-
-        chaincode_calls = {
-            'invoke': client.chaincode_invoke,
-            'query': client.chaincode_query,
-        }
-
-        all_peers = client._peers.keys()
-
-        peers = {
-            'invoke': get_invoke_endorsing_peers(current_peer=settings.LEDGER_PEER_NAME, all_peers=all_peers),
-            'query': get_query_endorsing_peers(current_peer=settings.LEDGER_PEER_NAME, all_peers=all_peers),
-        }
-
-        params = {
-            'requestor': user,
-            'channel_name': channel_name,
-            'peers': peers[call_type],
-            'args': args,
-            'cc_name': settings.LEDGER_CHANNELS[channel_name]['chaincode']['name'],
-            'fcn': fcn
-        }
-
-        if kwargs is not None and isinstance(kwargs, dict):
-            params.update(kwargs)
-
-        try:
-            response = loop.run_until_complete(chaincode_calls[call_type](**params))
-        except TimeoutError as e:
-            raise LedgerTimeout(str(e))
-        except Exception as e:
-            # TODO add a method to parse properly the base Exception raised by the fabric-sdk-py
-            if hasattr(e, 'details') and 'access denied' in e.details():
-                raise LedgerForbidden(f'Access denied for {(fcn, args)}')
-
-            if hasattr(e, 'details') and 'failed to connect to all addresses' in e.details():
-                logger.error(f'failed to reach all peers {all_peers}, current_peer is {settings.LEDGER_PEER_NAME}')
-                raise LedgerUnavailable(f'Failed to connect to all addresses for {(fcn, args)}')
-
-            for arg in e.args:
-                if 'MVCC_READ_CONFLICT' in arg:
-                    logger.error(f'MVCC read conflict for {(fcn, args)}')
-                    raise LedgerMVCCError(arg) from e
-
-                if 'PHANTOM_READ_CONFLICT' in arg:
-                    logger.error(f'PHANTOM read conflict for {(fcn, args)}')
-                    raise LedgerPhantomReadConflictError(arg) from e
-
-                if 'ENDORSEMENT_POLICY_FAILURE' in arg:
-                    logger.error(f'ENDORSEMENT_POLICY_FAILURE for {(fcn, args)}')
-                    raise LedgerEndorsementPolicyFailure(arg) from e
-
-            try:  # get first failed response from list of protobuf ProposalResponse
-                response = [r for r in e.args[0] if r.response.status != 200][0].response.message
-            except Exception:
-                raise LedgerError(str(e))
-
-        # Deserialize the stringified json
-        try:
-            response = json.loads(response)
-        except json.decoder.JSONDecodeError:
-            raise LedgerInvalidResponse(response)
-
-        # Raise errors if status is not ok
-        raise_for_status(response)
 
-        return response
+async def _call_ledger_async(channel_name, call_type, fcn, args=None, kwargs=None):
+    if call_type == 'query' and kwargs is None:
+        # identical queries in flight share one ledger call, see `substrapp.ledger.singleflight`
+        single_flight = get_current_connection(channel_name).single_flight
+        return await single_flight.do(fcn, args, functools.partial(
+            _call_ledger_once, channel_name, call_type, fcn, args=args))
+    return await _call_ledger_once(channel_name, call_type, fcn, args=args, kwargs=kwargs)
 
 
-def call_ledger(channel_name, call_type, fcn, *args, **kwargs):
-    """Call ledger and log each request."""
-    ts = time.time()
-    error = None
+async def _call_ledger_once(channel_name, call_type, fcn, args=None, kwargs=None):
+    circuit_breaker = retry.get_circuit_breaker(channel_name)
+    circuit_breaker.before_call()
     try:
-        response = _call_ledger(channel_name, call_type, fcn, *args, **kwargs)
+        response = await _send_ledger_call(channel_name, call_type, fcn, args=args, kwargs=kwargs)
+    except Exception as e:
+        circuit_breaker.on_failure(e)
+        raise
+    circuit_breaker.on_success()
+    return response
 
-        if isinstance(response, dict) and 'bookmark' in response:
-            results = response['results']  # first results
-            while response['results'] and len(response['bookmark']) > 0:
-                kwargs['args'] = {'bookmark': response['bookmark']}
-                response = _call_ledger(channel_name, call_type, fcn, *args, **kwargs)
-                results.extend(response['results'])  # following results
-            else:
-                response = results
 
-        return response
+async def _send_ledger_call(channel_name, call_type, fcn, args=None, kwargs=None):
+
+    connection = get_current_connection(channel_name)
+    client = connection.client
+    user = connection.user
+
+    if call_type == 'invoke':
+        # fabric-sdk-py keeps the transaction it waits for on the client instance (`evt_tx_id`, `evts`).
+        # Each invoke gets its own shallow copy of the pooled client, so that concurrent invokes do not
+        # overwrite each other's state. Peers, orderers and channels are still shared.
+        client = copy.copy(client)
+
+    if not args:
+        args = []
+    else:
+        args = [json.dumps(args, cls=UUIDEncoder)]
 
+    chaincode_calls = {
+        'invoke': client.chaincode_invoke,
+        'query': client.chaincode_query,
+    }
+
+    all_peers = client._peers.keys()
+
+    peers = {
+        'invoke': get_invoke_endorsing_peers(current_peer=settings.LEDGER_PEER_NAME, all_peers=all_peers),
+        'query': get_query_endorsing_peers(
+            current_peer=settings.LEDGER_PEER_NAME, all_peers=all_peers, channel_name=channel_name),
+    }
+
+    params = {
+        'requestor': user,
+        'channel_name': channel_name,
+        'peers': peers[call_type],
+        'args': args,
+        'cc_name': settings.LEDGER_CHANNELS[channel_name]['chaincode']['name'],
+        'fcn': fcn
+    }
+
+    if kwargs is not None and isinstance(kwargs, dict):
+        params.update(kwargs)
+
+    ledger_metrics.observe_payload(call_type, fcn, 'request', sum(len(arg) for arg in args))
+
+    if call_type == 'query' and settings.LEDGER_QUERY_STRATEGY == 'ADAPTIVE':
+        chaincode_call = _adaptive_query(client, channel_name, params)
+    elif call_type == 'invoke' and params.get('wait_for_event') and not params.get('cc_pattern') and \
+            settings.LEDGER_COMMIT_TRACKER_ENABLED and connection.commit_tracker is not None:
+        chaincode_call = invoke_and_wait(connection.commit_tracker, client, **params)
+    else:
+        chaincode_call = chaincode_calls[call_type](**params)
+
+    try:
+        response = await chaincode_call
+    except TimeoutError as e:
+        raise LedgerTimeout(str(e))
+    except Exception as e:
+        # TODO add a method to parse properly the base Exception raised by the fabric-sdk-py
+        if hasattr(e, 'details') and 'access denied' in e.details():
+            raise LedgerForbidden(f'Access denied for {(fcn, args)}')
+
+        if hasattr(e, 'details') and 'failed to connect to all addresses' in e.details():
+            logger.error(f'failed to reach all peers {all_peers}, current_peer is {settings.LEDGER_PEER_NAME}')
+            invalidate_discovery(channel_name)
+            raise LedgerUnavailable(f'Failed to connect to all addresses for {(fcn, args)}')
+
+        for arg in e.args:
+            if 'MVCC_READ_CONFLICT' in arg:
+                logger.error(f'MVCC read conflict for {(fcn, args)}')
+                raise LedgerMVCCError(arg) from e
+
+            if 'PHANTOM_READ_CONFLICT' in arg:
+                logger.error(f'PHANTOM read conflict for {(fcn, args)}')
+                raise LedgerPhantomReadConflictError(arg) from e
+
+            if 'ENDORSEMENT_POLICY_FAILURE' in arg:
+                logger.error(f'ENDORSEMENT_POLICY_FAILURE for {(fcn, args)}')
+                raise LedgerEndorsementPolicyFailure(arg) from e
+
+        try:  # get first failed response from list of protobuf ProposalResponse
+            response = [r for r in e.args[0] if r.response.status != 200][0].response.message
+        except Exception:
+            raise LedgerError(str(e))
+
+    ledger_metrics.observe_payload(call_type, fcn, 'response', len(response))
+
+    # Deserialize the stringified json
+    try:
+        response = json.loads(response)
+    except json.decoder.JSONDecodeError:
+        raise LedgerInvalidResponse(response)
+
+    # Raise errors if status is not ok
+    raise_for_status(response)
+
+    return response
+
+
+@contextlib.contextmanager
+def _log_ledger_call(call_type, fcn):
+    ts = time.time()
+    error = None
+    try:
+        yield
     except Exception as e:
         error = e.__class__.__name__
         raise
     finally:
         # add a log even if the function raises an exception
         te = time.time()
+        ledger_metrics.observe_call(call_type, fcn, te - ts, error)
         elaps = (te - ts) * 1000
         if error is None:
             logger.info(f"(smartcontract) {call_type}:{fcn} took {elaps:.2f} ms")
@@ -194,11 +330,77 @@ def call_ledger(channel_name, call_type, fcn, *args, **kwargs):
             logger.info(f"(smartcontract) {call_type}:{fcn} took {elaps:.2f} ms. Error: {error}")
 
 
-def _invoke_ledger(channel_name, fcn, args=None, cc_pattern=None, sync=False, only_key=True):
+def _is_paginated(response):
+    return isinstance(response, dict) and 'bookmark' in response
+
+
+def _next_page_args(response):
+    """Return the args of the call to the page following a paginated `response`, None if it is the last one."""
+    if response['results'] and len(response['bookmark']) > 0:
+        return {'bookmark': response['bookmark']}
+    return None
+
+
+def _next_pages(call, response, *args, **kwargs):
+    """Follow the bookmark of a paginated `response` and yield the following responses."""
+    kwargs['args'] = _next_page_args(response)
+    while kwargs['args'] is not None:
+        response = call(*args, **kwargs)
+        yield response
+        kwargs['args'] = _next_page_args(response)
+
+
+async def _next_pages_async(call, response, *args, **kwargs):
+    """Same as `_next_pages`, awaiting each `call`."""
+    kwargs['args'] = _next_page_args(response)
+    while kwargs['args'] is not None:
+        response = await call(*args, **kwargs)
+        yield response
+        kwargs['args'] = _next_page_args(response)
+
+
+def call_ledger(channel_name, call_type, fcn, *args, **kwargs):
+    """Call ledger and log each request."""
+    with _log_ledger_call(call_type, fcn):
+        response = _call_ledger(channel_name, call_type, fcn, *args, **kwargs)
+
+        if _is_paginated(response):
+            results = response['results']  # first results
+            for page in _next_pages(_call_ledger, response, channel_name, call_type, fcn, *args, **kwargs):
+                results.extend(page['results'])  # following results
+            response = results
+
+        return response
+
+
+async def call_ledger_async(channel_name, call_type, fcn, *args, **kwargs):
+    """Call ledger and log each request.
+
+    Must be awaited on the connection loop of `channel_name` (see `LedgerConnection.run`).
+    """
+    with _log_ledger_call(call_type, fcn):
+        response = await _call_ledger_async(channel_name, call_type, fcn, *args, **kwargs)
+
+        if _is_paginated(response):
+            results = response['results']  # first results
+            pages = _next_pages_async(_call_ledger_async, response, channel_name, call_type, fcn, *args, **kwargs)
+            async for page in pages:
+                results.extend(page['results'])  # following results
+            response = results
+
+        return response
+
+
+def _invoke_ledger(channel_name, fcn, args=None, cc_pattern=None, sync=False, only_key=True, lock_keys=None):
+    """Invoke the chaincode, holding the locks of the logical keys written if `sync` (see `ledger_locks`).
+
+    `lock_keys` defaults to the keys derived from the arguments of `fcn`.
+    """
     params = {
         'wait_for_event': sync,
-        'grpc_broker_unavailable_retry': 5,
-        'grpc_broker_unavailable_retry_delay': 3000,
+        # fabric-sdk-py waits between these retries with a blocking `sleep`, which would stall every call
+        # sharing the pooled connection loop. Unreachable peers are retried by `retry_on_error` instead.
+        'grpc_broker_unavailable_retry': 0,
         'raise_broker_unavailable': False
     }
 
@@ -208,7 +410,18 @@ def _invoke_ledger(channel_name, fcn, args=None, cc_pattern=None, sync=False, on
     if cc_pattern:
         params['cc_pattern'] = cc_pattern
 
-    response = call_ledger(channel_name, 'invoke', fcn=fcn, args=args, kwargs=params)
+    if not sync:
+        # returns before the commit: a lock would not order it
+        lock_keys = []
+    elif lock_keys is None:
+        lock_keys = ledger_locks.get_lock_keys(fcn, args)
+
+    try:
+        with ledger_locks.invoke_lock(channel_name, fcn, lock_keys):
+            response = call_ledger(channel_name, 'invoke', fcn=fcn, args=args, kwargs=params)
+    finally:
+        # even a failed invoke (e.g. timeout) may have been committed
+        ledger_cache.invalidate_invoke(channel_name, fcn)
 
     if only_key:
         return {'key': response.get('key', response.get('keys'))}
@@ -216,12 +429,103 @@ def _invoke_ledger(channel_name, fcn, args=None, cc_pattern=None, sync=False, on
         return response
 
 
+def query_ledger(channel_name, fcn, args=None, use_cache=True):
+    """Query ledger. Results of `ledger_cache.CACHED_QUERIES` are cached unless `use_cache` is False.
+
+    With `use_cache`, lists of the `ledger_mirror.MIRRORED_KINDS` are read from the ledger mirror once indexed.
+    """
+    if use_cache:
+        data = ledger_mirror.lookup(channel_name, fcn, args)
+        if data is not None:
+            return data
+        return ledger_cache.cached_query(channel_name, fcn, args, _query_ledger)
+    return _query_ledger(channel_name, fcn, args=args)
+
+
 @retry_on_error(exceptions=[LedgerTimeout])
-def query_ledger(channel_name, fcn, args=None):
+def _query_ledger(channel_name, fcn, args=None):
     # careful, passing invoke parameters to query_ledger will NOT fail
     return call_ledger(channel_name, 'query', fcn=fcn, args=args)
 
 
+@retry_on_error(exceptions=[LedgerTimeout])
+def _query_ledger_page(channel_name, fcn, args=None):
+    with _log_ledger_call('query', fcn):
+        return _call_ledger(channel_name, 'query', fcn=fcn, args=args)
+
+
+def iter_ledger(channel_name, fcn, args=None):
+    """Query ledger and yield the results page by page, as soon as each page is received.
+
+    Unlike `query_ledger`, the whole result set is never held in memory. Each page request
+    is logged and retried on its own. Non paginated results are yielded as a single page.
+    """
+    response = _query_ledger_page(channel_name, fcn, args=args)
+
+    if not _is_paginated(response):
+        if response:
+            yield response
+        return
+
+    if response['results']:
+        yield response['results']
+    for page in _next_pages(_query_ledger_page, response, channel_name, fcn):
+        if page['results']:
+            yield page['results']
+
+
+@retry_on_error(exceptions=[LedgerTimeout])
+async def query_ledger_async(channel_name, fcn, args=None):
+    return await call_ledger_async(channel_name, 'query', fcn=fcn, args=args)
+
+
+async def _gather_with_concurrency(coros, max_concurrency):
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*[_run(coro) for coro in coros])
+
+
+async def query_ledger_many_async(channel_name, queries, max_concurrency=None):
+    """Run `queries`, a list of `(fcn, args)`, concurrently. Results are returned in the same order."""
+    max_concurrency = max_concurrency or settings.LEDGER_MAX_CONCURRENT_QUERIES
+    return await _gather_with_concurrency(
+        [query_ledger_async(channel_name, fcn=fcn, args=args) for fcn, args in queries],
+        max_concurrency
+    )
+
+
+def query_ledger_many(channel_name, queries, max_concurrency=None, use_cache=True):
+    """Run `queries`, a list of `(fcn, args)`, concurrently on the channel connection loop.
+
+    The call takes about as long as the slowest query, instead of the sum of all of them. Results are
+    neither read from nor stored in the ledger cache unless `use_cache`.
+    """
+    if not queries:
+        return []
+
+    if not use_cache:
+        connection = get_connection(channel_name)
+        return connection.run(query_ledger_many_async(channel_name, queries, max_concurrency=max_concurrency))
+
+    lookups = [ledger_cache.lookup(channel_name, fcn, args) for fcn, args in queries]
+    misses = [i for i, (_, value) in enumerate(lookups) if value is ledger_cache.MISSING]
+    results = [value for _, value in lookups]
+
+    if misses:
+        connection = get_connection(channel_name)
+        responses = connection.run(query_ledger_many_async(
+            channel_name, [queries[i] for i in misses], max_concurrency=max_concurrency))
+        for i, response in zip(misses, responses):
+            ledger_cache.store(lookups[i][0], queries[i][0], response)
+            results[i] = response
+
+    return results
+
+
 @retry_on_error()
 def invoke_ledger(channel_name, *args, **kwargs):
     return _invoke_ledger(channel_name, *args, **kwargs)
@@ -232,16 +536,20 @@ def update_ledger(channel_name, *args, **kwargs):
     return _invoke_ledger(channel_name, *args, **kwargs)
 
 
-def query_tuples(channel_name, tuple_type, data_owner):
+def _query_tuples_args(tuple_type, data_owner):
     # Convert to chaincode index for compositeTraintuple
     tuple_type = 'compositeTraintuple' if tuple_type == 'composite_traintuple' else tuple_type
+    return {
+        'indexName': f'{tuple_type}~worker~status',
+        'attributes': f'{data_owner},todo'
+    }
+
+
+def query_tuples(channel_name, tuple_type, data_owner):
     data = query_ledger(
         channel_name,
         fcn="queryFilter",
-        args={
-            'indexName': f'{tuple_type}~worker~status',
-            'attributes': f'{data_owner},todo'
-        }
+        args=_query_tuples_args(tuple_type, data_owner)
     )
 
     data = [] if data is None else data
@@ -249,8 +557,36 @@ def query_tuples(channel_name, tuple_type, data_owner):
     return data
 
 
-def get_object_from_ledger(channel_name, key, query):
-    return query_ledger(channel_name, fcn=query, args={'key': key})
+def iter_tuples(channel_name, tuple_type, data_owner):
+    """Yield the todo tuples of `data_owner` as ledger pages are received."""
+    for page in iter_ledger(channel_name, fcn="queryFilter", args=_query_tuples_args(tuple_type, data_owner)):
+        yield from page
+
+
+def get_object_from_ledger(channel_name, key, query, use_cache=True):
+    return query_ledger(channel_name, fcn=query, args={'key': key}, use_cache=use_cache)
+
+
+async def get_object_from_ledger_async(channel_name, key, query):
+    return await query_ledger_async(channel_name, fcn=query, args={'key': key})
+
+
+async def get_objects_from_ledger_async(channel_name, keys, query, max_concurrency=None):
+    return await query_ledger_many_async(
+        channel_name,
+        [(query, {'key': key}) for key in keys],
+        max_concurrency=max_concurrency
+    )
+
+
+def get_objects_from_ledger(channel_name, keys, query, max_concurrency=None, use_cache=True):
+    """Get the objects identified by `keys` concurrently. Results are returned in the same order."""
+    return query_ledger_many(
+        channel_name,
+        [(query, {'key': key}) for key in keys],
+        max_concurrency=max_concurrency,
+        use_cache=use_cache
+    )
 
 
 LOG_TUPLE_INVOKE_FCNS = {
@@ -275,10 +611,11 @@ LOG_TUPLE_INVOKE_FCNS = {
 }
 
 
-def _update_tuple_status(channel_name, tuple_type, tuple_key, status, extra_kwargs=None):
+def _update_tuple_status(channel_name, tuple_type, tuple_key, status, extra_kwargs=None, compute_plan_key=None):
     """Update tuple status to doing, done or failed.
 
     In case of ledger timeout, query the ledger until the status has been updated.
+    The updates of the tuples of a compute plan are serialized, as they all write the compute plan.
     """
     try:
         invoke_fcn = LOG_TUPLE_INVOKE_FCNS[status][tuple_type]
@@ -291,22 +628,23 @@ def _update_tuple_status(channel_name, tuple_type, tuple_key, status, extra_kwar
     if extra_kwargs:
         invoke_args.update(extra_kwargs)
 
-    update_ledger(channel_name, fcn=invoke_fcn, args=invoke_args, sync=True)
+    update_ledger(channel_name, fcn=invoke_fcn, args=invoke_args, sync=True, lock_keys=[compute_plan_key])
 
 
-def log_start_tuple(channel_name, tuple_type, tuple_key):
-    _update_tuple_status(channel_name, tuple_type, tuple_key, 'doing')
+def log_start_tuple(channel_name, tuple_type, tuple_key, compute_plan_key=None):
+    _update_tuple_status(channel_name, tuple_type, tuple_key, 'doing', compute_plan_key=compute_plan_key)
 
 
-def log_fail_tuple(channel_name, tuple_type, tuple_key, err_msg):
+def log_fail_tuple(channel_name, tuple_type, tuple_key, err_msg, compute_plan_key=None):
     err_msg = str(err_msg).replace('"', "'").replace('\\', "").replace('\\n', "")[:200]
     extra_kwargs = {
         'log': err_msg,
     }
-    _update_tuple_status(channel_name, tuple_type, tuple_key, 'failed', extra_kwargs=extra_kwargs)
+    _update_tuple_status(channel_name, tuple_type, tuple_key, 'failed', extra_kwargs=extra_kwargs,
+                         compute_plan_key=compute_plan_key)
 
 
-def log_success_tuple(channel_name, tuple_type, tuple_key, res):
+def log_success_tuple(channel_name, tuple_type, tuple_key, res, compute_plan_key=None):
     extra_kwargs = {
         'log': '',
     }
@@ -338,4 +676,5 @@ def log_success_tuple(channel_name, tuple_type, tuple_key, res):
             'perf': float(res["global_perf"]),
         })
 
-    _update_tuple_status(channel_name, tuple_type, tuple_key, 'done', extra_kwargs=extra_kwargs)
+    _update_tuple_status(channel_name, tuple_type, tuple_key, 'done', extra_kwargs=extra_kwargs,
+                         compute_plan_key=compute_plan_key)
@@ -0,0 +1,223 @@
+"""Read-through cache for ledger queries.
+
+Query results are stored in the `ledger` Django cache, which is shared by all the backend processes.
+Each cached query reads one or more asset kinds. Every asset kind of a channel has a generation token
+which is part of the cache keys: when an asset of this kind changes (local invoke or new block received
+by the events app), the token is renewed and the results which depend on it are never read again.
+Per-function TTLs bound the staleness if an invalidation is missed.
+"""
+import hashlib
+import json
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from hfc.protos.peer import chaincode_pb2
+
+from substrapp.ledger import metrics as ledger_metrics
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = 'ledger'
+
+MISSING = object()
+
+ALGO_KINDS = ['algo', 'composite_algo', 'aggregate_algo']
+TUPLE_KINDS = ['traintuple', 'testtuple', 'composite_traintuple', 'aggregatetuple']
+ALL_KINDS = ['node', 'objective', 'dataset', 'data_sample', 'compute_plan'] + ALGO_KINDS + TUPLE_KINDS
+
+# Cacheable query functions: default TTL (seconds) and asset kinds read
+CACHED_QUERIES = {
+    'queryNodes': (300, ['node']),
+    'queryAlgos': (60, ['algo']),
+    'queryAlgo': (300, ['algo']),
+    'queryCompositeAlgos': (60, ['composite_algo']),
+    'queryCompositeAlgo': (300, ['composite_algo']),
+    'queryAggregateAlgos': (60, ['aggregate_algo']),
+    'queryAggregateAlgo': (300, ['aggregate_algo']),
+    'queryObjectives': (60, ['objective']),
+    'queryObjective': (300, ['objective']),
+    'queryDataManagers': (60, ['dataset']),
+    'queryDataManager': (60, ['dataset']),
+    'queryDataset': (60, ['dataset', 'data_sample']),
+    'queryDataSamples': (60, ['data_sample']),
+    'queryObjectiveLeaderboard': (30, ['objective'] + ALGO_KINDS + TUPLE_KINDS),
+    'queryComputePlans': (30, ['compute_plan'] + TUPLE_KINDS),
+    'queryComputePlan': (30, ['compute_plan'] + TUPLE_KINDS),
+    'queryTraintuples': (30, ['traintuple']),
+    'queryTraintuple': (30, ['traintuple']),
+    'queryTesttuples': (30, ['testtuple']),
+    'queryTesttuple': (30, ['testtuple']),
+    'queryCompositeTraintuples': (30, ['composite_traintuple']),
+    'queryCompositeTraintuple': (30, ['composite_traintuple']),
+    'queryAggregatetuples': (30, ['aggregatetuple']),
+    'queryAggregatetuple': (30, ['aggregatetuple']),
+    'queryModels': (30, TUPLE_KINDS),
+    'queryModelDetails': (30, TUPLE_KINDS),
+    'queryModelPermissions': (30, TUPLE_KINDS),
+}
+
+# Asset kinds written by invoke functions. Unknown functions invalidate every kind.
+INVOKE_ASSET_KINDS = {
+    'registerNode': ['node'],
+    'registerAlgo': ['algo'],
+    'registerCompositeAlgo': ['composite_algo'],
+    'registerAggregateAlgo': ['aggregate_algo'],
+    'registerObjective': ['objective'],
+    'registerDataManager': ['dataset'],
+    'updateDataManager': ['dataset', 'objective'],
+    'registerDataSample': ['data_sample', 'dataset'],
+    'updateDataSample': ['data_sample', 'dataset'],
+    'createTraintuple': ['traintuple', 'compute_plan'],
+    'createTesttuple': ['testtuple', 'compute_plan'],
+    'createCompositeTraintuple': ['composite_traintuple', 'compute_plan'],
+    'createAggregatetuple': ['aggregatetuple', 'compute_plan'],
+    'logStartTrain': ['traintuple', 'compute_plan'],
+    'logSuccessTrain': ['traintuple', 'compute_plan'],
+    'logFailTrain': ['traintuple', 'compute_plan'],
+    'logStartTest': ['testtuple', 'compute_plan'],
+    'logSuccessTest': ['testtuple', 'compute_plan'],
+    'logFailTest': ['testtuple', 'compute_plan'],
+    'logStartCompositeTrain': ['composite_traintuple', 'compute_plan'],
+    'logSuccessCompositeTrain': ['composite_traintuple', 'compute_plan'],
+    'logFailCompositeTrain': ['composite_traintuple', 'compute_plan'],
+    'logStartAggregate': ['aggregatetuple', 'compute_plan'],
+    'logSuccessAggregate': ['aggregatetuple', 'compute_plan'],
+    'logFailAggregate': ['aggregatetuple', 'compute_plan'],
+    'createComputePlan': ['compute_plan'] + TUPLE_KINDS,
+    'updateComputePlan': ['compute_plan'] + TUPLE_KINDS,
+    'cancelComputePlan': ['compute_plan'] + TUPLE_KINDS,
+}
+
+
+def is_enabled():
+    return getattr(settings, 'LEDGER_CACHE_ENABLED', False)
+
+
+def get_ttl(fcn):
+    ttls = getattr(settings, 'LEDGER_CACHE_TTL_SECONDS', {})
+    return ttls.get(fcn, CACHED_QUERIES[fcn][0])
+
+
+def _generation_key(channel_name, kind):
+    return f'ledger:{channel_name}:generation:{kind}'
+
+
+def _get_generations(cache, channel_name, kinds):
+    keys = [_generation_key(channel_name, kind) for kind in kinds]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            # never set or evicted: any token is fine as long as all the processes agree on it
+            cache.add(key, uuid.uuid4().hex, None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def _query_key(channel_name, fcn, args, generations):
+    digest = hashlib.sha256(
+        json.dumps([fcn, args, generations], sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f'ledger:{channel_name}:query:{fcn}:{digest}'
+
+
+def lookup(channel_name, fcn, args):
+    """Return `(key, value)` for a query. `value` is MISSING on a miss, `key` is None if it can't be cached."""
+    if not is_enabled() or fcn not in CACHED_QUERIES:
+        return None, MISSING
+
+    try:
+        cache = caches[CACHE_ALIAS]
+        generations = _get_generations(cache, channel_name, CACHED_QUERIES[fcn][1])
+        key = _query_key(channel_name, fcn, args, generations)
+        value = cache.get(key, MISSING)
+        ledger_metrics.CACHE_REQUESTS.labels(fcn=fcn, result='miss' if value is MISSING else 'hit').inc()
+        return key, value
+    except Exception as e:
+        # the cache is an optimization, the ledger stays the source of truth
+        logger.warning(f'Ledger cache lookup failed for {fcn} ({type(e)}): {e}')
+        return None, MISSING
+
+
+def store(key, fcn, value):
+    if key is None:
+        return
+    try:
+        caches[CACHE_ALIAS].set(key, value, get_ttl(fcn))
+    except Exception as e:
+        logger.warning(f'Ledger cache store failed for {fcn} ({type(e)}): {e}')
+
+
+def cached_query(channel_name, fcn, args, query):
+    """Return the cached result of `query(channel_name, fcn, args=args)` or run it and cache its result."""
+    key, value = lookup(channel_name, fcn, args)
+    if value is not MISSING:
+        return value
+
+    value = query(channel_name, fcn, args=args)
+    store(key, fcn, value)
+    return value
+
+
+def invalidate(channel_name, kinds):
+    if not is_enabled():
+        return
+    try:
+        caches[CACHE_ALIAS].set_many(
+            {_generation_key(channel_name, kind): uuid.uuid4().hex for kind in set(kinds)},
+            None
+        )
+    except Exception as e:
+        logger.warning(f'Ledger cache invalidation failed for {channel_name} ({type(e)}): {e}')
+
+
+def invalidate_invoke(channel_name, fcn):
+    """Invalidate the queries reading the asset kinds written by the invoke function `fcn`."""
+    invalidate(channel_name, INVOKE_ASSET_KINDS.get(fcn, ALL_KINDS))
+
+
+def get_transaction_call(tx):
+    """Return the (chaincode function, JSON arguments or None) invoked by a decoded endorser transaction, or None."""
+    try:
+        actions = tx['payload']['data']['actions']
+    except (KeyError, TypeError):
+        return None  # config transaction
+
+    for action in actions:
+        invocation_spec = chaincode_pb2.ChaincodeInvocationSpec()
+        invocation_spec.ParseFromString(action['payload']['chaincode_proposal_payload']['input'])
+        args = invocation_spec.chaincode_spec.input.args
+        if args:
+            return args[0].decode(), args[1].decode() if len(args) > 1 else None
+    return None
+
+
+def get_transaction_fcn(tx):
+    """Return the chaincode function invoked by a decoded endorser transaction, or None."""
+    call = get_transaction_call(tx)
+    return None if call is None else call[0]
+
+
+def get_block_kinds(block):
+    """Return the asset kinds written by the transactions of a decoded block."""
+    kinds = set()
+    for tx in block['data']['data']:
+        try:
+            fcn = get_transaction_fcn(tx)
+        except Exception as e:
+            logger.warning(f'Cannot decode a transaction of block {block["header"]["number"]}: {e}')
+            fcn = ''
+        if fcn is not None:
+            kinds.update(INVOKE_ASSET_KINDS.get(fcn, ALL_KINDS))
+    return kinds
+
+
+def invalidate_block(channel_name, block):
+    """Invalidate the queries reading the asset kinds written by the transactions of a decoded block."""
+    if not is_enabled():
+        return
+
+    kinds = get_block_kinds(block)
+    if kinds:
+        invalidate(channel_name, kinds)
@@ -0,0 +1,144 @@
+"""Shared tracking of the commit of synchronous invokes (LEDGER_COMMIT_TRACKER_ENABLED).
+
+fabric-sdk-py opens one event stream per endorsing peer for each invoke waiting for its transaction.
+Instead, each ledger connection keeps a single filtered block stream from the local peer, and resolves
+a future per pending transaction id as blocks are committed. After a stream failure, the stream is
+re-opened from the block following the last one seen, so that no commit is missed.
+
+The stream is started with the connection, from the newest block. A transaction is only sent once the
+stream delivered a first block (see `wait_ready`): its commit is in a later block.
+"""
+import asyncio
+import logging
+
+from django.conf import settings
+from hfc.fabric.block_decoder import decode_proposal_response_payload
+from hfc.fabric.channel.channel_eventhub import ChannelEventHub
+from hfc.fabric.transaction.tx_context import create_tx_context
+from hfc.fabric.transaction.tx_proposal_request import create_tx_prop_req, CC_INVOKE, CC_TYPE_GOLANG
+from hfc.util import utils
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY_SECONDS = 1
+
+
+class CommitTracker(object):
+    """Resolve the futures of pending transactions from one block stream.
+
+    Must only be used from the connection loop.
+    """
+
+    def __init__(self, client, user, channel_name):
+        self.client = client
+        self.user = user
+        self.channel_name = channel_name
+        self.pending = {}
+        self.last_block = None
+        self.task = None
+        self.ready = None
+
+    def start(self):
+        """Start the block stream, if not running."""
+        if self.ready is None:
+            self.ready = asyncio.Event()
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._listen())
+
+    async def wait_ready(self, timeout):
+        """Wait until the stream delivered a block, raise TimeoutError after `timeout` seconds."""
+        self.start()
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'Commit event stream of {self.channel_name} not established.')
+
+    def register(self, tx_id):
+        """Return a future set to the validation code of `tx_id` once committed."""
+        self.start()
+        future = asyncio.get_event_loop().create_future()
+        self.pending[tx_id] = future
+        return future
+
+    def unregister(self, tx_id):
+        self.pending.pop(tx_id, None)
+
+    def on_block(self, block):
+        self.last_block = block['number']
+        # the stream is re-opened after the last block seen: it stays ready
+        self.ready.set()
+        for transaction in block['filtered_transactions']:
+            future = self.pending.pop(transaction['txid'], None)
+            if future is not None and not future.done():
+                future.set_result(transaction['tx_validation_code'])
+
+    async def _listen(self):
+        while True:
+            start = 'newest' if self.last_block is None else self.last_block + 1
+            peer = self.client.get_peer(settings.LEDGER_PEER_NAME)
+            event_hub = ChannelEventHub(peer, self.channel_name, self.user)
+            event_hub.registerBlockEvent(unregister=False, onEvent=self.on_block)
+            try:
+                await event_hub.connect(filtered=True, start=start)
+            except asyncio.CancelledError:
+                event_hub.disconnect()
+                raise
+            except Exception as e:
+                logger.warning(f'Commit event stream of {self.channel_name} failed: {e}')
+            await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+
+
+async def invoke_and_wait(tracker, client, requestor, channel_name, peers, args, cc_name, fcn,
+                          cc_type=CC_TYPE_GOLANG, wait_for_event_timeout=30, **kwargs):
+    """Invoke the chaincode and wait for the local peer to commit the transaction.
+
+    Same results and errors as `Client.chaincode_invoke(wait_for_event=True)`, without retries of
+    unreachable peers (see `_invoke_ledger`).
+    """
+    tran_prop_req = create_tx_prop_req(prop_type=CC_INVOKE, cc_name=cc_name, cc_type=cc_type, fcn=fcn, args=args)
+    tx_context = create_tx_context(requestor, requestor.cryptoSuite, tran_prop_req)
+    target_peers = [client.get_peer(peer) for peer in peers]
+
+    channel = client.get_channel(channel_name)
+    responses, proposal, header = channel.send_tx_proposal(tx_context, target_peers)
+    res = await asyncio.gather(*responses, return_exceptions=True)
+
+    # as fabric-sdk-py, leave unmet endorsement policies to the orderer
+    errors = [r for r in res if isinstance(r, Exception)]
+    res = [r for r in res if not isinstance(r, Exception)]
+    if not res:
+        raise errors[0]
+
+    if any(r.response.status != 200 for r in res):
+        return '; '.join({r.response.message for r in res if r.response.status != 200})
+
+    tran_req = utils.build_tx_req((res, proposal, header))
+    tx_context_tx = create_tx_context(requestor, requestor.cryptoSuite, tran_req)
+
+    # registered before the transaction can be committed, once the stream is sure to deliver its block
+    await tracker.wait_ready(wait_for_event_timeout)
+    committed = tracker.register(tx_context.tx_id)
+    try:
+        async for v in utils.send_transaction(client.orderers, tran_req, tx_context_tx):
+            if not v.status == 200:
+                return v.message
+
+        try:
+            status = await asyncio.wait_for(committed, timeout=wait_for_event_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError('waitForEvent timed out.')
+    finally:
+        tracker.unregister(tx_context.tx_id)
+
+    if status != 'VALID':
+        raise Exception([status])
+
+    res = decode_proposal_response_payload(res[0].payload)
+    return res['extension']['response']['payload'].decode('utf-8')
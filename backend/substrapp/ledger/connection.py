@@ -1,9 +1,15 @@
 import base64
+import concurrent.futures
 import contextlib
 import asyncio
 import glob
+import hashlib
+import json
+import logging
+import os
 import tempfile
 import threading
+import time
 
 from django.conf import settings
 from hfc.fabric import Client
@@ -13,15 +19,34 @@ from hfc.fabric.orderer import Orderer
 from hfc.util.keyvaluestore import FileKeyValueStore
 from hfc.fabric.block_decoder import decode_fabric_MSP_config, decode_fabric_peers_info, decode_fabric_endpoints
 
+from substrapp.ledger import metrics as ledger_metrics
+from substrapp.ledger.commit_tracker import CommitTracker
+from substrapp.ledger.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
 user = None
 user_lock = threading.Lock()
 
+connections = {}
+connections_locks = {}
+connections_lock = threading.Lock()
+
+# Holds the connection served by the current thread, in connection loop threads only.
+_loop_local = threading.local()
+
+# Peers and orderers replaced by a discovery are closed after this delay, by a later discovery: the calls
+# started before the discovery (queries, invokes waiting for their commit) may still use them.
+RETIRED_NODES_GRACE_SECONDS = 120
+
 
 def ledger_grpc_options(hostname):
     return {
         'grpc.max_send_message_length': settings.LEDGER_GRPC_MAX_SEND_MESSAGE_LENGTH,
         'grpc.max_receive_message_length': settings.LEDGER_GRPC_MAX_RECEIVE_MESSAGE_LENGTH,
+        'grpc.keepalive_time_ms': settings.LEDGER_GRPC_KEEPALIVE_TIME_MS,
         'grpc.keepalive_timeout_ms': settings.LEDGER_GRPC_KEEPALIVE_TIMEOUT_MS,
+        'grpc.http2.min_time_between_pings_ms': settings.LEDGER_GRPC_HTTP2_MIN_TIME_BETWEEN_PINGS_MS,
         'grpc.http2.max_pings_without_data': settings.LEDGER_GRPC_HTTP2_MAX_PINGS_WITHOUT_DATA,
         'grpc.keepalive_permit_without_calls': settings.LEDGER_GRPC_KEEPALIVE_PERMIT_WITHOUT_CALLS,
         'grpc.ssl_target_name_override': hostname
@@ -30,36 +55,318 @@ def ledger_grpc_options(hostname):
 
 @contextlib.contextmanager
 def get_hfc(channel_name):
-    loop, client, user = _get_hfc(channel_name)
+    """Create a short-lived client for `channel_name`.
+
+    The client is closed when leaving the context. Prefer `get_connection` for ledger calls: it
+    keeps the client and its gRPC channels open between calls.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    client = None
     try:
+        client = loop.run_until_complete(
+            _create_client(channel_name, get_user())
+        )
         yield (loop, client, user)
     finally:
-        loop.run_until_complete(
-            client.close_grpc_channels()
-        )
-        del client
+        if client is not None:
+            loop.run_until_complete(
+                client.close_grpc_channels()
+            )
+            del client
         loop.close()
 
 
-def _get_hfc(channel_name):
+def get_user():
     global user
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-
     if not user:
         with user_lock:
             # Only call `create_user` once in the lifetime of the application.
             # Calling `create_user` twice breaks thread-safety (bug in fabric-sdk-py)
-            user = create_user(
-                name=settings.LEDGER_USER_NAME,
-                org=settings.ORG_NAME,
-                state_store=FileKeyValueStore(settings.LEDGER_CLIENT_STATE_STORE),
-                msp_id=settings.LEDGER_MSP_ID,
-                key_path=glob.glob(settings.LEDGER_CLIENT_KEY_PATH)[0],
-                cert_path=settings.LEDGER_CLIENT_CERT_PATH
+            if not user:
+                user = create_user(
+                    name=settings.LEDGER_USER_NAME,
+                    org=settings.ORG_NAME,
+                    state_store=FileKeyValueStore(settings.LEDGER_CLIENT_STATE_STORE),
+                    msp_id=settings.LEDGER_MSP_ID,
+                    key_path=glob.glob(settings.LEDGER_CLIENT_KEY_PATH)[0],
+                    cert_path=settings.LEDGER_CLIENT_CERT_PATH
+                )
+
+    return user
+
+
+class LedgerConnection(object):
+    """Long-lived connection to a ledger channel.
+
+    The fabric-sdk-py client, its gRPC channels and the discovered peers and orderers are bound to
+    an event loop running in a dedicated thread. Any thread can submit coroutines to this loop
+    with `run`, so a ledger call only pays for its own RPC.
+    """
+
+    def __init__(self, channel_name, user=None):
+        self.channel_name = channel_name
+        self.pid = os.getpid()
+        self.user = user if user is not None else get_user()
+        self.client = None
+        self.commit_tracker = None
+        self.single_flight = SingleFlight()
+        self.broken = False
+        self.last_checked_at = None
+
+        self.discovery_signature = None
+        self.discovered_at = None
+        # (retired at, peer or orderer) replaced by the discovery, not closed yet
+        self.retired_nodes = []
+        self.discovery_expired = True
+        self.discovery_stats = {
+            'refreshes': 0,
+            'changes': 0,
+            'failures': 0,
+            'last_duration_ms': None,
+            'total_duration_ms': 0.0,
+        }
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run_loop,
+            name=f'ledger-connection-{channel_name}',
+            daemon=True
+        )
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        _loop_local.connection = self
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def run(self, coro, timeout=None):
+        """Run `coro` on the connection loop and return its result."""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('LedgerConnection.run cannot be called from the connection loop')
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # the coroutine would keep running on the loop
+            future.cancel()
+            raise
+
+    def submit(self, coro):
+        """Schedule `coro` on the connection loop and return a `concurrent.futures.Future` of its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def connect(self):
+        self.client = self.run(_create_client(self.channel_name, self.user, discover=False))
+        self.commit_tracker = CommitTracker(self.client, self.user, self.channel_name)
+        if getattr(settings, 'LEDGER_COMMIT_TRACKER_ENABLED', False):
+            # established before the first invoke
+            self.loop.call_soon_threadsafe(self.commit_tracker.start)
+        self.last_checked_at = time.time()
+        self.refresh_discovery()
+
+    def needs_discovery(self):
+        return (
+            self.discovery_expired or
+            self.discovered_at is None or
+            time.time() - self.discovered_at > settings.LEDGER_DISCOVERY_TTL_SECONDS
+        )
+
+    def refresh_discovery(self):
+        """Run channel discovery and reload peers and orderers if the topology changed.
+
+        The connection is marked as broken if the discovery fails.
+        """
+        self._close_retired_nodes()
+
+        ts = time.time()
+        retired = []
+        try:
+            # the callers of `get_connection` wait for the discovery
+            signature = self.run(
+                _update_discovery(self.client, self.user, self.channel_name, self.discovery_signature, retired),
+                timeout=getattr(settings, 'LEDGER_DISCOVERY_TIMEOUT_SECONDS', 30)
             )
+        except Exception:
+            self.discovery_stats['failures'] += 1
+            ledger_metrics.DISCOVERY_FAILURES.labels(channel=self.channel_name).inc()
+            self.broken = True
+            raise
+        finally:
+            elaps = (time.time() - ts) * 1000
+            self.discovery_stats['refreshes'] += 1
+            self.discovery_stats['last_duration_ms'] = elaps
+            self.discovery_stats['total_duration_ms'] += elaps
+            ledger_metrics.DISCOVERY_DURATION.labels(channel=self.channel_name).observe(elaps / 1000)
+
+        self.retired_nodes.extend((time.time(), node) for node in retired)
+        changed = signature != self.discovery_signature
+        if changed:
+            self.discovery_stats['changes'] += 1
+            ledger_metrics.DISCOVERY_CHANGES.labels(channel=self.channel_name).inc()
+
+        self.discovery_signature = signature
+        self.discovered_at = time.time()
+        self.discovery_expired = False
+
+        logger.info(f'(discovery) {self.channel_name} took {elaps:.2f} ms (topology changed: {changed})')
+
+    def _close_retired_nodes(self, grace=RETIRED_NODES_GRACE_SECONDS):
+        now = time.time()
+        nodes = [node for retired_at, node in self.retired_nodes if now - retired_at >= grace]
+        if not nodes:
+            return
+        self.retired_nodes = [(retired_at, node) for retired_at, node in self.retired_nodes
+                              if now - retired_at < grace]
+        try:
+            self.run(_close_nodes(nodes), timeout=settings.LEDGER_CONNECTION_HEALTH_CHECK_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.warning(f'Failed to close the retired peers of ledger connection {self.channel_name}: {e}')
+
+    def check(self):
+        """Check the local peer still answers and has joined the channel.
+
+        The connection is marked as broken if the check fails.
+        """
+        try:
+            self.run(
+                _check_peer_channel(self.client, self.user, self.channel_name),
+                timeout=settings.LEDGER_CONNECTION_HEALTH_CHECK_TIMEOUT_SECONDS
+            )
+        except Exception:
+            self.broken = True
+            raise
+        self.last_checked_at = time.time()
+
+    def needs_check(self):
+        interval = settings.LEDGER_CONNECTION_HEALTH_CHECK_INTERVAL_SECONDS
+        return self.last_checked_at is None or time.time() - self.last_checked_at > interval
+
+    def close(self):
+        if not self._thread.is_alive():
+            return
+
+        try:
+            if self.commit_tracker is not None:
+                self.loop.call_soon_threadsafe(self.commit_tracker.stop)
+            self._close_retired_nodes(grace=0)
+            if self.client is not None:
+                self.run(
+                    self.client.close_grpc_channels(),
+                    timeout=settings.LEDGER_CONNECTION_HEALTH_CHECK_TIMEOUT_SECONDS
+                )
+        except Exception as e:
+            logger.warning(f'Failed to close gRPC channels of ledger connection {self.channel_name}: {e}')
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+
+
+def _get_connection_lock(channel_name):
+    with connections_lock:
+        if channel_name not in connections_locks:
+            connections_locks[channel_name] = threading.Lock()
+        return connections_locks[channel_name]
+
+
+def get_connection(channel_name):
+    """Return the pooled connection to `channel_name`.
+
+    The connection is created on first use, and transparently re-created when it has been marked
+    as broken, fails its periodic health check, or was inherited from a parent process.
+    Channel discovery results are cached for `LEDGER_DISCOVERY_TTL_SECONDS`.
+    """
+    with _get_connection_lock(channel_name):
+        connection = connections.get(channel_name)
+
+        if connection is not None and connection.pid != os.getpid():
+            # The connection was created before a fork: its loop thread and gRPC channels
+            # do not exist in this process, so they must not be reused nor closed.
+            connection = None
+
+        if connection is not None and not connection.broken and connection.needs_check():
+            try:
+                connection.check()
+            except Exception as e:
+                logger.warning(f'Ledger connection health check failed for {channel_name}: {e}')
+
+        if connection is not None and not connection.broken and connection.needs_discovery():
+            try:
+                connection.refresh_discovery()
+            except Exception as e:
+                logger.warning(f'Ledger discovery failed for {channel_name}: {e}')
+
+        if connection is not None and connection.broken:
+            logger.info(f'Re-creating ledger connection for {channel_name}')
+            connection.close()
+            connection = None
+
+        if connection is None:
+            connection = LedgerConnection(channel_name)
+            try:
+                connection.connect()
+            except Exception:
+                connection.close()
+                connections.pop(channel_name, None)
+                raise
+            connections[channel_name] = connection
+            logger.info(f'Created ledger connection for {channel_name}')
+
+        return connection
+
+
+def get_current_connection(channel_name):
+    """Return the connection to `channel_name` whose loop runs the current coroutine."""
+    connection = getattr(_loop_local, 'connection', None)
+    if connection is None or connection.channel_name != channel_name:
+        raise RuntimeError(f'Ledger coroutines for {channel_name} must run on its connection loop')
+    return connection
+
+
+def invalidate_connection(channel_name):
+    """Mark the pooled connection to `channel_name` as broken: the next call will reconnect."""
+    connection = connections.get(channel_name)
+    if connection is not None:
+        connection.broken = True
+
+
+def invalidate_discovery(channel_name):
+    """Force a discovery refresh of the pooled connection to `channel_name` on the next call."""
+    connection = connections.get(channel_name)
+    if connection is not None:
+        connection.discovery_expired = True
+
+
+def close_connections():
+    for channel_name in list(connections.keys()):
+        with _get_connection_lock(channel_name):
+            connection = connections.pop(channel_name, None)
+            if connection is not None and connection.pid == os.getpid():
+                connection.close()
+
+
+async def _query_peer_channels(client, user, peer):
+    response = await client.query_channels(
+        requestor=user,
+        peers=[peer],
+        decode=True
+    )
+    return [ch.channel_id for ch in response.channels]
+
 
+async def _check_peer_channel(client, user, channel_name):
+    peer = client._peers[settings.LEDGER_PEER_NAME]
+    channels = await _query_peer_channels(client, user, peer)
+
+    if channel_name not in channels:
+        raise Exception(f'Peer has not joined channel: {channel_name}')
+
+
+async def _create_client(channel_name, user, discover=True):
     client = Client()
 
     # Add peer from backend ledger config file
@@ -73,63 +380,86 @@ def _get_hfc(channel_name):
     })
     client._peers[settings.LEDGER_PEER_NAME] = peer
 
-    # Check peer has joined channel
-
-    response = loop.run_until_complete(
-        client.query_channels(
-            requestor=user,
-            peers=[peer],
-            decode=True
-        )
+    try:
+        # Check peer has joined channel
+        await _check_peer_channel(client, user, channel_name)
+
+        client.new_channel(channel_name)
+
+        # This part is commented because `query_committed_chaincodes` is not implemented in
+        # the last version of fabric-sdk-py
+
+        # chaincode_name = settings.LEDGER_CHANNELS[channel_name]['chaincode']['name']
+
+        # /!\ New chaincode lifecycle.
+
+        # Check chaincode is committed in the channel
+        # responses = await client.query_committed_chaincodes(
+        #     requestor=user,
+        #     channel_name=channel_name,
+        #     peers=[peer],
+        #     decode=True
+        # )
+        # chaincodes = [cc.name
+        #               for resp in responses
+        #               for cc in resp.chaincode_definitions]
+        # if chaincode_name not in chaincodes:
+        #     raise Exception(f'Chaincode : {chaincode_name}'
+        #                     f' is not committed in the channel :  {channel_name}')
+
+        if discover:
+            await _update_discovery(client, user, channel_name)
+    except Exception:
+        await client.close_grpc_channels()
+        raise
+
+    return client
+
+
+async def _update_discovery(client, user, channel_name, previous_signature=None, retired=None):
+    """Discover orderers and peers from channel discovery and load them in `client`.
+
+    The client peers and orderers are only rebuilt if the discovery results differ from the ones
+    identified by `previous_signature`. The replaced ones are added to `retired`, to be closed by the
+    caller, or closed now if `retired` is None. Return the signature of the new results.
+    """
+    peer = client._peers[settings.LEDGER_PEER_NAME]
+    channel = client.get_channel(channel_name)
+
+    results = await channel._discovery(
+        user,
+        peer,
+        config=True,
+        local=False,
+        interests=[{'chaincodes': [{'name': "_lifecycle"}]}]
     )
 
-    channels = [ch.channel_id for ch in response.channels]
+    results = _deserialize_discovery(results)
 
-    if channel_name not in channels:
-        raise Exception(f'Peer has not joined channel: {channel_name}')
+    _validate_channels(channel_name, results)
 
-    channel = client.new_channel(channel_name)
-
-    # This part is commented because `query_committed_chaincodes` is not implemented in
-    # the last version of fabric-sdk-py
-
-    # chaincode_name = settings.LEDGER_CHANNELS[channel_name]['chaincode']['name']
-
-    # /!\ New chaincode lifecycle.
-
-    # Check chaincode is committed in the channel
-    # responses = loop.run_until_complete(
-    #     client.query_committed_chaincodes(
-    #         requestor=user,
-    #         channel_name=channel_name,
-    #         peers=[peer],
-    #         decode=True
-    #     )
-    # )
-    # chaincodes = [cc.name
-    #               for resp in responses
-    #               for cc in resp.chaincode_definitions]
-    # if chaincode_name not in chaincodes:
-    #     raise Exception(f'Chaincode : {chaincode_name}'
-    #                     f' is not committed in the channel :  {channel_name}')
-
-    # Discover orderers and peers from channel discovery
-    results = loop.run_until_complete(
-        channel._discovery(
-            user,
-            peer,
-            config=True,
-            local=False,
-            interests=[{'chaincodes': [{'name': "_lifecycle"}]}]
-        )
-    )
+    signature = _get_discovery_signature(results)
+    if signature == previous_signature:
+        return signature
 
-    results = _deserialize_discovery(results)
+    stale = _update_client_with_discovery(client, results)
+    if retired is None:
+        await _close_nodes(stale)
+    else:
+        retired.extend(stale)
 
-    _validate_channels(channel_name, results)
-    _update_client_with_discovery(client, results)
+    return signature
+
+
+async def _close_nodes(nodes):
+    for node in nodes:
+        await node._channel.close()
 
-    return loop, client, user
+
+def _get_discovery_signature(discovery_results):
+    return hashlib.sha256(
+        json.dumps(discovery_results, sort_keys=True, default=str).encode()
+    ).hexdigest()
 
 
 def _validate_channels(channel_name, discovery_results):
@@ -146,13 +476,19 @@ def _validate_channels(channel_name, discovery_results):
 
 
 def _update_client_with_discovery(client, discovery_results):
+    """Replace the discovered peers and orderers of `client`.
+
+    Return the peers and orderers which are no longer used by the client.
+    """
+    peers = {settings.LEDGER_PEER_NAME: client._peers[settings.LEDGER_PEER_NAME]}
+    orderers = {}
 
     # Get all msp tls root cert files
     tls_root_certs = {}
 
     for mspid, msp_info in discovery_results['config']['msps'].items():
         tls_root_certs[mspid] = base64.decodebytes(
-            msp_info['tls_root_certs'].pop().encode()
+            msp_info['tls_root_certs'][-1].encode()
         )
 
     # Load one peer per msp for endorsing transaction
@@ -178,7 +514,7 @@ def _update_client_with_discovery(client, discovery_results):
                     'clientCert': {'path': settings.LEDGER_PEER_TLS_CLIENT_CERT}
                 })
 
-            client._peers[peer_info['mspid']] = peer
+            peers[peer_info['mspid']] = peer
 
     # Load one orderer for broadcasting transaction
     orderer_mspid, orderer_info = list(discovery_results['config']['orderers'].items())[0]
@@ -198,7 +534,17 @@ def _update_client_with_discovery(client, discovery_results):
             'clientCert': {'path': settings.LEDGER_PEER_TLS_CLIENT_CERT}
         })
 
-    client._orderers[orderer_mspid] = orderer
+    orderers[orderer_mspid] = orderer
+
+    stale = [p for name, p in client._peers.items() if peers.get(name) is not p]
+    stale.extend(client._orderers.values())
+
+    # Swap the dictionaries instead of updating them in place: they are read from other threads
+    # while the discovery is refreshed on the connection loop.
+    client._peers = peers
+    client._orderers = orderers
+
+    return stale
 
 
 def _deserialize_discovery(response):
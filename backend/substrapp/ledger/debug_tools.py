@@ -1,16 +1,66 @@
+import collections
 import json
-from substrapp.ledger.connection import get_hfc
+import os
+from substrapp.ledger.api import LOG_TUPLE_INVOKE_FCNS
+from substrapp.ledger.cache import get_transaction_fcn
+from substrapp.ledger.connection import get_connection
 from pathlib import Path
 from django.conf import settings
-from typing import Generator, Dict, List
+from hfc.protos.common.common_pb2 import BlockMetadataIndex
+from hfc.protos.peer.transaction_pb2 import TxValidationCode
+from typing import Generator, Dict, List, Optional, Tuple
 
+VALID = TxValidationCode.Value('VALID')
+MVCC_READ_CONFLICT = TxValidationCode.Value('MVCC_READ_CONFLICT')
+PHANTOM_READ_CONFLICT = TxValidationCode.Value('PHANTOM_READ_CONFLICT')
+CHECKPOINT_FILE = '.checkpoint'
 
-def dump_all_transactions(channel_name: str, start_block: int, end_block: int, out_folder: str) -> None:
-    """Dump all the blocks from `start_block` to `end_block` as JSON files in `out_folder`.
-    Files are named "{block_number},{transaction_index}.json", e.g. "0123,0.json"
+# Namespaces of the system chaincodes, read by every transaction
+SYSTEM_NAMESPACES = ('lscc', '_lifecycle')
+
+# Backend call sites of the chaincode functions, see `analyze_conflicts`
+LOG_TUPLE_CALL_SITES = {'doing': 'log_start_tuple', 'done': 'log_success_tuple', 'failed': 'log_fail_tuple'}
+CALL_SITES = {
+    **{fcn: LOG_TUPLE_CALL_SITES[status] for status, fcns in LOG_TUPLE_INVOKE_FCNS.items() for fcn in fcns.values()},
+    'createComputePlan': 'ledger.assets.create_computeplan',
+    'updateComputePlan': 'ledger.assets.update_computeplan',
+    'cancelComputePlan': 'views.computeplan.cancel',
+    'updateDataSample': 'ledger.assets.update_datasample',
+    'updateDataManager': 'ledger.assets.update_datamanager',
+}
+
+
+def dump_all_transactions(channel_name: str, start_block: int, end_block: int, out_folder: str,
+                          output_format: str = 'json', resume: bool = False) -> None:
+    """Dump all the transactions from `start_block` to `end_block` in `out_folder`.
+
+    With the 'json' format, files are named "{block_number},{transaction_index}.json", e.g. "0123,0.json".
+    With the 'ndjson' format, transactions are appended one per line to "transactions.ndjson".
+
+    With `resume`, the dump restarts after the last block processed by the previous dump in `out_folder`.
     """
-    for block_number, tx_index, tx in get_transactions(channel_name, start_block, end_block):
-        dump_transaction(block_number, tx_index, tx, out_folder)
+    path = Path(out_folder)
+    path.mkdir(parents=True, exist_ok=True)
+    checkpoint = path / CHECKPOINT_FILE
+    if resume:
+        start_block = max(start_block, read_checkpoint(checkpoint) + 1)
+    elif checkpoint.exists():
+        checkpoint.unlink()
+
+    if output_format == 'ndjson':
+        with open(path / 'transactions.ndjson', 'a' if resume else 'w') as ndjson_file:
+            for block_number, block in scan_blocks(channel_name, start_block, end_block):
+                for tx_index, tx in get_block_transactions(block_number, block):
+                    ndjson_file.write(json.dumps(_transaction_record(block_number, tx_index, tx)) + '\n')
+                ndjson_file.flush()
+                write_checkpoint(checkpoint, block_number)
+    elif output_format == 'json':
+        for block_number, block in scan_blocks(channel_name, start_block, end_block):
+            for tx_index, tx in get_block_transactions(block_number, block):
+                dump_transaction(block_number, tx_index, tx, out_folder)
+            write_checkpoint(checkpoint, block_number)
+    else:
+        raise ValueError(f'output_format should either be "json" or "ndjson", "{output_format}" given')
 
 
 def get_mvcc_transactions(channel_name: str, start_block: int, end_block: int) -> List[Dict]:
@@ -28,14 +78,13 @@ def get_mvcc_transactions(channel_name: str, start_block: int, end_block: int) -
       # }
     """
     res = []
-    for block_number in range(start_block, end_block + 1):
-        block = get_block(channel_name, block_number)
+    for block_number, block in scan_blocks(channel_name, start_block, end_block):
+        validation_codes = block['metadata']['metadata'][BlockMetadataIndex.Value('TRANSACTIONS_FILTER')]
         for tx_index, tx in enumerate(block['data']['data']):
             tx_id = tx['payload']['header']['channel_header']['tx_id']
             if not tx_id:
                 continue
-            tx = get_transaction(channel_name, tx_id)
-            if tx['validation_code'] == 11:  # MVCC_READ_CONFLICT = 11
+            if validation_codes[tx_index] == MVCC_READ_CONFLICT:
                 res.append({
                     'block_number': block_number,
                     'tx_index': tx_index,
@@ -44,50 +93,226 @@ def get_mvcc_transactions(channel_name: str, start_block: int, end_block: int) -
     return res
 
 
-def get_ledger_height(channel_name: str) -> int:
+def analyze_conflicts(channel_name: str, start_block: int, end_block: int, top: int = 20,
+                      window_gap: int = 10) -> Dict:
+    """Rank what causes the MVCC and phantom read conflicts between `start_block` and `end_block`.
+
+    The read sets of the conflicted transactions are compared with the writes of the valid transactions
+    seen so far: a key is blamed when its read version is older than its last write. Writes made before
+    `start_block` are unknown, so scan from early enough to catch them.
+
+    Return the `top` keys, chaincode functions and backend call sites by number of conflicts, and for
+    each hot key its contention windows: runs of conflicts at most `window_gap` blocks apart.
+
+    Example usage:
+
+      report = analyze_conflicts('mychannel', 0, get_ledger_height('mychannel') - 1)
+      report['keys'][0]
+      # {'key': '\\x00traintuple~worker~status\\x00...', 'namespace': 'mycc', 'conflicts': 12, 'windows': [...]}
+    """
+    last_writes = {}
+    key_conflicts = collections.defaultdict(list)
+    fcn_stats = collections.defaultdict(collections.Counter)
+    validation_codes_count = collections.Counter()
+
+    for block_number, block in scan_blocks(channel_name, start_block, end_block):
+        validation_codes = block['metadata']['metadata'][BlockMetadataIndex.Value('TRANSACTIONS_FILTER')]
+        for tx_num, tx in enumerate(block['data']['data']):
+            rwsets = get_transaction_rwsets(tx)
+            if rwsets is None:
+                continue  # config transaction
+
+            code = validation_codes[tx_num]
+            fcn = get_transaction_fcn(tx) or 'unknown'
+            validation_codes_count[TxValidationCode.Name(code)] += 1
+            fcn_stats[fcn]['transactions'] += 1
+
+            if code == VALID:
+                for namespace, rwset in rwsets:
+                    for write in rwset['writes']:
+                        last_writes[(namespace, write['key'])] = (block_number, tx_num)
+            elif code in (MVCC_READ_CONFLICT, PHANTOM_READ_CONFLICT):
+                fcn_stats[fcn]['conflicts'] += 1
+                for key in _get_conflicting_keys(rwsets, last_writes, code):
+                    key_conflicts[key].append((block_number, fcn))
+
+    keys = sorted(key_conflicts.items(), key=lambda item: len(item[1]), reverse=True)[:top]
+    functions = sorted(fcn_stats.items(), key=lambda item: item[1]['conflicts'], reverse=True)
+    call_sites = collections.Counter()
+    for fcn, stats in functions:
+        call_sites[CALL_SITES.get(fcn, fcn)] += stats['conflicts']
+
+    return {
+        'validation_codes': dict(validation_codes_count),
+        'keys': [
+            {
+                'namespace': namespace,
+                'key': key,
+                'conflicts': len(conflicts),
+                'functions': dict(collections.Counter(fcn for _, fcn in conflicts)),
+                'windows': _get_contention_windows([block_number for block_number, _ in conflicts], window_gap),
+            }
+            for (namespace, key), conflicts in keys
+        ],
+        'functions': [
+            {
+                'fcn': fcn,
+                'call_site': CALL_SITES.get(fcn, fcn),
+                'transactions': stats['transactions'],
+                'conflicts': stats['conflicts'],
+                'conflict_rate': stats['conflicts'] / stats['transactions'],
+            }
+            for fcn, stats in functions[:top] if stats['conflicts']
+        ],
+        'call_sites': [
+            {'call_site': call_site, 'conflicts': conflicts}
+            for call_site, conflicts in call_sites.most_common(top) if conflicts
+        ],
+    }
+
+
+def get_transaction_rwsets(tx: Dict) -> Optional[List[Tuple[str, Dict]]]:
+    """Return the (namespace, KV read/write set) of a decoded endorser transaction, None for other ones."""
+    try:
+        actions = tx['payload']['data']['actions']
+    except (KeyError, TypeError):
+        return None
+
+    rwsets = []
+    for action in actions:
+        results = action['payload']['action']['proposal_response_payload']['extension']['results']
+        for ns_rwset in results['ns_rwset']:
+            if ns_rwset['namespace'] not in SYSTEM_NAMESPACES:
+                rwsets.append((ns_rwset['namespace'], ns_rwset['rwset']))
+    return rwsets
+
+
+def _get_version(read: Dict) -> Optional[Tuple[int, int]]:
+    if read['version'] is None:
+        return None
+    return int(read['version']['block_num']), int(read['version']['tx_num'])
+
+
+def _get_conflicting_keys(rwsets: List[Tuple[str, Dict]], last_writes: Dict, code: int) -> List[Tuple[str, str]]:
+    keys = []
+    for namespace, rwset in rwsets:
+        if code == MVCC_READ_CONFLICT:
+            for read in rwset['reads']:
+                last_write = last_writes.get((namespace, read['key']))
+                if last_write is not None and last_write != _get_version(read):
+                    keys.append((namespace, read['key']))
+        else:
+            # a key was added or removed in a range read by the transaction
+            for range_query in rwset['range_queries_info']:
+                keys.append((namespace, f"{range_query['start_key']}..{range_query['end_key']}"))
+    return keys
+
+
+def _get_contention_windows(block_numbers: List[int], gap: int) -> List[Dict]:
+    windows = []
+    for block_number in block_numbers:
+        if windows and block_number - windows[-1]['end_block'] <= gap:
+            windows[-1]['end_block'] = block_number
+            windows[-1]['conflicts'] += 1
+        else:
+            windows.append({'start_block': block_number, 'end_block': block_number, 'conflicts': 1})
+    return windows
+
+
+def get_ledger_height(channel_name: str, timeout: Optional[float] = None) -> int:
     """Return the highest block number in the ledger (aka ledger height)"""
-    with get_hfc(channel_name) as (loop, client, user):
-        info = loop.run_until_complete(client.query_info(
-            user,
-            channel_name,
-            [settings.LEDGER_PEER_NAME],
-            decode=True))
-        return info.height
+    connection = get_connection(channel_name)
+    info = connection.run(connection.client.query_info(
+        connection.user,
+        channel_name,
+        [settings.LEDGER_PEER_NAME],
+        decode=True), timeout)
+    return info.height
+
+
+def scan_blocks(channel_name: str, start_block: int, end_block: int,
+                window: Optional[int] = None) -> Generator[Tuple[int, Dict], None, None]:
+    """Yield the decoded blocks from `start_block` to `end_block`, in order.
+
+    Blocks are fetched concurrently on the pooled connection to `channel_name`, with at most `window`
+    (default LEDGER_MAX_CONCURRENT_QUERIES) requests in flight.
+    """
+    window = window or settings.LEDGER_MAX_CONCURRENT_QUERIES
+    connection = get_connection(channel_name)
+    block_numbers = iter(range(start_block, end_block + 1))
+    in_flight = collections.deque()
+
+    def fetch_next():
+        block_number = next(block_numbers, None)
+        if block_number is not None:
+            in_flight.append((block_number, connection.submit(_query_block(connection, channel_name, block_number))))
+
+    for _ in range(window):
+        fetch_next()
+
+    try:
+        while in_flight:
+            block_number, future = in_flight.popleft()
+            block = future.result()
+            fetch_next()
+            yield block_number, block
+    finally:
+        for _, future in in_flight:
+            future.cancel()
 
 
 def get_transactions(channel_name: str, start_block: int, end_block: int) -> Generator:
-    for block_number in range(start_block, end_block + 1):
-        block = get_block(channel_name, block_number)
-        for tx_index, tx in enumerate(block['data']['data']):
-            if "actions" not in tx['payload']['data']:
-                # not an invoke
-                continue
-            input = tx['payload']['data']['actions'][0]['payload']['chaincode_proposal_payload']['input']
-            if ('ApproveChaincode' not in str(input)):
-                print(f"block: {block_number}, tx_index: {tx_index}")
-                yield block_number, tx_index, tx
+    for block_number, block in scan_blocks(channel_name, start_block, end_block):
+        yield from get_block_transactions(block_number, block)
+
+
+def get_block_transactions(block_number: int, block: Dict) -> Generator:
+    """Yield the chaincode invoke transactions of `block`, with their index."""
+    for tx_index, tx in enumerate(block['data']['data']):
+        if "actions" not in tx['payload']['data']:
+            # not an invoke
+            continue
+        input = tx['payload']['data']['actions'][0]['payload']['chaincode_proposal_payload']['input']
+        if ('ApproveChaincode' not in str(input)):
+            yield tx_index, tx
+
+
+async def _query_block(connection, channel_name: str, block_number: int) -> Dict:
+    return await connection.client.query_block(
+        connection.user,
+        channel_name,
+        [settings.LEDGER_PEER_NAME],
+        str(block_number),
+        decode=True)
 
 
 def get_block(channel_name: str, block_number: int) -> Dict:
-    with get_hfc(channel_name) as (loop, client, user):
-        block = loop.run_until_complete(client.query_block(
-            user,
-            channel_name,
-            [settings.LEDGER_PEER_NAME],
-            str(block_number),
-            decode=True))
-        return block
+    connection = get_connection(channel_name)
+    return connection.run(_query_block(connection, channel_name, block_number))
 
 
 def get_transaction(channel_name: str, tx_id: str) -> Dict:
-    with get_hfc(channel_name) as (loop, client, user):
-        transaction = loop.run_until_complete(client.query_transaction(
-            user,
-            channel_name,
-            [settings.LEDGER_PEER_NAME],
-            tx_id=tx_id,
-            decode=True))
-        return transaction
+    connection = get_connection(channel_name)
+    return connection.run(connection.client.query_transaction(
+        connection.user,
+        channel_name,
+        [settings.LEDGER_PEER_NAME],
+        tx_id=tx_id,
+        decode=True))
+
+
+def read_checkpoint(checkpoint: Path) -> int:
+    """Return the last block number saved in `checkpoint`, -1 if there is none."""
+    try:
+        return int(checkpoint.read_text())
+    except (FileNotFoundError, ValueError):
+        return -1
+
+
+def write_checkpoint(checkpoint: Path, block_number: int) -> None:
+    tmp = checkpoint.with_suffix('.tmp')
+    tmp.write_text(str(block_number))
+    os.replace(str(tmp), str(checkpoint))
 
 
 def dump_transaction(block_number: int, tx_index: int, tx: Dict, out_folder: str) -> None:
@@ -97,6 +322,10 @@ def dump_transaction(block_number: int, tx_index: int, tx: Dict, out_folder: str
         json.dump(_make_jsonifiable(tx), json_file, indent=2)
 
 
+def _transaction_record(block_number: int, tx_index: int, tx: Dict) -> Dict:
+    return {'block_number': block_number, 'tx_index': tx_index, 'transaction': _make_jsonifiable(tx)}
+
+
 def _make_jsonifiable(x: Dict) -> Dict:
     if type(x) == bytes:
         return str(x)
@@ -65,6 +65,11 @@ class LedgerUnavailable(LedgerError):
     status = status.HTTP_503_SERVICE_UNAVAILABLE
 
 
+class LedgerCircuitOpen(LedgerUnavailable):
+    """Ledger calls fail fast because the last ones could not reach the peer."""
+    pass
+
+
 class LedgerBadRequest(LedgerError):
     """Invalid request."""
     status = status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,536 @@
+"""In-memory stand-in for the chaincode and the peer, to benchmark the ledger layer without a Fabric network.
+
+    chaincode = generate_chaincode(traintuples=5000)
+    with use_fake_ledger({'mychannel': chaincode}, latency=0.005):
+        query_ledger('mychannel', 'queryTraintuples')
+
+`use_fake_ledger` installs `FakeLedgerConnection`s in the connection pool, so the whole `substrapp.ledger.api`
+stack (connection loops, retries, cache, metrics, response parsing) runs as with a real peer.
+
+Invokes follow the Fabric transaction flow: the function is simulated against the current state, which
+records its read and write sets, then committed after `commit_delay`. The commit fails with
+MVCC_READ_CONFLICT if a key it read was written in between.
+"""
+import asyncio
+import base64
+import collections
+import contextlib
+import json
+import re
+import threading
+import uuid
+
+from substrapp.ledger import connection as ledger_connection
+
+ORG = 'MyOrg1MSP'
+# Requestor of the calls, ignored by the fake client
+FAKE_USER = 'fake-user'
+
+# Asset names in the chaincode function names
+KINDS = {
+    'Objective': 'objective',
+    'DataManager': 'data_manager',
+    'DataSample': 'data_sample',
+    'Algo': 'algo',
+    'CompositeAlgo': 'composite_algo',
+    'AggregateAlgo': 'aggregate_algo',
+    'Traintuple': 'traintuple',
+    'CompositeTraintuple': 'composite_traintuple',
+    'Aggregatetuple': 'aggregatetuple',
+    'Testtuple': 'testtuple',
+    'ComputePlan': 'compute_plan',
+    'Node': 'node',
+}
+TRAIN_KINDS = ['traintuple', 'composite_traintuple', 'aggregatetuple']
+
+# Tuple names in the log functions and the worker~status indexes
+LOG_KINDS = {
+    'Train': 'traintuple',
+    'CompositeTrain': 'composite_traintuple',
+    'Aggregate': 'aggregatetuple',
+    'Test': 'testtuple',
+}
+INDEX_KINDS = {
+    'traintuple': 'traintuple',
+    'compositeTraintuple': 'composite_traintuple',
+    'aggregatetuple': 'aggregatetuple',
+    'testtuple': 'testtuple',
+}
+STATUS_TRANSITIONS = {
+    'Start': ('todo', 'doing'),
+    'Success': ('doing', 'done'),
+    'Fail': ('doing', 'failed'),
+}
+
+COMPUTE_PLAN_TUPLES = {
+    'traintuples': 'traintuple',
+    'composite_traintuples': 'composite_traintuple',
+    'aggregatetuples': 'aggregatetuple',
+    'testtuples': 'testtuple',
+}
+
+
+def _error(status, message, key=None):
+    error = {'error': message, 'status': status}
+    if key is not None:
+        error['key'] = key
+    return error
+
+
+class Transaction(object):
+    """Read and write sets of a chaincode function call."""
+
+    def __init__(self, chaincode):
+        self.chaincode = chaincode
+        self.reads = {}
+        self.writes = collections.OrderedDict()
+        # position in the list of results, from the bookmark
+        self.offset = 0
+
+    def get(self, key, kind=None):
+        self.reads.setdefault(key, self.chaincode.versions.get(key, 0))
+        if key in self.writes:
+            asset_kind, asset = self.writes[key]
+        else:
+            asset_kind, asset = self.chaincode.assets.get(key, (None, None))
+        if kind is not None and asset_kind != kind:
+            return None
+        return asset
+
+    def put(self, kind, asset):
+        self.writes[asset['key']] = (kind, asset)
+
+
+class FakeChaincode(object):
+    """State and functions of the chaincode of one channel.
+
+    List queries return bookmark pages of `page_size` results, or whole lists if `page_size` is None.
+    """
+
+    # Functions with their own implementation, the others are derived from their name
+    FUNCTIONS = {
+        'queryFilter': '_query_filter',
+        'queryModels': '_query_models',
+        'queryModelDetails': '_query_model_details',
+        'queryModelPermissions': '_query_model_permissions',
+        'queryDataset': '_query_dataset',
+        'queryObjectiveLeaderboard': '_query_objective_leaderboard',
+        'queryNodes': '_query_nodes',
+        'createComputePlan': '_create_compute_plan',
+        'updateComputePlan': '_update_compute_plan',
+        'cancelComputePlan': '_cancel_compute_plan',
+        'updateDataManager': '_update_data_manager',
+        'updateDataSample': '_update_data_sample',
+    }
+
+    def __init__(self, page_size=None, org=ORG):
+        self.page_size = page_size
+        self.org = org
+        self.assets = {}
+        self.versions = {}
+        self.keys_by_kind = collections.defaultdict(dict)
+        self.block_number = 0
+        self.lock = threading.Lock()
+
+    # Transaction flow
+
+    def execute(self, fcn, args):
+        """Simulate `fcn` against the current state, return its response and transaction."""
+        tx = Transaction(self)
+        with self.lock:
+            try:
+                response = self._dispatch(tx, fcn, args or {})
+            except (KeyError, TypeError, ValueError) as e:
+                response = _error(400, f'invalid arguments for {fcn}: {e}')
+        return response, tx
+
+    def commit(self, tx):
+        """Apply the writes of `tx` unless a key it read changed since, return its validation code."""
+        with self.lock:
+            self.block_number += 1
+            if any(self.versions.get(key, 0) != version for key, version in tx.reads.items()):
+                return 'MVCC_READ_CONFLICT'
+            self._apply(tx.writes)
+        return 'VALID'
+
+    def _apply(self, writes):
+        for key, (kind, asset) in writes.items():
+            self.assets[key] = (kind, asset)
+            self.versions[key] = self.versions.get(key, 0) + 1
+            self.keys_by_kind[kind][key] = None
+
+    def add(self, kind, asset):
+        """Store `asset` directly, e.g. to populate the state before a benchmark."""
+        with self.lock:
+            self._apply({asset['key']: (kind, asset)})
+
+    # Functions
+
+    def _dispatch(self, tx, fcn, args):
+        if isinstance(args, dict) and args.get('bookmark'):
+            bookmark = json.loads(base64.b64decode(args['bookmark']))
+            args, tx.offset = bookmark['args'], bookmark['offset']
+
+        if fcn in self.FUNCTIONS:
+            return getattr(self, self.FUNCTIONS[fcn])(tx, args)
+
+        if fcn.startswith('query') and fcn[5:] in KINDS:
+            return self._query_asset(tx, KINDS[fcn[5:]], args['key'])
+        if fcn.startswith('query') and fcn[5:-1] in KINDS:
+            keys = list(self.keys_by_kind[KINDS[fcn[5:-1]]])
+            return self._page(tx, fcn, args, keys)
+        if fcn.startswith('register') and fcn[8:] in KINDS:
+            return self._register(tx, KINDS[fcn[8:]], args)
+        if fcn.startswith('create') and fcn[6:] in KINDS:
+            return self._create_tuple(tx, KINDS[fcn[6:]], args)
+
+        match = re.match(r'^log(Start|Success|Fail)(\w+)$', fcn)
+        if match and match.group(2) in LOG_KINDS:
+            return self._log(tx, LOG_KINDS[match.group(2)], STATUS_TRANSITIONS[match.group(1)], args)
+
+        return _error(400, f'unknown function {fcn}')
+
+    def _page(self, tx, fcn, args, keys, transform=None):
+        end = len(keys) if self.page_size is None else tx.offset + self.page_size
+        results = [tx.get(key) for key in keys[tx.offset:end]]
+        if transform is not None:
+            results = [transform(result) for result in results]
+        if self.page_size is None:
+            return results
+
+        bookmark = ''
+        if end < len(keys):
+            bookmark = base64.b64encode(json.dumps({'fcn': fcn, 'args': args, 'offset': end}).encode()).decode()
+        return {'results': results, 'bookmark': bookmark}
+
+    def _query_asset(self, tx, kind, key):
+        asset = tx.get(key, kind)
+        if asset is None:
+            return _error(404, f'{kind} {key} not found')
+        return asset
+
+    def _register(self, tx, kind, args):
+        keys = args['keys'] if 'keys' in args else [args['key']]
+        for key in keys:
+            if tx.get(key) is not None:
+                return _error(409, f'{kind} {key} already exists', key=key)
+            asset = {k: v for k, v in args.items() if k != 'keys'}
+            asset.update({'key': key, 'owner': self.org})
+            asset.setdefault('permissions', {'process': {'public': True, 'authorized_ids': []}})
+            tx.put(kind, asset)
+        return {'keys': keys} if 'keys' in args else {'key': keys[0]}
+
+    def _create_tuple(self, tx, kind, args, compute_plan_key=''):
+        if tx.get(args['key']) is not None:
+            return _error(409, f'{kind} {args["key"]} already exists', key=args['key'])
+
+        asset = dict(args)
+        asset.update({
+            'creator': self.org,
+            'status': 'todo',
+            'log': '',
+            'rank': args.get('rank', 0),
+            'compute_plan_key': args.get('compute_plan_key') or compute_plan_key,
+            'algo': {'key': args.get('algo_key')},
+        })
+        if kind != 'aggregatetuple':
+            data_manager = tx.get(args.get('data_manager_key'), 'data_manager') or {}
+            asset['dataset'] = {
+                'key': args.get('data_manager_key'),
+                'worker': data_manager.get('owner', self.org),
+                'data_sample_keys': args.get('data_sample_keys', []),
+            }
+        tx.put(kind, asset)
+        return {'key': args['key']}
+
+    def _log(self, tx, kind, transition, args):
+        asset = tx.get(args['key'], kind)
+        if asset is None:
+            return _error(404, f'{kind} {args["key"]} not found')
+        from_status, to_status = transition
+        if asset['status'] != from_status:
+            return _error(400, f'{kind} {args["key"]} cannot change status from {asset["status"]} to {to_status}')
+        asset = dict(asset, **{k: v for k, v in args.items() if k != 'key'})
+        asset['status'] = to_status
+        tx.put(kind, asset)
+        return asset
+
+    def _query_filter(self, tx, args):
+        index_name, attributes = args['indexName'], args['attributes'].split(',')
+        kind = INDEX_KINDS[index_name.split('~')[0]]
+        worker, status = attributes
+        keys = [
+            key for key in self.keys_by_kind[kind]
+            if _get_worker(self.assets[key][1]) == worker and self.assets[key][1]['status'] == status
+        ]
+        return self._page(tx, 'queryFilter', args, keys)
+
+    def _query_models(self, tx, args):
+        keys = [key for kind in TRAIN_KINDS for key in self.keys_by_kind[kind]]
+        return self._page(tx, 'queryModels', args, keys, transform=lambda t: {'traintuple': t})
+
+    def _query_model_details(self, tx, args):
+        for kind in TRAIN_KINDS:
+            asset = tx.get(args['key'], kind)
+            if asset is not None:
+                testtuples = [
+                    self.assets[key][1] for key in self.keys_by_kind['testtuple']
+                    if self.assets[key][1].get('traintuple_key') == args['key']
+                ]
+                return {
+                    kind: asset,
+                    'testtuple': next((t for t in testtuples if t.get('certified')), None),
+                    'non_certified_testtuples': [t for t in testtuples if not t.get('certified')],
+                }
+        return _error(404, f'model {args["key"]} not found')
+
+    def _query_model_permissions(self, tx, args):
+        return {'process': {'public': True, 'authorized_ids': []}}
+
+    def _query_dataset(self, tx, args):
+        data_manager = self._query_asset(tx, 'data_manager', args['key'])
+        if 'error' in data_manager:
+            return data_manager
+        samples = [self.assets[key][1] for key in self.keys_by_kind['data_sample']
+                   if args['key'] in self.assets[key][1].get('data_manager_keys', [])]
+        return dict(
+            data_manager,
+            train_data_sample_keys=[s['key'] for s in samples if not s.get('test_only')],
+            test_data_sample_keys=[s['key'] for s in samples if s.get('test_only')],
+        )
+
+    def _query_objective_leaderboard(self, tx, args):
+        objective = self._query_asset(tx, 'objective', args['objective_key'])
+        if 'error' in objective:
+            return objective
+        return {'objective': objective, 'testtuples': []}
+
+    def _query_nodes(self, tx, args):
+        return [{'id': self.org}]
+
+    def _create_compute_plan(self, tx, args):
+        if tx.get(args['key']) is not None:
+            return _error(409, f'compute plan {args["key"]} already exists', key=args['key'])
+        compute_plan = {
+            'key': args['key'],
+            'tag': args.get('tag') or '',
+            'metadata': args.get('metadata') or {},
+            'clean_models': args.get('clean_models', False),
+            'id_to_key': {},
+        }
+        return self._add_compute_plan_tuples(tx, compute_plan, args)
+
+    def _update_compute_plan(self, tx, args):
+        compute_plan = tx.get(args['key'], 'compute_plan')
+        if compute_plan is None:
+            return _error(404, f'compute plan {args["key"]} not found')
+        return self._add_compute_plan_tuples(tx, dict(compute_plan), args)
+
+    def _add_compute_plan_tuples(self, tx, compute_plan, args):
+        for field, kind in COMPUTE_PLAN_TUPLES.items():
+            keys = list(compute_plan.get(f'{kind}_keys') or [])
+            for tuple_args in args.get(field) or []:
+                response = self._create_tuple(tx, kind, tuple_args, compute_plan_key=compute_plan['key'])
+                if 'error' in response:
+                    return response
+                keys.append(tuple_args['key'])
+                if tuple_args.get('id'):
+                    compute_plan['id_to_key'][tuple_args['id']] = tuple_args['key']
+            compute_plan[f'{kind}_keys'] = keys or None
+
+        tuple_count = sum(len(compute_plan[f'{kind}_keys'] or []) for kind in COMPUTE_PLAN_TUPLES.values())
+        compute_plan.update({'status': 'todo', 'tuple_count': tuple_count, 'done_count': 0})
+        tx.put('compute_plan', compute_plan)
+        return compute_plan
+
+    def _cancel_compute_plan(self, tx, args):
+        compute_plan = tx.get(args['key'], 'compute_plan')
+        if compute_plan is None:
+            return _error(404, f'compute plan {args["key"]} not found')
+        compute_plan = dict(compute_plan, status='canceled')
+        tx.put('compute_plan', compute_plan)
+        return compute_plan
+
+    def _update_data_manager(self, tx, args):
+        data_manager = tx.get(args['data_manager_key'], 'data_manager')
+        if data_manager is None:
+            return _error(404, f'data manager {args["data_manager_key"]} not found')
+        tx.put('data_manager', dict(data_manager, objective_key=args['objective_key']))
+        return {'key': args['data_manager_key']}
+
+    def _update_data_sample(self, tx, args):
+        for key in args['keys']:
+            sample = tx.get(key, 'data_sample')
+            if sample is None:
+                return _error(404, f'data sample {key} not found')
+            data_manager_keys = sorted(set(sample.get('data_manager_keys', [])) | set(args['data_manager_keys']))
+            tx.put('data_sample', dict(sample, data_manager_keys=data_manager_keys))
+        return {'keys': args['keys']}
+
+
+def _get_worker(asset):
+    return asset.get('worker') or asset.get('dataset', {}).get('worker')
+
+
+def generate_chaincode(objectives=10, data_managers=10, data_samples=100, algos=50, traintuples=1000,
+                       testtuples=100, compute_plans=10, worker=ORG, todo_ratio=0.5, page_size=None):
+    """Return a chaincode holding synthetic assets, `todo_ratio` of the tuples waiting for `worker`."""
+    chaincode = FakeChaincode(page_size=page_size, org=worker)
+    permissions = {'process': {'public': True, 'authorized_ids': []}}
+
+    def new_key():
+        return str(uuid.uuid4())
+
+    objective_keys = [new_key() for _ in range(objectives)]
+    for i, key in enumerate(objective_keys):
+        chaincode.add('objective', {'key': key, 'name': f'objective {i}', 'owner': worker,
+                                    'permissions': permissions, 'metadata': {}})
+
+    data_manager_keys = [new_key() for _ in range(data_managers)]
+    for i, key in enumerate(data_manager_keys):
+        chaincode.add('data_manager', {'key': key, 'name': f'dataset {i}', 'owner': worker,
+                                       'objective_key': objective_keys[i % objectives],
+                                       'permissions': permissions, 'metadata': {}})
+
+    data_sample_keys = [new_key() for _ in range(data_samples)]
+    for i, key in enumerate(data_sample_keys):
+        chaincode.add('data_sample', {'key': key, 'owner': worker, 'test_only': False,
+                                      'data_manager_keys': [data_manager_keys[i % data_managers]]})
+
+    algo_keys = [new_key() for _ in range(algos)]
+    for i, key in enumerate(algo_keys):
+        chaincode.add('algo', {'key': key, 'name': f'algo {i}', 'owner': worker,
+                               'permissions': permissions, 'metadata': {}})
+
+    compute_plan_keys = [new_key() for _ in range(compute_plans)]
+    tuple_keys = collections.defaultdict(list)
+    traintuple_keys = []
+    for i in range(traintuples):
+        key = new_key()
+        compute_plan_key = compute_plan_keys[i % compute_plans] if compute_plans else ''
+        chaincode.add('traintuple', {
+            'key': key,
+            'algo': {'key': algo_keys[i % algos]},
+            'creator': worker,
+            'dataset': {'key': data_manager_keys[i % data_managers], 'worker': worker,
+                        'data_sample_keys': [data_sample_keys[i % data_samples]]},
+            'compute_plan_key': compute_plan_key,
+            'in_models': None,
+            'log': '',
+            'metadata': {},
+            'out_model': None,
+            'permissions': permissions,
+            'rank': 0,
+            'status': 'todo' if i < traintuples * todo_ratio else 'done',
+            'tag': '',
+        })
+        traintuple_keys.append(key)
+        tuple_keys[compute_plan_key].append(key)
+
+    for i in range(testtuples):
+        chaincode.add('testtuple', {
+            'key': new_key(),
+            'algo': {'key': algo_keys[i % algos]},
+            'certified': True,
+            'creator': worker,
+            'dataset': {'key': data_manager_keys[i % data_managers], 'worker': worker,
+                        'data_sample_keys': [data_sample_keys[i % data_samples]]},
+            'compute_plan_key': '',
+            'log': '',
+            'metadata': {},
+            'objective': {'key': objective_keys[i % objectives]},
+            'rank': 0,
+            'status': 'todo' if i < testtuples * todo_ratio else 'done',
+            'tag': '',
+            'traintuple_key': traintuple_keys[i % traintuples] if traintuples else None,
+            'traintuple_type': 'traintuple',
+        })
+
+    for key in compute_plan_keys:
+        chaincode.add('compute_plan', {
+            'key': key, 'traintuple_keys': tuple_keys[key], 'aggregatetuple_keys': None,
+            'composite_traintuple_keys': None, 'testtuple_keys': None, 'clean_models': False, 'tag': '',
+            'metadata': {}, 'status': 'doing', 'tuple_count': len(tuple_keys[key]), 'done_count': 0,
+            'id_to_key': {},
+        })
+
+    return chaincode
+
+
+class FakeClient(object):
+    """Implement the chaincode calls of the fabric-sdk-py client used by `substrapp.ledger.api`."""
+
+    def __init__(self, chaincode, peer_name, latency=0, commit_delay=0):
+        self.chaincode = chaincode
+        self.latency = latency
+        self.commit_delay = commit_delay
+        self._peers = {peer_name: None}
+
+    async def chaincode_query(self, requestor, channel_name, peers, args, cc_name, fcn, **kwargs):
+        await asyncio.sleep(self.latency)
+        response, _ = self.chaincode.execute(fcn, json.loads(args[0]) if args else None)
+        return json.dumps(response)
+
+    async def chaincode_invoke(self, requestor, channel_name, peers, args, cc_name, fcn, wait_for_event=False,
+                               wait_for_event_timeout=30, **kwargs):
+        await asyncio.sleep(self.latency)
+        response, tx = self.chaincode.execute(fcn, json.loads(args[0]) if args else None)
+        if isinstance(response, dict) and 'error' in response:
+            return json.dumps(response)
+
+        commit = asyncio.ensure_future(self._commit(tx))
+        if wait_for_event:
+            status = await asyncio.wait_for(commit, timeout=wait_for_event_timeout)
+            if status != 'VALID':
+                raise Exception([status])
+        return json.dumps(response)
+
+    async def _commit(self, tx):
+        await asyncio.sleep(self.commit_delay)
+        return self.chaincode.commit(tx)
+
+    async def close_grpc_channels(self):
+        pass
+
+
+class FakeLedgerConnection(ledger_connection.LedgerConnection):
+    """Pooled connection to a fake chaincode: no discovery, no health check, no commit tracker."""
+
+    def __init__(self, channel_name, client):
+        self._fake_client = client
+        super().__init__(channel_name, user=FAKE_USER)
+
+    def connect(self):
+        self.client = self._fake_client
+
+    def needs_discovery(self):
+        return False
+
+    def needs_check(self):
+        return False
+
+
+@contextlib.contextmanager
+def use_fake_ledger(chaincodes, latency=0, commit_delay=0, peer_name='peer'):
+    """Serve the ledger calls to the channels of `chaincodes` (name -> FakeChaincode) from memory."""
+    previous = {}
+    fake_connections = []
+    with ledger_connection.connections_lock:
+        for channel_name, chaincode in chaincodes.items():
+            client = FakeClient(chaincode, peer_name, latency=latency, commit_delay=commit_delay)
+            connection = FakeLedgerConnection(channel_name, client)
+            connection.connect()
+            fake_connections.append(connection)
+            previous[channel_name] = ledger_connection.connections.get(channel_name)
+            ledger_connection.connections[channel_name] = connection
+    try:
+        yield
+    finally:
+        with ledger_connection.connections_lock:
+            for channel_name, connection in previous.items():
+                if connection is None:
+                    ledger_connection.connections.pop(channel_name, None)
+                else:
+                    ledger_connection.connections[channel_name] = connection
+        for connection in fake_connections:
+            connection.close()
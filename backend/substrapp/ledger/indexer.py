@@ -0,0 +1,208 @@
+"""Maintenance of the ledger mirror (see substrapp.ledger.mirror) from the committed blocks.
+
+A channel is first indexed with the list queries of the mirrored asset kinds. Then, for each valid
+transaction of the following blocks, the assets whose keys are in the write set are queried again and
+stored, each one with the single asset query of its kind: the kind already mirrored for the key, else the
+kind created by the chaincode function of the transaction (see `get_written_keys`). The kinds without a
+single asset query (data samples, models) are listed again when the block writes the kinds they read.
+
+Blocks already applied are skipped, so the events app can replay the chain from the start. A block which
+can't be applied (e.g. the peer is unavailable) is left to the caller to retry: the mirror is only rebuilt
+when a block is missing, i.e. when the next block is not the one following the last block applied.
+"""
+import json
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+from hfc.protos.common.common_pb2 import BlockMetadataIndex
+
+from substrapp.ledger import mirror
+from substrapp.ledger.api import query_ledger, query_ledger_many
+from substrapp.ledger.cache import CACHED_QUERIES, INVOKE_ASSET_KINDS, get_block_kinds, get_transaction_call
+from substrapp.ledger.debug_tools import VALID, get_ledger_height, get_transaction_rwsets
+from substrapp.ledger.exceptions import LedgerAssetNotFound
+
+logger = logging.getLogger(__name__)
+
+# chaincode composite keys (e.g. worker~status indexes) are not assets
+COMPOSITE_KEY_PREFIX = '\x00'
+
+
+def _create_assets(channel_name, kind, assets, block_number):
+    from substrapp.models import LedgerAsset
+    LedgerAsset.objects.bulk_create([
+        LedgerAsset(channel=channel_name, kind=kind, key=mirror.get_key(kind, asset), data=json.dumps(asset),
+                    block_number=block_number, **mirror.get_columns(asset))
+        for asset in assets or []
+    ])
+
+
+def index_channel(channel_name):
+    """Rebuild the mirror of `channel_name` from the current state of the ledger."""
+    from substrapp.models import LedgerAsset, LedgerIndexState
+
+    # blocks committed during the queries will be applied again, which is harmless
+    block_number = get_ledger_height(channel_name) - 1
+    kinds = list(mirror.MIRRORED_KINDS)
+    results = query_ledger_many(
+        channel_name,
+        [(mirror.MIRRORED_KINDS[kind][0], []) for kind in kinds],
+        use_cache=False,
+    )
+
+    with transaction.atomic():
+        LedgerAsset.objects.filter(channel=channel_name).delete()
+        for kind, assets in zip(kinds, results):
+            _create_assets(channel_name, kind, assets, block_number)
+        LedgerIndexState.objects.update_or_create(channel=channel_name, defaults={
+            'block_number': block_number,
+            'head_block_number': block_number,
+            'head_checked_at': timezone.now(),
+        })
+
+    logger.info(f'Ledger mirror of {channel_name} indexed at block {block_number}')
+
+
+# Arguments of the compute plan functions holding the new tuples, by tuple kind
+COMPUTE_PLAN_FUNCTIONS = ('createComputePlan', 'updateComputePlan')
+COMPUTE_PLAN_TUPLE_FIELDS = {
+    'traintuples': 'traintuple',
+    'testtuples': 'testtuple',
+    'composite_traintuples': 'composite_traintuple',
+    'aggregatetuples': 'aggregatetuple',
+}
+
+
+def get_created_kinds(fcn, args):
+    """Return the kinds of the assets created by a call of the chaincode function `fcn`, by key.
+
+    Keys not in the result are assets of the first mirrored kind written by `fcn`, see `get_written_keys`.
+    """
+    if fcn not in COMPUTE_PLAN_FUNCTIONS or not args:
+        return {}
+    try:
+        args = json.loads(args)
+        kinds = {args['key']: 'compute_plan'} if args.get('key') else {}
+        for field, kind in COMPUTE_PLAN_TUPLE_FIELDS.items():
+            for tuple_args in args.get(field) or []:
+                if tuple_args.get('key'):
+                    kinds[tuple_args['key']] = kind
+    except (TypeError, ValueError, AttributeError):
+        return {}
+    return kinds
+
+
+def _get_default_kind(fcn):
+    # None if the function is unknown: every kind mirrored asset by asset is tried
+    if fcn not in INVOKE_ASSET_KINDS:
+        return None
+    # the kinds of a function start with the kind it creates, the other ones are known assets
+    kinds = INVOKE_ASSET_KINDS[fcn]
+    return kinds[0] if kinds and kinds[0] in mirror.SINGLE_KINDS else ''
+
+
+def get_written_keys(block):
+    """Return the (key, kind, is_delete) of the assets written by the valid transactions of a block.
+
+    `kind` is derived from the chaincode function of the transaction: '' if not mirrored asset by asset, None if
+    unknown.
+    """
+    validation_codes = block['metadata']['metadata'][BlockMetadataIndex.Value('TRANSACTIONS_FILTER')]
+    writes = []
+    for tx_index, tx in enumerate(block['data']['data']):
+        if validation_codes[tx_index] != VALID:
+            continue
+        rwsets = get_transaction_rwsets(tx)
+        if not rwsets:
+            continue
+        fcn, args = get_transaction_call(tx) or (None, None)
+        created_kinds = get_created_kinds(fcn, args)
+        default_kind = _get_default_kind(fcn)
+        for _, rwset in rwsets:
+            for write in rwset['writes']:
+                key = write['key']
+                if not key.startswith(COMPOSITE_KEY_PREFIX):
+                    writes.append((key, created_kinds.get(key, default_kind), write.get('is_delete', False)))
+    return writes
+
+
+def _refresh_asset(channel_name, key, kinds, block_number):
+    """Query the asset `key` with the single asset query of its `kinds`, in order, and store the first found."""
+    from substrapp.models import LedgerAsset
+
+    for kind in kinds:
+        try:
+            asset = query_ledger(channel_name, fcn=mirror.MIRRORED_KINDS[kind][1], args={'key': key},
+                                 use_cache=False)
+        except LedgerAssetNotFound:
+            continue
+        LedgerAsset.objects.update_or_create(
+            channel=channel_name, kind=kind, key=key,
+            defaults={'data': json.dumps(asset), 'block_number': block_number, **mirror.get_columns(asset)})
+        return
+
+
+def _refresh_lists(channel_name, block, block_number):
+    """Query again the lists of the kinds without a single asset query reading the kinds written by `block`."""
+    from substrapp.models import LedgerAsset
+
+    written_kinds = get_block_kinds(block)
+    kinds = [
+        kind for kind, (list_fcn, single_fcn) in mirror.MIRRORED_KINDS.items()
+        if single_fcn is None and written_kinds.intersection(CACHED_QUERIES[list_fcn][1])
+    ]
+    if not kinds:
+        return
+
+    results = query_ledger_many(channel_name, [(mirror.MIRRORED_KINDS[kind][0], []) for kind in kinds],
+                                use_cache=False)
+    with transaction.atomic():
+        for kind, assets in zip(kinds, results):
+            LedgerAsset.objects.filter(channel=channel_name, kind=kind).delete()
+            _create_assets(channel_name, kind, assets, block_number)
+
+
+def apply_block(channel_name, block):
+    """Apply a decoded block to the mirror of `channel_name`, indexing the channel first if needed.
+
+    An error leaves the mirror at the previous block: the block can be applied again.
+    """
+    from substrapp.models import LedgerAsset, LedgerIndexState
+
+    block_number = block['header']['number']
+    applied_block_number = mirror.get_block_number(channel_name)
+
+    if applied_block_number is not None and block_number <= applied_block_number:
+        return
+    if applied_block_number is None or block_number > applied_block_number + 1:
+        if applied_block_number is not None:
+            logger.warning(f'Ledger mirror of {channel_name} is missing the blocks {applied_block_number + 1}'
+                           f' to {block_number - 1}: indexing it again')
+        index_channel(channel_name)
+        return
+
+    # the same key may be written several times in a block, query it once
+    writes = {}
+    for key, kind, is_delete in get_written_keys(block):
+        writes[key] = (kind, is_delete)
+    known_kinds = dict(LedgerAsset.objects
+                       .filter(channel=channel_name, kind__in=mirror.SINGLE_KINDS, key__in=list(writes))
+                       .values_list('key', 'kind'))
+
+    for key, (kind, is_delete) in writes.items():
+        if is_delete:
+            LedgerAsset.objects.filter(channel=channel_name, kind__in=mirror.SINGLE_KINDS, key=key).delete()
+            continue
+        if key in known_kinds:
+            kinds = [known_kinds[key]]
+        elif kind is None:
+            kinds = mirror.SINGLE_KINDS
+        elif kind:
+            kinds = [kind]
+        else:
+            continue  # not mirrored, or by `_refresh_lists`
+        _refresh_asset(channel_name, key, kinds, block_number)
+    _refresh_lists(channel_name, block, block_number)
+
+    LedgerIndexState.objects.update_or_create(channel=channel_name, defaults={'block_number': block_number})
@@ -0,0 +1,143 @@
+"""Serialization of the invokes of this node writing the same logical keys (LEDGER_INVOKE_LOCK_ENABLED, off by
+default).
+
+Concurrent invokes updating the same compute plan or data manager, e.g. the status updates of the tuples
+of a compute plan, fail at commit time with MVCC_READ_CONFLICT and go through the retry loop. Instead,
+the synchronous invokes of all the backend processes of the node hold a lock per logical key until their
+transaction is committed, so that they are ordered. Asynchronous invokes return before the commit: a lock
+would not order them, they are sent without.
+
+With PostgreSQL, locks are session advisory locks, waited for by the database under `lock_timeout` and
+released if the process dies. With other databases, they are entries of the ledger cache, polled with an
+exponential backoff, which expire after LEDGER_INVOKE_LOCK_TIMEOUT_SECONDS. Waiting for a lock is bounded
+by the same timeout: past it, the invoke is sent anyway and a conflict, if any, is retried.
+"""
+import contextlib
+import hashlib
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import OperationalError, connection
+
+from substrapp.ledger import metrics as ledger_metrics
+from substrapp.ledger.cache import CACHE_ALIAS
+
+logger = logging.getLogger(__name__)
+
+POLL_MIN_INTERVAL_SECONDS = 0.05
+POLL_MAX_INTERVAL_SECONDS = 1
+
+# Logical keys written by invoke functions, from their arguments.
+# The status updates of tuples lock their compute plan, see `api._update_tuple_status`.
+INVOKE_LOCK_KEYS = {
+    'updateComputePlan': lambda args: [args['key']],
+    'updateDataManager': lambda args: [args['data_manager_key']],
+    'registerDataSample': lambda args: args['data_manager_keys'],
+    'updateDataSample': lambda args: args['data_manager_keys'],
+}
+
+
+def is_enabled():
+    return getattr(settings, 'LEDGER_INVOKE_LOCK_ENABLED', False)
+
+
+def get_lock_keys(fcn, args):
+    if fcn not in INVOKE_LOCK_KEYS:
+        return []
+    try:
+        return INVOKE_LOCK_KEYS[fcn](args)
+    except (KeyError, TypeError):
+        return []
+
+
+class AdvisoryLock(object):
+    """PostgreSQL session advisory lock, held by the database connection of the current thread."""
+
+    def __init__(self, channel_name, key):
+        digest = hashlib.sha256(f'{channel_name}:{key}'.encode()).digest()
+        self.lock_id = int.from_bytes(digest[:8], 'big', signed=True)
+
+    def acquire(self, timeout):
+        with connection.cursor() as cursor:
+            # a lock_timeout of 0 would wait forever
+            cursor.execute("SELECT set_config('lock_timeout', %s, false)", [f'{max(1, int(timeout * 1000))}ms'])
+            try:
+                cursor.execute('SELECT pg_advisory_lock(%s)', [self.lock_id])
+            except OperationalError:
+                # lock_not_available
+                return False
+            finally:
+                cursor.execute('RESET lock_timeout')
+        return True
+
+    def release(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [self.lock_id])
+
+
+class CacheLock(object):
+    """Entry of the ledger cache, which expires if it is never released."""
+
+    def __init__(self, channel_name, key):
+        self.cache_key = f'ledger:{channel_name}:lock:{key}'
+        self.token = uuid.uuid4().hex
+
+    def try_acquire(self):
+        return caches[CACHE_ALIAS].add(self.cache_key, self.token, settings.LEDGER_INVOKE_LOCK_TIMEOUT_SECONDS)
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        interval = POLL_MIN_INTERVAL_SECONDS
+        while not self.try_acquire():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, POLL_MAX_INTERVAL_SECONDS)
+        return True
+
+    def release(self):
+        cache = caches[CACHE_ALIAS]
+        # do not release the lock of another invoke if ours expired
+        if cache.get(self.cache_key) == self.token:
+            cache.delete(self.cache_key)
+
+
+@contextlib.contextmanager
+def invoke_lock(channel_name, fcn, keys):
+    """Hold the locks of the logical `keys` written by the invoke function `fcn`."""
+    keys = sorted({str(key) for key in keys if key})  # same order everywhere to avoid deadlocks
+    if not is_enabled() or not keys:
+        yield
+        return
+
+    lock_class = AdvisoryLock if connection.vendor == 'postgresql' else CacheLock
+    start = time.monotonic()
+    deadline = start + settings.LEDGER_INVOKE_LOCK_TIMEOUT_SECONDS
+    locks = []
+    try:
+        for key in keys:
+            lock = lock_class(channel_name, key)
+            try:
+                acquired = lock.acquire(max(0, deadline - time.monotonic()))
+            except Exception as e:
+                # the locks are an optimization, the invoke is sent anyway
+                logger.warning(f'Cannot acquire the lock of {key} for {fcn} ({type(e)}): {e}')
+                acquired = False
+            if not acquired:
+                logger.warning(f'Invoke {fcn} sent without the lock of {key}')
+                break
+            locks.append(lock)
+
+        result = 'acquired' if len(locks) == len(keys) else 'timeout'
+        ledger_metrics.INVOKE_LOCK_WAIT.labels(fcn=fcn, result=result).observe(time.monotonic() - start)
+        yield
+    finally:
+        for lock in reversed(locks):
+            try:
+                lock.release()
+            except Exception as e:
+                logger.warning(f'Cannot release the lock of {fcn} ({type(e)}): {e}')
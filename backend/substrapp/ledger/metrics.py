@@ -0,0 +1,90 @@
+from prometheus_client import Counter, Histogram
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+CALL_DURATION = Histogram(
+    'ledger_call_duration_seconds',
+    'Duration of the chaincode calls, bookmark pages included',
+    ['call_type', 'fcn'],
+    buckets=LATENCY_BUCKETS,
+)
+
+CALL_ERRORS = Counter(
+    'ledger_call_errors_total',
+    'Failed chaincode calls by exception class',
+    ['call_type', 'fcn', 'error'],
+)
+
+CALL_RETRIES = Counter(
+    'ledger_call_retries_total',
+    'Retry decisions of retry_on_error after a failed call: retry or give up (and why)',
+    ['function', 'error', 'decision'],
+)
+
+CIRCUIT_BREAKER_TRANSITIONS = Counter(
+    'ledger_circuit_breaker_transitions_total',
+    'State changes of the per-channel ledger circuit breakers',
+    ['channel', 'state'],
+)
+
+PAYLOAD_SIZE = Histogram(
+    'ledger_payload_bytes',
+    'Size of the chaincode call arguments (request) and results (response)',
+    ['call_type', 'fcn', 'direction'],
+    buckets=SIZE_BUCKETS,
+)
+
+DISCOVERY_DURATION = Histogram(
+    'ledger_discovery_duration_seconds',
+    'Duration of the channel discovery refreshes',
+    ['channel'],
+    buckets=LATENCY_BUCKETS,
+)
+
+DISCOVERY_FAILURES = Counter(
+    'ledger_discovery_failures_total',
+    'Failed channel discovery refreshes',
+    ['channel'],
+)
+
+DISCOVERY_CHANGES = Counter(
+    'ledger_discovery_changes_total',
+    'Channel discovery refreshes which changed the peers or orderers',
+    ['channel'],
+)
+
+CACHE_REQUESTS = Counter(
+    'ledger_cache_requests_total',
+    'Lookups of cacheable queries in the ledger cache',
+    ['fcn', 'result'],
+)
+
+QUERY_HEDGES = Counter(
+    'ledger_query_hedges_total',
+    'Queries sent to a second peer (ADAPTIVE strategy), by the peer which answered first',
+    ['channel', 'winner'],
+)
+
+QUERY_COALESCED = Counter(
+    'ledger_query_coalesced_total',
+    'Queries which waited for the response of an identical query in flight instead of calling the ledger',
+    ['fcn'],
+)
+
+INVOKE_LOCK_WAIT = Histogram(
+    'ledger_invoke_lock_wait_seconds',
+    'Time waited by invokes for the locks of the logical keys they write',
+    ['fcn', 'result'],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def observe_call(call_type, fcn, duration, error=None):
+    CALL_DURATION.labels(call_type=call_type, fcn=fcn).observe(duration)
+    if error is not None:
+        CALL_ERRORS.labels(call_type=call_type, fcn=fcn, error=error).inc()
+
+
+def observe_payload(call_type, fcn, direction, size):
+    PAYLOAD_SIZE.labels(call_type=call_type, fcn=fcn, direction=direction).observe(size)
@@ -0,0 +1,160 @@
+"""Local copy of the ledger assets in the backend database (LEDGER_MIRROR_ENABLED).
+
+The events app applies every committed block to the mirror of its channel (see substrapp.ledger.indexer)
+and records the number of the last block applied. Once a channel is indexed, the list queries of the
+mirrored asset kinds are served from the database instead of the ledger, filtered and paginated on the
+indexed columns of the attributes most searched (see `search`).
+
+The mirror is eventually consistent: single asset queries and the calls which need the latest state
+(`use_cache=False`) still read the ledger. The events app also reports the last block of the ledger it
+knows, on every block and periodically: the lists are read from the ledger again while the mirror is
+more than LEDGER_MIRROR_MAX_LAG_BLOCKS behind, or when the last report is older than
+LEDGER_MIRROR_MAX_LAG_SECONDS (e.g. the events app is stopped).
+"""
+import datetime
+import json
+import logging
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Mirrored asset kinds: list and single asset query functions. The kinds without a single asset query are
+# listed again by the blocks writing the kinds their list query reads.
+MIRRORED_KINDS = {
+    'objective': ('queryObjectives', 'queryObjective'),
+    'dataset': ('queryDataManagers', 'queryDataManager'),
+    'algo': ('queryAlgos', 'queryAlgo'),
+    'composite_algo': ('queryCompositeAlgos', 'queryCompositeAlgo'),
+    'aggregate_algo': ('queryAggregateAlgos', 'queryAggregateAlgo'),
+    'traintuple': ('queryTraintuples', 'queryTraintuple'),
+    'testtuple': ('queryTesttuples', 'queryTesttuple'),
+    'composite_traintuple': ('queryCompositeTraintuples', 'queryCompositeTraintuple'),
+    'aggregatetuple': ('queryAggregatetuples', 'queryAggregatetuple'),
+    'compute_plan': ('queryComputePlans', 'queryComputePlan'),
+    'data_sample': ('queryDataSamples', None),
+    'model': ('queryModels', None),
+}
+
+# Kinds mirrored asset by asset, from the keys written by the blocks
+SINGLE_KINDS = [kind for kind, (_, single_fcn) in MIRRORED_KINDS.items() if single_fcn is not None]
+
+# Tuple of a model, by priority
+MODEL_TUPLE_KINDS = ('composite_traintuple', 'aggregatetuple', 'traintuple')
+
+LIST_QUERIES = {list_fcn: kind for kind, (list_fcn, _) in MIRRORED_KINDS.items()}
+
+# Attributes of the assets copied to indexed columns of LedgerAsset, to search the lists in the database
+INDEXED_ATTRIBUTES = ('key', 'name', 'owner', 'creator', 'status', 'tag', 'compute_plan_key')
+
+
+def is_enabled():
+    return getattr(settings, 'LEDGER_MIRROR_ENABLED', False)
+
+
+def get_max_lag_seconds():
+    return getattr(settings, 'LEDGER_MIRROR_MAX_LAG_SECONDS', 60)
+
+
+def get_block_number(channel_name):
+    """Return the number of the last block applied to the mirror of `channel_name`, None if not indexed."""
+    from substrapp.models import LedgerIndexState
+    state = LedgerIndexState.objects.filter(channel=channel_name).first()
+    return None if state is None else state.block_number
+
+
+def set_head(channel_name, head_block_number):
+    """Record the last block of the ledger known by the events app."""
+    from substrapp.models import LedgerIndexState
+    LedgerIndexState.objects.filter(channel=channel_name).update(
+        head_block_number=head_block_number, head_checked_at=timezone.now())
+
+
+def is_up_to_date(state):
+    """Return whether the lists can be served by a mirror at `state` (a LedgerIndexState)."""
+    max_lag = datetime.timedelta(seconds=get_max_lag_seconds())
+    if state.head_checked_at is None or timezone.now() - state.head_checked_at > max_lag:
+        return False
+    max_lag_blocks = getattr(settings, 'LEDGER_MIRROR_MAX_LAG_BLOCKS', 10)
+    return state.head_block_number is None or state.head_block_number - state.block_number <= max_lag_blocks
+
+
+def get_key(kind, asset):
+    """Return the key of a mirrored asset: the key of its tuple for a model."""
+    if kind == 'model':
+        return next(asset[tuple_kind]['key'] for tuple_kind in MODEL_TUPLE_KINDS if asset.get(tuple_kind))
+    return asset['key']
+
+
+def get_columns(asset):
+    """Return the indexed columns of the LedgerAsset of `asset`, None for the attributes which aren't strings."""
+    return {
+        attribute: asset.get(attribute) if isinstance(asset.get(attribute), str) else None
+        for attribute in INDEXED_ATTRIBUTES
+        if attribute != 'key'
+    }
+
+
+def _filter_assets(channel_name, kind, filters):
+    from substrapp.models import LedgerAsset
+    assets = LedgerAsset.objects.filter(channel=channel_name, kind=kind)
+    if filters:
+        match = Q()
+        for attributes in filters:
+            match |= Q(**{f'{attribute}__in': values for attribute, values in attributes.items()})
+        assets = assets.filter(match)
+    return assets
+
+
+def get_assets(channel_name, kind, filters=None, offset=0, limit=None):
+    """Return the mirrored assets of `kind`, ordered by key.
+
+    `filters` is a list of {attribute: accepted values}, with attributes of INDEXED_ATTRIBUTES: an asset is
+    returned if it matches all the attributes of one of them.
+    """
+    rows = _filter_assets(channel_name, kind, filters).order_by('key').values_list('data', flat=True)
+    rows = rows[offset:] if limit is None else rows[offset:offset + limit]
+    return [json.loads(data) for data in rows]
+
+
+def count_assets(channel_name, kind, filters=None):
+    return _filter_assets(channel_name, kind, filters).count()
+
+
+def _is_available(channel_name):
+    from substrapp.models import LedgerIndexState
+    state = LedgerIndexState.objects.filter(channel=channel_name).first()
+    return state is not None and is_up_to_date(state)
+
+
+def lookup(channel_name, fcn, args):
+    """Return the result of a list query from the mirror, None if it must be sent to the ledger."""
+    if not is_enabled() or fcn not in LIST_QUERIES or args:
+        return None
+
+    try:
+        if not _is_available(channel_name):
+            return None
+        return get_assets(channel_name, LIST_QUERIES[fcn])
+    except Exception as e:
+        # the mirror is an optimization, the ledger stays the source of truth
+        logger.warning(f'Ledger mirror lookup failed for {fcn} ({type(e)}): {e}')
+        return None
+
+
+def search(channel_name, kind, filters=None, offset=0, limit=None):
+    """Return a page of the assets of `kind` matching `filters` (see `get_assets`) and their count, None if
+    the mirror can't serve them."""
+    if not is_enabled() or kind not in MIRRORED_KINDS:
+        return None
+
+    try:
+        if not _is_available(channel_name):
+            return None
+        return (get_assets(channel_name, kind, filters, offset, limit),
+                count_assets(channel_name, kind, filters))
+    except Exception as e:
+        logger.warning(f'Ledger mirror search failed for {kind} ({type(e)}): {e}')
+        return None
@@ -0,0 +1,84 @@
+"""Latency-aware selection of the endorsing peer of queries (LEDGER_QUERY_STRATEGY=ADAPTIVE).
+
+Each channel keeps, for every peer, an EWMA of the query latency and of the error rate, plus a window
+of the last latencies. Queries are sent to the peer with the best score; peers without statistics are
+tried first and a small share of the queries explores another peer, so that the statistics of a peer
+which recovered get refreshed. With hedging enabled, a query which did not complete after the
+LEDGER_QUERY_HEDGING_PERCENTILE latency percentile of its peer is also sent to the second best peer.
+"""
+import collections
+import random
+import threading
+
+EWMA_ALPHA = 0.2
+# A peer which always fails is considered 10 times slower than its latency
+ERROR_PENALTY = 10
+EXPLORATION_RATE = 0.05
+LATENCY_WINDOW = 100
+MIN_SAMPLES_FOR_HEDGING = 10
+
+
+class PeerStats(object):
+
+    def __init__(self):
+        self.latency = None
+        self.error_rate = 0.
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, latency, error):
+        self.latencies.append(latency)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+        self.error_rate = EWMA_ALPHA * float(error) + (1 - EWMA_ALPHA) * self.error_rate
+
+    @property
+    def score(self):
+        if self.latency is None:
+            return 0.
+        return self.latency * (1 + ERROR_PENALTY * self.error_rate)
+
+    def percentile(self, percentile):
+        if len(self.latencies) < MIN_SAMPLES_FOR_HEDGING:
+            return None
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+
+class PeerSelector(object):
+
+    def __init__(self, channel_name):
+        self.channel_name = channel_name
+        self.stats = collections.defaultdict(PeerStats)
+        self.lock = threading.Lock()
+
+    def rank(self, peer_names, preferred=None):
+        """Return `peer_names` from the best to the worst. `preferred` wins ties (e.g. the local peer)."""
+        with self.lock:
+            ranked = sorted(peer_names, key=lambda name: (self.stats[name].score, name != preferred, name))
+        if len(ranked) > 1 and random.random() < EXPLORATION_RATE:
+            explored = ranked.pop(random.randrange(1, len(ranked)))
+            ranked.insert(0, explored)
+        return ranked
+
+    def record(self, peer_name, latency, error=False):
+        with self.lock:
+            self.stats[peer_name].record(latency, error)
+
+    def hedge_delay(self, peer_name, percentile):
+        """Return how long to wait for `peer_name` before hedging, None until enough latencies are known."""
+        with self.lock:
+            return self.stats[peer_name].percentile(percentile)
+
+
+_selectors = {}
+_selectors_lock = threading.Lock()
+
+
+def get_peer_selector(channel_name):
+    with _selectors_lock:
+        if channel_name not in _selectors:
+            _selectors[channel_name] = PeerSelector(channel_name)
+        return _selectors[channel_name]
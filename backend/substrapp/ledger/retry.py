@@ -0,0 +1,167 @@
+"""Retry policy of the ledger calls.
+
+- Backoff: exponential with full jitter, so that the processes which failed together do not retry together.
+- Retry budget (per process): each retry after an unavailability error (UNAVAILABILITY_ERRORS) consumes a
+  token, each successful call gives back a fraction of one. These retries stop while less than half of the
+  tokens are left, so a failing peer does not get `nbtries` times the normal load (same algorithm as gRPC
+  retry throttling). Conflicts, commit timeouts and status lag are expected contention: they are retried up
+  to `nbtries` without consuming the budget.
+- Circuit breaker (per channel): after consecutive failures to reach the peer, calls fail fast with
+  `LedgerCircuitOpen` until a trial call succeeds.
+"""
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from grpc import RpcError
+
+from substrapp.ledger import metrics as ledger_metrics
+from substrapp.ledger.exceptions import LedgerCircuitOpen, LedgerUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Failures meaning the peer cannot be reached, counted by the circuit breakers.
+# `LedgerTimeout` is not one of them: it is raised while waiting for the commit of an invoke the peers
+# already endorsed, so a slow block must not suspend the other calls on the channel.
+UNAVAILABILITY_ERRORS = (LedgerUnavailable, RpcError)
+
+RETRY = 'retry'
+GIVE_UP_ATTEMPTS = 'give_up_attempts'
+GIVE_UP_BUDGET = 'give_up_budget'
+GIVE_UP_CIRCUIT_OPEN = 'give_up_circuit_open'
+
+
+def get_backoff_delay(attempt, delay, backoff):
+    """Return the delay before the retry number `attempt` (starting at 1)."""
+    max_delay = settings.LEDGER_RETRY_MAX_DELAY_SECONDS
+    return random.uniform(0, min(max_delay, delay * backoff ** (attempt - 1)))
+
+
+class RetryBudget(object):
+
+    def __init__(self, max_tokens, token_ratio):
+        self.max_tokens = max_tokens
+        self.token_ratio = token_ratio
+        self.tokens = max_tokens
+        self.lock = threading.Lock()
+
+    def on_success(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.token_ratio)
+
+    def try_withdraw(self):
+        with self.lock:
+            if self.tokens - 1 <= self.max_tokens / 2:
+                return False
+            self.tokens -= 1
+            return True
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_retry_budget():
+    global _budget
+    if _budget is None:
+        with _budget_lock:
+            if _budget is None:
+                _budget = RetryBudget(
+                    max_tokens=settings.LEDGER_RETRY_BUDGET_MAX_TOKENS,
+                    token_ratio=settings.LEDGER_RETRY_BUDGET_TOKEN_RATIO,
+                )
+    return _budget
+
+
+def decide(fn_name, error, attempt, nbtries):
+    """Return whether `fn_name` should be retried after its `attempt`-th call failed with `error`."""
+    if isinstance(error, LedgerCircuitOpen):
+        decision = GIVE_UP_CIRCUIT_OPEN
+    elif attempt >= nbtries:
+        decision = GIVE_UP_ATTEMPTS
+    elif isinstance(error, UNAVAILABILITY_ERRORS) and not get_retry_budget().try_withdraw():
+        decision = GIVE_UP_BUDGET
+    else:
+        decision = RETRY
+
+    ledger_metrics.CALL_RETRIES.labels(function=fn_name, error=type(error).__name__, decision=decision).inc()
+    if decision not in (RETRY, GIVE_UP_ATTEMPTS):
+        logger.warning(f'Function {fn_name} failed ({type(error)}): {error} not retrying ({decision})')
+    return decision == RETRY
+
+
+def on_success():
+    get_retry_budget().on_success()
+
+
+class CircuitBreaker(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning(f'Ledger circuit breaker for {self.name}: {self.state} -> {state}')
+            ledger_metrics.CIRCUIT_BREAKER_TRANSITIONS.labels(channel=self.name, state=state).inc()
+        self.state = state
+
+    def before_call(self):
+        """Raise `LedgerCircuitOpen` if the call must not be sent.
+
+        Once open, one trial call is let through every `reset_timeout` seconds.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            if time.time() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.time()
+                self._set_state(self.HALF_OPEN)
+                return
+            raise LedgerCircuitOpen(f'Ledger calls to {self.name} are suspended after {self.failures} failures')
+
+    def on_success(self):
+        with self.lock:
+            self.failures = 0
+            self._set_state(self.CLOSED)
+
+    def on_failure(self, error):
+        with self.lock:
+            if not isinstance(error, UNAVAILABILITY_ERRORS):
+                # the peer answered
+                self.failures = 0
+                self._set_state(self.CLOSED)
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+                self._set_state(self.OPEN)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(channel_name):
+    breaker = _breakers.get(channel_name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(channel_name)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    channel_name,
+                    failure_threshold=settings.LEDGER_CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                    reset_timeout=settings.LEDGER_CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS,
+                )
+                _breakers[channel_name] = breaker
+    return breaker
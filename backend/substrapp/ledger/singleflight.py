@@ -0,0 +1,62 @@
+"""Coalescing of identical concurrent ledger queries.
+
+While a query for a given (fcn, args) is in flight on a channel connection, identical queries submitted
+by other threads or coroutines of the process wait for its response instead of sending their own RPC.
+Only in-flight calls are shared: a query sent after the response is received goes to the ledger
+(see substrapp.ledger.cache for the caching of results).
+"""
+import asyncio
+import copy
+import json
+
+from substrapp.ledger import metrics as ledger_metrics
+
+
+class SingleFlight(object):
+    """In-flight calls of one connection loop. Must only be used from this loop."""
+
+    def __init__(self):
+        self.calls = {}
+        self.stats = {
+            'calls': 0,
+            'coalesced': 0,
+        }
+
+    @staticmethod
+    def get_key(fcn, args):
+        return fcn, json.dumps(args, sort_keys=True, default=str)
+
+    async def do(self, fcn, args, call):
+        """Return the response of the coroutine function `call`, shared with identical calls in flight.
+
+        Callers may modify the response (e.g. to extend paginated results): when it is shared, each
+        caller gets its own copy.
+        """
+        key = self.get_key(fcn, args)
+        self.stats['calls'] += 1
+
+        if key in self.calls:
+            future, waiters = self.calls[key]
+            self.calls[key] = (future, waiters + 1)
+            self.stats['coalesced'] += 1
+            ledger_metrics.QUERY_COALESCED.labels(fcn=fcn).inc()
+            return copy.deepcopy(await asyncio.shield(future))
+
+        future = asyncio.get_event_loop().create_future()
+        self.calls[key] = (future, 0)
+        try:
+            response = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # retrieved, even if no identical call was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(response)
+            _, waiters = self.calls[key]
+            return copy.deepcopy(response) if waiters else response
+        finally:
+            del self.calls[key]
@@ -0,0 +1,69 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from substrapp.ledger.api import get_object_from_ledger, iter_tuples, log_start_tuple, query_ledger
+from substrapp.ledger.exceptions import LedgerError
+from substrapp.ledger.fake import ORG, generate_chaincode, use_fake_ledger
+
+
+def percentile(durations, p):
+    return durations[min(len(durations) - 1, int(len(durations) * p / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the ledger layer against an in-memory fake chaincode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--channel', default='mychannel')
+        parser.add_argument('--traintuples', type=int, default=1000)
+        parser.add_argument('--page-size', type=int, default=None)
+        parser.add_argument('--latency-ms', type=float, default=5, help='latency of each chaincode call')
+        parser.add_argument('--commit-delay-ms', type=float, default=100, help='delay before a commit')
+        parser.add_argument('--threads', type=int, default=10)
+        parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+
+    def handle(self, *args, **options):
+        channel_name = options['channel']
+        chaincode = generate_chaincode(
+            traintuples=options['traintuples'], page_size=options['page_size'], todo_ratio=1)
+        todo_keys = list(chaincode.keys_by_kind['traintuple'])
+        random.shuffle(todo_keys)
+
+        scenarios = {
+            'queryTraintuples': lambda i: query_ledger(channel_name, 'queryTraintuples', use_cache=False),
+            'queryTraintuple': lambda i: get_object_from_ledger(
+                channel_name, todo_keys[i % len(todo_keys)], 'queryTraintuple', use_cache=False),
+            'iter_tuples': lambda i: list(iter_tuples(channel_name, 'traintuple', ORG)),
+            'logStartTrain': lambda i: log_start_tuple(channel_name, 'traintuple', todo_keys[i % len(todo_keys)]),
+        }
+
+        self.stdout.write(f'{"scenario".ljust(20)} | {"req/s":>8} | {"p50 ms":>8} | {"p95 ms":>8} | '
+                          f'{"p99 ms":>8} | {"errors":>6}')
+        with use_fake_ledger({channel_name: chaincode},
+                             latency=options['latency_ms'] / 1000,
+                             commit_delay=options['commit_delay_ms'] / 1000):
+            for name, scenario in scenarios.items():
+                self.run_scenario(name, scenario, options['requests'], options['threads'])
+
+    def run_scenario(self, name, scenario, requests, threads):
+        def timed(i):
+            ts = time.time()
+            try:
+                scenario(i)
+            except LedgerError:
+                return time.time() - ts, True
+            return time.time() - ts, False
+
+        ts = time.time()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(timed, range(requests)))
+        elapsed = time.time() - ts
+
+        durations = sorted(duration * 1000 for duration, _ in results)
+        errors = sum(error for _, error in results)
+        self.stdout.write(
+            f'{name.ljust(20)} | {requests / elapsed:8.1f} | {percentile(durations, 50):8.1f} | '
+            f'{percentile(durations, 95):8.1f} | {percentile(durations, 99):8.1f} | {errors:6d}')
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.17 on 2026-10-18 05:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0005_auto_20210119_1103'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerIndexState',
+            fields=[
+                ('channel', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('block_number', models.BigIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerAsset',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(max_length=100)),
+                ('kind', models.CharField(max_length=50)),
+                ('key', models.CharField(max_length=100)),
+                ('data', models.TextField()),
+                ('block_number', models.BigIntegerField()),
+            ],
+            options={
+                'unique_together': {('channel', 'kind', 'key')},
+            },
+        ),
+    ]
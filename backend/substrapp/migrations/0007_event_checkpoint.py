@@ -0,0 +1,21 @@
+# Generated by Django 2.2.17 on 2026-10-18 05:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0006_ledger_mirror'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventCheckpoint',
+            fields=[
+                ('channel', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('block_number', models.BigIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
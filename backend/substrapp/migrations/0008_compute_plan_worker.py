@@ -0,0 +1,51 @@
+# Generated by Django 2.2.17 on 2026-10-18 05:42
+
+import json
+
+from django.db import migrations, models
+
+
+def backfill_compute_plan_workers(apps, schema_editor):
+    # the workers of the compute plans were only known from the results of their compute tasks
+    TaskResult = apps.get_model('django_celery_results', 'TaskResult')
+    ComputePlanWorker = apps.get_model('substrapp', 'ComputePlanWorker')
+
+    workers = {}
+    results = (TaskResult.objects
+               .filter(task_name='substrapp.tasks.tasks.compute_task', result__icontains='"compute_plan_key"')
+               # the latest worker of a compute plan
+               .order_by('-date_done')
+               .values_list('result', flat=True))
+    for result in results.iterator():
+        try:
+            result = json.loads(result)
+            compute_plan_key = result['compute_plan_key']
+            worker = result['worker']
+        except (TypeError, ValueError, KeyError):
+            continue
+        if compute_plan_key and compute_plan_key not in workers:
+            workers[compute_plan_key] = ComputePlanWorker(
+                compute_plan_key=compute_plan_key, worker=worker, queue=result.get('queue') or worker)
+
+    ComputePlanWorker.objects.bulk_create(workers.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0007_event_checkpoint'),
+        ('django_celery_results', '0004_auto_20190516_0412'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComputePlanWorker',
+            fields=[
+                ('compute_plan_key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('worker', models.CharField(max_length=255)),
+                ('queue', models.CharField(max_length=255)),
+                ('last_seen', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_compute_plan_workers, migrations.RunPython.noop),
+    ]
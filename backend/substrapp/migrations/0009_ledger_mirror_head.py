@@ -0,0 +1,23 @@
+# Generated by Django 2.2.17 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0008_compute_plan_worker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledgerindexstate',
+            name='head_block_number',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='ledgerindexstate',
+            name='head_checked_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
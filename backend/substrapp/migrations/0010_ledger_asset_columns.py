@@ -0,0 +1,61 @@
+# Generated by Django 2.2.17 on 2026-10-18 06:36
+
+import json
+
+from django.db import migrations, models
+
+COLUMNS = ('name', 'owner', 'creator', 'status', 'tag', 'compute_plan_key')
+
+
+def backfill_columns(apps, schema_editor):
+    LedgerAsset = apps.get_model('substrapp', 'LedgerAsset')
+
+    assets = []
+    for ledger_asset in LedgerAsset.objects.iterator():
+        asset = json.loads(ledger_asset.data)
+        for column in COLUMNS:
+            value = asset.get(column)
+            setattr(ledger_asset, column, value if isinstance(value, str) else None)
+        assets.append(ledger_asset)
+    LedgerAsset.objects.bulk_update(assets, COLUMNS, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0009_ledger_mirror_head'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledgerasset',
+            name='compute_plan_key',
+            field=models.CharField(db_index=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='ledgerasset',
+            name='creator',
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='ledgerasset',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='ledgerasset',
+            name='owner',
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='ledgerasset',
+            name='status',
+            field=models.CharField(db_index=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='ledgerasset',
+            name='tag',
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+        migrations.RunPython(backfill_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.17 on 2026-10-18 10:05
+
+from django.db import migrations
+
+
+def reset_ledger_mirror(apps, schema_editor):
+    # the data samples and the models are mirrored too: the channels are indexed again on their next block
+    LedgerIndexState = apps.get_model('substrapp', 'LedgerIndexState')
+    LedgerIndexState.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0010_ledger_asset_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_ledger_mirror, migrations.RunPython.noop),
+    ]
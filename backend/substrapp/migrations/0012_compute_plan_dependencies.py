@@ -0,0 +1,22 @@
+# Generated by Django 2.2.17 on 2026-10-18 06:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0011_ledger_mirror_lists'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComputePlanDependencies',
+            fields=[
+                ('compute_plan_key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('parents', models.TextField()),
+                ('last_rank', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.17 on 2026-10-18 11:20
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_tables(apps, schema_editor):
+    # the ledger cache (CACHES['ledger']) is used by the server, the workers and the events app, whichever
+    # starts first: its table is created with the schema
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0012_compute_plan_dependencies'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_tables, migrations.RunPython.noop),
+    ]
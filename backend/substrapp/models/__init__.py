@@ -7,5 +7,11 @@ from .algo import Algo
 from .model import Model
 from .compositealgo import CompositeAlgo
 from .aggregatealgo import AggregateAlgo
+from .ledgerasset import LedgerAsset
+from .ledgerindexstate import LedgerIndexState
+from .eventcheckpoint import EventCheckpoint
+from .computeplanworker import ComputePlanWorker
+from .computeplandependencies import ComputePlanDependencies
 
-__all__ = ['DataSample', 'Objective', 'DataManager', 'Algo', 'Model', 'CompositeAlgo', 'AggregateAlgo']
+__all__ = ['DataSample', 'Objective', 'DataManager', 'Algo', 'Model', 'CompositeAlgo', 'AggregateAlgo', 'LedgerAsset',
+           'LedgerIndexState', 'EventCheckpoint', 'ComputePlanWorker', 'ComputePlanDependencies']
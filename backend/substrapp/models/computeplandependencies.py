@@ -0,0 +1,18 @@
+import json
+
+from django.db import models
+
+
+class ComputePlanDependencies(models.Model):
+    """Parents of the training tuples of a compute plan, to prioritize them, see substrapp.tasks.priority"""
+    compute_plan_key = models.CharField(max_length=100, primary_key=True)
+    # keys of the parents by training tuple key, as JSON
+    parents = models.TextField()
+    last_rank = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def get_parents(self):
+        return json.loads(self.parents)
+
+    def __str__(self):
+        return f'Dependencies of compute plan {self.compute_plan_key}'
@@ -0,0 +1,12 @@
+from django.db import models
+
+
+class ComputePlanWorker(models.Model):
+    """Worker running the tuples of a compute plan, to send them all to the same worker"""
+    compute_plan_key = models.CharField(max_length=100, primary_key=True)
+    worker = models.CharField(max_length=255)
+    queue = models.CharField(max_length=255)
+    last_seen = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Compute plan {self.compute_plan_key} on worker {self.worker}'
@@ -0,0 +1,11 @@
+from django.db import models
+
+
+class EventCheckpoint(models.Model):
+    """Last block of a channel whose events have been processed by the events app"""
+    channel = models.CharField(max_length=100, primary_key=True)
+    block_number = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Events of channel {self.channel} processed up to block {self.block_number}'
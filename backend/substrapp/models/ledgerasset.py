@@ -0,0 +1,30 @@
+import json
+
+from django.db import models
+
+
+class LedgerAsset(models.Model):
+    """Copy of a ledger asset, as returned by the chaincode, see substrapp.ledger.mirror"""
+    channel = models.CharField(max_length=100)
+    kind = models.CharField(max_length=50)
+    key = models.CharField(max_length=100)
+    data = models.TextField()
+    # number of the block of the last update
+    block_number = models.BigIntegerField()
+    # attributes of the asset searched in the database, see substrapp.ledger.mirror.INDEXED_ATTRIBUTES
+    name = models.CharField(max_length=255, null=True, db_index=True)
+    owner = models.CharField(max_length=255, null=True, db_index=True)
+    creator = models.CharField(max_length=255, null=True, db_index=True)
+    status = models.CharField(max_length=50, null=True, db_index=True)
+    tag = models.CharField(max_length=255, null=True, db_index=True)
+    compute_plan_key = models.CharField(max_length=100, null=True, db_index=True)
+
+    class Meta:
+        unique_together = (('channel', 'kind', 'key'),)
+
+    @property
+    def asset(self):
+        return json.loads(self.data)
+
+    def __str__(self):
+        return f'{self.kind} with key {self.key} on channel {self.channel}'
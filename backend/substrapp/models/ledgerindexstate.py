@@ -0,0 +1,15 @@
+from django.db import models
+
+
+class LedgerIndexState(models.Model):
+    """Progress of the ledger mirror of a channel"""
+    channel = models.CharField(max_length=100, primary_key=True)
+    # number of the last block applied to the mirror
+    block_number = models.BigIntegerField()
+    # last block of the ledger known by the events app, and when it was last reported
+    head_block_number = models.BigIntegerField(null=True)
+    head_checked_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Ledger mirror of channel {self.channel} at block {self.block_number}'
@@ -0,0 +1,148 @@
+"""Cache of the assets downloaded from the nodes by the workers, by checksum, under MEDIA_ROOT/cache.
+
+It is filled by the prefetching of the inputs of the tuples (see substrapp.tasks.prefetch) and by the downloads
+of the tuples themselves, so the algos, metrics and models shared by the tuples of a compute plan are
+downloaded once. A cached asset is checked against its checksum each time it is used: a corrupted file is
+removed and downloaded again.
+
+The files used the least recently are evicted beyond TASK_PREFETCH_CACHE_MAX_SIZE bytes.
+"""
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+from os import path
+
+from django.conf import settings
+
+from substrapp.utils import compute_hash, get_hash, raise_if_path_traversal
+
+logger = logging.getLogger(__name__)
+
+TMP_PREFIX = '.tmp-'
+
+
+def is_enabled():
+    return settings.TASK['PREFETCH_ENABLED']
+
+
+def get_cache_directory():
+    return path.join(getattr(settings, 'MEDIA_ROOT'), 'cache')
+
+
+def get_cache_path(checksum):
+    directory = get_cache_directory()
+    cache_path = path.join(directory, checksum)
+    raise_if_path_traversal([cache_path], directory)
+    return cache_path
+
+
+def contains(checksum):
+    return path.isfile(get_cache_path(checksum))
+
+
+def _remove(file_path):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def _link_or_copy(src, dst):
+    # the cache and the subtuple folders are on the same volume: a hard link costs no copy, and the file
+    # stays in the subtuple folder if evicted from the cache
+    _remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+@contextlib.contextmanager
+def temporary_path():
+    """Path of a temporary file in the cache directory, removed on exit."""
+    directory = get_cache_directory()
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=TMP_PREFIX)
+    os.close(fd)
+    try:
+        yield tmp_path
+    finally:
+        _remove(tmp_path)
+
+
+def get_content(checksum, salt=None):
+    """Return the content of the cached asset `checksum`, None if not cached."""
+    cache_path = get_cache_path(checksum)
+    try:
+        with open(cache_path, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+
+    if compute_hash(content, key=salt) != checksum:
+        logger.warning(f'Cached asset {checksum} is corrupted: removing it')
+        _remove(cache_path)
+        return None
+
+    # last use, for the eviction
+    os.utime(cache_path)
+    return content
+
+
+def put_content(checksum, content):
+    with temporary_path() as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, get_cache_path(checksum))
+    evict()
+
+
+def get_file(checksum, dst_path, hash_key=None):
+    """Put the cached asset `checksum` at `dst_path`. Return False if not cached."""
+    cache_path = get_cache_path(checksum)
+    try:
+        _link_or_copy(cache_path, dst_path)
+    except FileNotFoundError:
+        return False
+
+    if get_hash(dst_path, key=hash_key) != checksum:
+        logger.warning(f'Cached asset {checksum} is corrupted: removing it')
+        _remove(dst_path)
+        _remove(cache_path)
+        return False
+
+    os.utime(cache_path)
+    return True
+
+
+def put_file(checksum, src_path):
+    with temporary_path() as tmp_path:
+        _link_or_copy(src_path, tmp_path)
+        os.replace(tmp_path, get_cache_path(checksum))
+    evict()
+
+
+def evict(max_size=None):
+    """Remove the least recently used assets until the cache is under `max_size` bytes."""
+    max_size = settings.TASK['PREFETCH_CACHE_MAX_SIZE'] if max_size is None else max_size
+    directory = get_cache_directory()
+
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.startswith(TMP_PREFIX) or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    size = sum(entry_size for _, entry_size, _ in entries)
+    for _, entry_size, entry_path in sorted(entries):
+        if size <= max_size:
+            break
+        _remove(entry_path)
+        size -= entry_size
@@ -0,0 +1,17 @@
+from prometheus_client import Histogram
+
+DURATION_BUCKETS = (.1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+MATERIALS_DURATION = Histogram(
+    'task_materials_duration_seconds',
+    'Duration of the preparation of the materials of a tuple, its stages running concurrently',
+    ['tuple_type'],
+    buckets=DURATION_BUCKETS,
+)
+
+MATERIALS_STAGE_DURATION = Histogram(
+    'task_materials_stage_duration_seconds',
+    'Duration of each stage of the preparation of the materials of a tuple (algo, models, ...)',
+    ['tuple_type', 'stage'],
+    buckets=DURATION_BUCKETS,
+)
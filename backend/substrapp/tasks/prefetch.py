@@ -0,0 +1,148 @@
+"""Prefetching of the inputs of the tuples of the compute plans, into the asset cache of the workers.
+
+The events service knows the tuples of a compute plan as soon as they are created, and the models of a round
+as soon as they are done: it requests their prefetching with the `prefetch_inputs` remote control command of
+the compute workers (see `request_prefetch`), registered by them only. Each request is either:
+
+- `{'tuple_type': ..., 'tuple': ...}`: the algo, the metrics and the done parent models of a tuple of the node
+- `{'model': key}`: the out model of a done training tuple, for the next round
+
+The command runs in the main process of the worker and downloads from a thread pool, without waiting for a
+slot of the worker pool, busy with the tuple of the previous round. When the tuple is executed,
+`prepare_materials` finds its inputs in the asset cache (see substrapp.tasks.asset_cache).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from celery.worker.control import control_command, ok, nok
+from django import db
+from django.conf import settings
+
+from backend.celery import app
+from substrapp.tasks import asset_cache
+from substrapp.tasks.tasks import (COMPOSITE_TRAINTUPLE_TYPE, TESTTUPLE_TYPE, find_training_step_tuple_from_key,
+                                   get_algo, get_and_put_model_content, get_objective)
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_COMMAND = 'prefetch_inputs'
+
+
+def get_parent_keys(tuple_type, tuple_):
+    """Return the keys of the tuples whose out model is an input of `tuple_`, except the local head models."""
+    if tuple_type == TESTTUPLE_TYPE:
+        return [tuple_['traintuple_key']] if tuple_.get('traintuple_key') else []
+    if tuple_type == COMPOSITE_TRAINTUPLE_TYPE:
+        trunk_model = tuple_.get('in_trunk_model')
+        return [trunk_model['traintuple_key']] if trunk_model else []
+    return [input_model['traintuple_key'] for input_model in tuple_.get('in_models') or []]
+
+
+def prefetch_model(channel_name, tuple_key):
+    """Download the out model of the training tuple `tuple_key` into the asset cache, if done."""
+    tuple_type, metadata = find_training_step_tuple_from_key(channel_name, tuple_key)
+    if metadata['status'] != 'done':
+        return
+
+    if tuple_type == COMPOSITE_TRAINTUPLE_TYPE:
+        out_model = metadata['out_trunk_model']['out_model']
+    else:
+        out_model = metadata['out_model']
+    if not out_model or asset_cache.contains(out_model['checksum']):
+        return
+
+    # put in the asset cache once downloaded
+    with asset_cache.temporary_path() as tmp_path:
+        get_and_put_model_content(channel_name, tuple_type, tuple_key, metadata, out_model, tmp_path)
+    logger.info(f'Prefetched model of {tuple_type} {tuple_key}')
+
+
+def prefetch_tuple(channel_name, tuple_type, tuple_):
+    """Download the algo, the metrics and the done parent models of `tuple_` into the asset cache."""
+    algo_tuple_type = tuple_type
+    if tuple_type == TESTTUPLE_TYPE:
+        get_objective(channel_name, tuple_)
+        algo_tuple_type = tuple_['traintuple_type']
+    get_algo(channel_name, algo_tuple_type, tuple_)
+
+    for parent_key in get_parent_keys(tuple_type, tuple_):
+        prefetch_model(channel_name, parent_key)
+    logger.info(f'Prefetched inputs of {tuple_type} {tuple_["key"]}')
+
+
+class Prefetcher(object):
+    """Thread pool of the prefetching of a worker. A request already in progress is not scheduled again."""
+
+    def __init__(self, max_workers):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self.lock = threading.Lock()
+        self.in_progress = set()
+
+    def submit(self, request_id, fn, *args):
+        with self.lock:
+            if request_id in self.in_progress:
+                return False
+            self.in_progress.add(request_id)
+        self.executor.submit(self._run, request_id, fn, *args)
+        return True
+
+    def _run(self, request_id, fn, *args):
+        try:
+            # the threads of the pool keep their database connection between requests
+            db.close_old_connections()
+            fn(*args)
+        except Exception as e:
+            # the tuple downloads its inputs itself
+            logger.warning(f'Prefetch of {request_id} failed: {e}')
+        finally:
+            with self.lock:
+                self.in_progress.discard(request_id)
+
+    def schedule(self, channel_name, requests):
+        """Schedule the prefetch `requests` (see module docstring), return the number of scheduled ones."""
+        scheduled = 0
+        for request in requests:
+            if 'model' in request:
+                scheduled += self.submit(
+                    ('model', channel_name, request['model']), prefetch_model, channel_name, request['model'])
+            else:
+                tuple_ = request['tuple']
+                scheduled += self.submit(
+                    ('tuple', channel_name, tuple_['key']),
+                    prefetch_tuple, channel_name, request['tuple_type'], tuple_)
+        return scheduled
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher(settings.TASK['PREFETCH_CONCURRENCY'])
+        return _prefetcher
+
+
+@control_command(
+    args=[('channel_name', str), ('requests', list)],
+    signature='<channel_name> <requests>',
+)
+def prefetch_inputs(state, channel_name, requests, **kwargs):
+    """Prefetch the inputs of tuples into the asset cache of the worker."""
+    if not asset_cache.is_enabled():
+        return nok('prefetch disabled')
+    scheduled = get_prefetcher().schedule(channel_name, requests)
+    return ok(f'{scheduled} prefetch scheduled')
+
+
+def request_prefetch(channel_name, requests, worker=None):
+    """Send the prefetch `requests` to the compute workers of the node, or only to `worker` (a hostname) if set."""
+    if not requests:
+        return
+    # the worker names are the hostnames of the workers without their `celery@` prefix
+    worker = worker or f'{settings.ORG_NAME}.worker'
+    app.control.broadcast(PREFETCH_COMMAND, arguments={'channel_name': channel_name, 'requests': requests},
+                          pattern=f'*@{worker}', matcher='glob')
@@ -0,0 +1,174 @@
+"""Priority of the tuple tasks in the worker queues.
+
+All the tuples of a node go to the same queues. With TASK_PRIORITY_ENABLED, the queues are RabbitMQ
+priority queues and the tasks of a tuple are published with a priority (0 to MAX_PRIORITY), from:
+
+- its type: the training tuples unblock the next rounds of their compute plan, the testtuples unblock nothing
+- its children: the training tuples of its compute plan using its out model, which it unblocks
+- its rank in its compute plan: the earlier the rank, the more ranks of the plan wait for it
+
+The children and the last rank of a compute plan are derived from the parents of its training tuples
+(see `get_plan_dependencies`). The events service records them from the events of the tuples, as they are
+created, and publishes the tasks with their priority (see `record_plan_dependencies`).
+
+The priority queues are declared by the workers: the queues declared before must be deleted to enable it.
+"""
+import collections
+import json
+import logging
+import math
+
+from django.conf import settings
+
+from substrapp.ledger.exceptions import LedgerError
+
+logger = logging.getLogger(__name__)
+
+MAX_PRIORITY = 9
+
+TRAINING_TUPLE_TYPES = ('traintuple', 'composite_traintuple', 'aggregatetuple')
+
+TRAINING_TUPLE_QUERIES = {
+    'traintuple': 'queryTraintuple',
+    'composite_traintuple': 'queryCompositeTraintuple',
+    'aggregatetuple': 'queryAggregatetuple',
+}
+
+TRAINING_PRIORITY = 5
+MAX_CHILDREN_PRIORITY = 3
+MAX_RANK_PRIORITY = 2
+
+
+def is_enabled():
+    return settings.TASK['PRIORITY_ENABLED']
+
+
+def get_parent_keys(tuple_type, tuple_):
+    """Return the keys of the training tuples whose out model is an input of the training tuple `tuple_`."""
+    if tuple_type == 'composite_traintuple':
+        return [model['traintuple_key'] for model in (tuple_.get('in_head_model'), tuple_.get('in_trunk_model'))
+                if model]
+    return [model['traintuple_key'] for model in tuple_.get('in_models') or []]
+
+
+def get_parents(tuples):
+    """Return the parent keys by tuple key and the last rank of `(tuple_type, tuple)` training tuples."""
+    parents = {}
+    last_rank = 0
+    for tuple_type, tuple_ in tuples:
+        parents[tuple_['key']] = sorted(set(get_parent_keys(tuple_type, tuple_)))
+        try:
+            last_rank = max(last_rank, int(tuple_.get('rank')))
+        except (TypeError, ValueError):
+            pass
+    return parents, last_rank
+
+
+def get_children_counts(parents):
+    return collections.Counter(parent_key for parent_keys in parents.values() for parent_key in parent_keys)
+
+
+def get_plan_dependencies(tuples):
+    """Return the number of children of each tuple and the last rank of a compute plan.
+
+    `tuples` are the `(tuple_type, tuple)` of the training tuples of the compute plan, as returned by the ledger.
+    """
+    parents, last_rank = get_parents(tuples)
+    return get_children_counts(parents), last_rank
+
+
+def _load_plan_parents(channel_name, compute_plan_key):
+    from substrapp.ledger.api import get_object_from_ledger, get_objects_from_ledger
+
+    compute_plan = get_object_from_ledger(channel_name, compute_plan_key, 'queryComputePlan', use_cache=False)
+    tuples = []
+    for tuple_type, query in TRAINING_TUPLE_QUERIES.items():
+        keys = compute_plan.get(f'{tuple_type}_keys') or []
+        tuples.extend((tuple_type, tuple_)
+                      for tuple_ in get_objects_from_ledger(channel_name, keys, query, use_cache=False))
+    return get_parents(tuples)
+
+
+def record_plan_dependencies(channel_name, tuples):
+    """Record the parents of training tuples, from the events of a block, and return the
+    `(children counts, last rank)` of their compute plans by key.
+
+    `tuples` are `(tuple_type, tuple)` of training tuples of compute plans. A compute plan not recorded yet is
+    loaded from the ledger first, once: its tuples created before are not in the events.
+    """
+    from substrapp.models import ComputePlanDependencies
+
+    tuples_by_plan = collections.defaultdict(list)
+    for tuple_type, tuple_ in tuples:
+        tuples_by_plan[tuple_['compute_plan_key']].append((tuple_type, tuple_))
+    records = ComputePlanDependencies.objects.in_bulk(list(tuples_by_plan))
+
+    dependencies = {}
+    for compute_plan_key, plan_tuples in tuples_by_plan.items():
+        parents, last_rank = get_parents(plan_tuples)
+
+        record = records.get(compute_plan_key)
+        try:
+            if record is not None:
+                known_parents, known_last_rank = record.get_parents(), record.last_rank
+            else:
+                known_parents, known_last_rank = _load_plan_parents(channel_name, compute_plan_key)
+        except LedgerError as e:
+            # recorded with the next events
+            logger.warning(f'Cannot get the tuples of the compute plan {compute_plan_key}: {e}')
+        else:
+            parents, last_rank = {**known_parents, **parents}, max(known_last_rank, last_rank)
+            if record is None or parents != known_parents or last_rank != known_last_rank:
+                ComputePlanDependencies.objects.update_or_create(
+                    compute_plan_key=compute_plan_key,
+                    defaults={'parents': json.dumps(parents), 'last_rank': last_rank})
+
+        dependencies[compute_plan_key] = (get_children_counts(parents), last_rank)
+    return dependencies
+
+
+def get_priority(tuple_type, subtuple):
+    """Return the priority of the tasks of a tuple, from the recorded dependencies of its compute plan."""
+    if not is_enabled():
+        return None
+
+    from substrapp.models import ComputePlanDependencies
+
+    children_count, last_rank = 0, 0
+    compute_plan_key = subtuple.get('compute_plan_key')
+    if compute_plan_key and tuple_type in TRAINING_TUPLE_TYPES:
+        record = ComputePlanDependencies.objects.filter(compute_plan_key=compute_plan_key).first()
+        if record is not None:
+            children_count = get_children_counts(record.get_parents())[subtuple['key']]
+            last_rank = record.last_rank
+    return get_tuple_priority(tuple_type, subtuple, children_count, last_rank)
+
+
+def get_tuple_priority(tuple_type, subtuple, children_count=0, last_rank=0):
+    """Return the priority of the tasks of a tuple, None if priorities are disabled.
+
+    `last_rank` is the last rank of the compute plan of the tuple, 0 if unknown.
+    """
+    if not is_enabled():
+        return None
+
+    if tuple_type not in TRAINING_TUPLE_TYPES:
+        return 0
+
+    priority = TRAINING_PRIORITY
+
+    if subtuple.get('compute_plan_key'):
+        # 0, 1, 2-3, 4+ children: +0, +1, +2, +3
+        priority += min(MAX_CHILDREN_PRIORITY, math.ceil(math.log2(1 + children_count)))
+        try:
+            rank = int(subtuple.get('rank'))
+        except (TypeError, ValueError):
+            rank = None
+        if rank is not None:
+            if last_rank > 0:
+                remaining_ranks = max(0, last_rank - rank) / last_rank
+            else:
+                remaining_ranks = 1 if rank == 0 else 0
+            priority += round(MAX_RANK_PRIORITY * remaining_ranks)
+
+    return min(MAX_PRIORITY, priority)
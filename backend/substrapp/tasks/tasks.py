@@ -9,9 +9,10 @@ from os import path
 import json
 import logging
 import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import kubernetes
-from billiard import Process
 
 from django.conf import settings
 from rest_framework.reverse import reverse
@@ -25,12 +26,14 @@ from substrapp.utils import (get_hash, get_owner, create_directory, uncompress_c
                              get_dir_hash, get_subtuple_directory, get_chainkeys_directory,
                              get_cp_local_folder, timeit)
 from substrapp.ledger.api import (log_start_tuple, log_success_tuple, log_fail_tuple,
-                                  query_tuples, get_object_from_ledger)
+                                  iter_tuples, get_object_from_ledger)
 from substrapp.ledger.exceptions import LedgerError, LedgerStatusError
 from substrapp.tasks.utils import (compute_job, get_asset_content, get_and_put_asset_content,
-                                   list_files, do_not_raise, remove_image)
+                                   list_files, do_not_raise, remove_image, MODELS_FETCH_CONCURRENCY)
 
 from substrapp.tasks.exception_handler import compute_error_code
+from substrapp.tasks import priority as task_priority
+from substrapp.tasks import metrics as tasks_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -65,6 +68,7 @@ S3_PREFIX = os.getenv('BUCKET_TRANSFER_PREFIX')
 S3_REGION_NAME = os.getenv('BUCKET_TRANSFER_REGION', 'eu-west-1')
 
 CELERY_TASK_MAX_RETRIES = int(getattr(settings, 'CELERY_TASK_MAX_RETRIES'))
+MATERIALS_CONCURRENCY = int(settings.TASK['MATERIALS_CONCURRENCY'])
 
 
 class TasksError(Exception):
@@ -74,7 +78,7 @@ class TasksError(Exception):
 def get_objective(channel_name, tuple_):
 
     objective_key = tuple_['objective']['key']
-    objective_metadata = get_object_from_ledger(channel_name, objective_key, 'queryObjective')
+    objective_metadata = get_object_from_ledger(channel_name, objective_key, 'queryObjective', use_cache=False)
 
     objective_content = get_asset_content(
         channel_name,
@@ -107,7 +111,7 @@ def get_algo(channel_name, tuple_type, tuple_):
     method_name = query_method_names_mapper[tuple_type]
 
     key = tuple_['algo']['key']
-    metadata = get_object_from_ledger(channel_name, key, method_name)
+    metadata = get_object_from_ledger(channel_name, key, method_name, use_cache=False)
 
     content = get_asset_content(
         channel_name,
@@ -140,7 +144,7 @@ def find_training_step_tuple_from_key(channel_name, tuple_key):
 
     Applies to traintuple, composite traintuple and aggregatetuple.
     """
-    metadata = get_object_from_ledger(channel_name, tuple_key, 'queryModelDetails')
+    metadata = get_object_from_ledger(channel_name, tuple_key, 'queryModelDetails', use_cache=False)
     if metadata.get('aggregatetuple'):
         return AGGREGATETUPLE_TYPE, metadata['aggregatetuple']
     if metadata.get('composite_traintuple'):
@@ -152,7 +156,7 @@ def find_training_step_tuple_from_key(channel_name, tuple_key):
 
 
 def get_testtuple(channel_name, key):
-    return get_object_from_ledger(channel_name, key, 'queryTesttuple')
+    return get_object_from_ledger(channel_name, key, 'queryTesttuple', use_cache=False)
 
 
 def get_tuple_status(channel_name, tuple_type, key):
@@ -222,32 +226,40 @@ def fetch_model(channel_name, parent_tuple_type, authorized_types, input_model,
         raise TasksError(f'Traintuple: invalid input model: type={tuple_type}')
 
 
-def fetch_models(channel_name, tuple_type, authorized_types, input_models, directory):
-
-    models = []
-    exceptions = []
-
-    # Close django connection to force each Process to create its own as
-    # django orm connection is not fork safe https://code.djangoproject.com/ticket/20562
+def fetch_model_in_thread(*args):
     from django import db
-    db.connections.close_all()
+    try:
+        fetch_model(*args)
+    finally:
+        # the database connection of the thread, if it opened one
+        db.connection.close()
 
-    for input_model in input_models:
-        args = (channel_name, tuple_type, authorized_types, input_model, directory)
-        proc = Process(target=fetch_model, args=args)
-        models.append((proc, args))
-        proc.start()
 
-    for proc, args in models:
-        proc.join()
-        if proc.exitcode != 0:
-            exceptions.append(Exception(f'fetch model failed for args {args}'))
+def fetch_models(channel_name, tuple_type, authorized_types, input_models, directory):
+    """Fetch the `input_models` of a tuple concurrently, on a thread pool of TASK_MODELS_FETCH_CONCURRENCY threads.
 
-    # Close django old connections to avoid potential leak
-    db.close_old_connections()
+    The threads share the ledger connection of the process and the HTTP session of each node. Raise a
+    TasksError with the error of each model which failed.
+    """
+    if not input_models:
+        return
 
-    if exceptions:
-        raise Exception(exceptions)
+    max_workers = min(MODELS_FETCH_CONCURRENCY, len(input_models))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch-model') as executor:
+        futures = [
+            (input_model, executor.submit(
+                fetch_model_in_thread, channel_name, tuple_type, authorized_types, input_model, directory))
+            for input_model in input_models
+        ]
+
+    errors = [(input_model, future.exception()) for input_model, future in futures
+              if future.exception() is not None]
+    if errors:
+        details = '; '.join(f'{input_model["traintuple_key"]}: {type(error).__name__}: {error}'
+                            for input_model, error in errors)
+        raise TasksError(
+            f'{tuple_type.capitalize()}: fetch of {len(errors)}/{len(input_models)} input models failed: {details}'
+        ) from errors[0][1]
 
 
 def prepare_traintuple_input_models(channel_name, directory, tuple_):
@@ -321,7 +333,7 @@ def prepare_testtuple_input_models(channel_name, directory, tuple_):
     # TODO we should use the find method to be consistent with the traintuple
 
     if traintuple_type == TRAINTUPLE_TYPE:
-        metadata = get_object_from_ledger(channel_name, traintuple_key, 'queryTraintuple')
+        metadata = get_object_from_ledger(channel_name, traintuple_key, 'queryTraintuple', use_cache=False)
         model_dst_path = path.join(directory, f'model/{traintuple_key}')
         raise_if_path_traversal([model_dst_path], path.join(directory, 'model/'))
         get_and_put_model_content(
@@ -329,7 +341,7 @@ def prepare_testtuple_input_models(channel_name, directory, tuple_):
         )
 
     elif traintuple_type == COMPOSITE_TRAINTUPLE_TYPE:
-        metadata = get_object_from_ledger(channel_name, traintuple_key, 'queryCompositeTraintuple')
+        metadata = get_object_from_ledger(channel_name, traintuple_key, 'queryCompositeTraintuple', use_cache=False)
         head_model_dst_path = path.join(directory, f'model/{PREFIX_HEAD_FILENAME}{traintuple_key}')
         raise_if_path_traversal([head_model_dst_path], path.join(directory, 'model/'))
         get_and_put_local_model_content(traintuple_key, metadata['out_head_model']['out_model'], head_model_dst_path)
@@ -502,25 +514,40 @@ def prepare_task(channel_name, tuple_type):
 def prepare_channel_task(channel_name, tuple_type):
     data_owner = get_owner()
     worker_queue = f"{settings.ORG_NAME}.worker"
-    tuples = query_tuples(channel_name, tuple_type, data_owner)
-
-    for subtuple in tuples:
+    # Tuples are dispatched as ledger pages are received
+    for subtuple in iter_tuples(channel_name, tuple_type, data_owner):
         tkey = subtuple['key']
         # Verify that tuple task does not already exist
         if AsyncResult(tkey).state == 'PENDING':
             prepare_tuple.apply_async(
                 (channel_name, subtuple, tuple_type),
                 task_id=tkey,
-                queue=worker_queue
+                queue=worker_queue,
+                priority=task_priority.get_priority(tuple_type, subtuple)
             )
         else:
             print(f'[Scheduler ({channel_name})] Tuple task ({tkey}) already exists')
 
 
-@app.task(ignore_result=False)
-def prepare_tuple(channel_name, subtuple, tuple_type):
-    from django_celery_results.models import TaskResult
+def get_compute_plan_worker(compute_plan_key):
+    """Return the worker queue of the tuples of a compute plan, None if none of them has started yet."""
+    from substrapp.models import ComputePlanWorker
+    return (ComputePlanWorker.objects
+            .filter(compute_plan_key=compute_plan_key)
+            .values_list('worker', flat=True)
+            .first())
+
 
+def set_compute_plan_worker(compute_plan_key, worker, queue):
+    """Record that a tuple of a compute plan runs on `worker`. The latest worker of a compute plan is kept."""
+    from substrapp.models import ComputePlanWorker
+    ComputePlanWorker.objects.update_or_create(
+        compute_plan_key=compute_plan_key, defaults={'worker': worker, 'queue': queue})
+
+
+@app.task(ignore_result=False)
+def prepare_tuple(channel_name, subtuple, tuple_type, priority=None):
+    """Start a tuple and publish its compute task, with `priority` as computed by the events service."""
     compute_plan_key = None
     worker_queue = f"{settings.ORG_NAME}.worker"
     key = subtuple['key']
@@ -542,15 +569,10 @@ def prepare_tuple(channel_name, subtuple, tuple_type):
 
     if 'compute_plan_key' in subtuple and subtuple['compute_plan_key']:
         compute_plan_key = subtuple['compute_plan_key']
-        flresults = TaskResult.objects.filter(
-            task_name='substrapp.tasks.tasks.compute_task',
-            result__icontains=f'"compute_plan_key": "{compute_plan_key}"')
-
-        if flresults and flresults.count() > 0:
-            worker_queue = json.loads(flresults.first().as_dict()['result'])['worker']
+        worker_queue = get_compute_plan_worker(compute_plan_key) or worker_queue
 
     try:
-        log_start_tuple(channel_name, tuple_type, key)
+        log_start_tuple(channel_name, tuple_type, key, compute_plan_key=subtuple.get('compute_plan_key'))
     except LedgerStatusError as e:
         # Do not log_fail_tuple in this case, because prepare_tuple task are not unique
         # in case of multiple instances of substra backend running for the same organisation
@@ -560,7 +582,8 @@ def prepare_tuple(channel_name, subtuple, tuple_type):
 
     compute_task.apply_async(
         (channel_name, tuple_type, subtuple, compute_plan_key),
-        queue=worker_queue)
+        queue=worker_queue,
+        priority=priority if priority is not None else task_priority.get_priority(tuple_type, subtuple))
 
 
 class ComputeTask(Task):
@@ -570,7 +593,8 @@ class ComputeTask(Task):
 
         channel_name, tuple_type, subtuple, compute_plan_key = self.split_args(args)
         try:
-            log_success_tuple(channel_name, tuple_type, subtuple['key'], retval['result'])
+            log_success_tuple(channel_name, tuple_type, subtuple['key'], retval['result'],
+                              compute_plan_key=subtuple.get('compute_plan_key'))
         except LedgerError as e:
             logger.exception(e)
 
@@ -589,7 +613,8 @@ class ComputeTask(Task):
             type_exc = type(exc)
             type_value = str(type_exc).split("'")[1]
             logger.error(f'Failed compute task: {tuple_type} {subtuple["key"]} {error_code} - {type_value}')
-            log_fail_tuple(channel_name, tuple_type, subtuple['key'], error_code)
+            log_fail_tuple(channel_name, tuple_type, subtuple['key'], error_code,
+                           compute_plan_key=subtuple.get('compute_plan_key'))
         except LedgerError as e:
             logger.exception(e)
 
@@ -616,6 +641,12 @@ def compute_task(self, channel_name, tuple_type, subtuple, compute_plan_key):
 
     result = {'worker': worker, 'queue': queue, 'compute_plan_key': compute_plan_key}
 
+    if compute_plan_key:
+        try:
+            set_compute_plan_worker(compute_plan_key, worker, queue)
+        except Exception as e:
+            logger.exception(e)
+
     try:
         prepare_materials(channel_name, subtuple, tuple_type)
         res = do_task(channel_name, subtuple, tuple_type)
@@ -637,36 +668,79 @@ def compute_task(self, channel_name, tuple_type, subtuple, compute_plan_key):
     return result
 
 
+def run_materials_stage(tuple_type, stage, function, args, durations):
+    from django import db
+    ts = time.time()
+    try:
+        function(*args)
+    finally:
+        durations[stage] = time.time() - ts
+        tasks_metrics.MATERIALS_STAGE_DURATION.labels(tuple_type=tuple_type, stage=stage).observe(durations[stage])
+        # the database connection of the thread, if it opened one
+        db.connection.close()
+
+
+def run_materials_stages(tuple_type, stages):
+    """Run the materials `stages` concurrently, on a thread pool of TASK_MATERIALS_CONCURRENCY threads.
+
+    Stages are `(function, args)` by stage name, independent of each other. Return their durations by
+    stage name. The error of the first failed stage, in stage order, is raised once all of them are finished,
+    so the subtuple folder is not removed while a stage still writes in it.
+
+    A stage must not fork (e.g. with multiprocessing): the child process would inherit the locks held by the
+    other threads of the pool.
+    """
+    durations = {}
+
+    with ThreadPoolExecutor(max_workers=MATERIALS_CONCURRENCY, thread_name_prefix='materials') as executor:
+        futures = [executor.submit(run_materials_stage, tuple_type, stage, function, args, durations)
+                   for stage, (function, args) in stages.items()]
+        wait(futures)
+
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        raise errors[0]
+    return durations
+
+
 @timeit
 def prepare_materials(channel_name, subtuple, tuple_type):
     logger.info(f'Prepare materials for task [{tuple_type}:{subtuple["key"]}]: Started.')
+    ts = time.time()
 
     # clean directory if exists (on retry)
     subtuple_directory = get_subtuple_directory(subtuple['key'])
     if os.path.exists(subtuple_directory):
         remove_subtuple_materials(subtuple_directory)
 
-    # create directory
+    # create directory: the stages only depend on it
     directory = build_subtuple_folders(subtuple)
 
+    stages = {}
+
     # metrics
     if tuple_type == TESTTUPLE_TYPE:
-        prepare_objective(channel_name, directory, subtuple)
+        stages['objective'] = (prepare_objective, (channel_name, directory, subtuple))
 
     # algo
     traintuple_type = (subtuple['traintuple_type'] if tuple_type == TESTTUPLE_TYPE else
                        tuple_type)
-    prepare_algo(channel_name, directory, traintuple_type, subtuple)
+    stages['algo'] = (prepare_algo, (channel_name, directory, traintuple_type, subtuple))
 
     # opener
     if tuple_type in (TESTTUPLE_TYPE, TRAINTUPLE_TYPE, COMPOSITE_TRAINTUPLE_TYPE):
-        prepare_opener(directory, subtuple)
-        prepare_data_sample(directory, subtuple)
+        stages['opener'] = (prepare_opener, (directory, subtuple))
+        stages['data_sample'] = (prepare_data_sample, (directory, subtuple))
 
     # input models
-    prepare_models(channel_name, directory, tuple_type, subtuple)
+    stages['models'] = (prepare_models, (channel_name, directory, tuple_type, subtuple))
+
+    durations = run_materials_stages(tuple_type, stages)
+    tasks_metrics.MATERIALS_DURATION.labels(tuple_type=tuple_type).observe(time.time() - ts)
 
-    logger.info(f'Prepare materials for task [{tuple_type}:{subtuple["key"]}]: Success. {list_files(directory)}')
+    timings = ', '.join(f'{stage}: {duration * 1000:.2f} ms' for stage, duration in durations.items())
+    logger.info(f'Prepare materials for task [{tuple_type}:{subtuple["key"]}]: Success ({timings}).'
+                f' {list_files(directory)}')
 
 
 @timeit
@@ -681,7 +755,7 @@ def do_task(channel_name, subtuple, tuple_type):
     if 'compute_plan_key' in subtuple and subtuple['compute_plan_key']:
         compute_plan_key = subtuple['compute_plan_key']
         rank = int(subtuple['rank'])
-        compute_plan = get_object_from_ledger(channel_name, compute_plan_key, 'queryComputePlan')
+        compute_plan = get_object_from_ledger(channel_name, compute_plan_key, 'queryComputePlan', use_cache=False)
         compute_plan_tag = compute_plan['tag']
 
     common_volumes, compute_volumes = prepare_volumes(
@@ -2,11 +2,15 @@ import os
 import json
 import logging
 import functools
+import threading
 
+import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from substrapp.utils import get_owner, get_remote_file_content, get_and_put_remote_file_content, NodeError, timeit
 
+from substrapp.tasks import asset_cache
 from substrapp.tasks.k8s_backend import (
     k8s_get_image, k8s_build_image, k8s_remove_image, k8s_compute, ImageNotFound, BuildError)
 
@@ -15,6 +19,7 @@ CELERYWORKER_IMAGE = os.environ.get('CELERYWORKER_IMAGE', 'substrafoundation/cel
 CELERY_WORKER_CONCURRENCY = int(getattr(settings, 'CELERY_WORKER_CONCURRENCY'))
 TASK_LABEL = 'substra_task'
 BUILD_IMAGE = settings.TASK['BUILD_IMAGE']
+MODELS_FETCH_CONCURRENCY = int(settings.TASK['MODELS_FETCH_CONCURRENCY'])
 
 logger = logging.getLogger(__name__)
 
@@ -39,13 +44,56 @@ def authenticate_worker(node_id):
     return auth
 
 
+_node_sessions = {}
+_node_sessions_pid = None
+_node_sessions_lock = threading.Lock()
+
+
+def get_node_session(node_id):
+    """Return the keep-alive HTTP session to `node_id`, shared by the threads of the process."""
+    global _node_sessions_pid
+
+    with _node_sessions_lock:
+        if _node_sessions_pid != os.getpid():
+            # the connections of a session must not be shared with a forked process
+            _node_sessions.clear()
+            _node_sessions_pid = os.getpid()
+
+        session = _node_sessions.get(node_id)
+        if session is None:
+            session = requests.Session()
+            # as many connections as models fetched in parallel from the node
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MODELS_FETCH_CONCURRENCY)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _node_sessions[node_id] = session
+        return session
+
+
 def get_asset_content(channel_name, url, node_id, content_checksum, salt=None):
-    return get_remote_file_content(channel_name, url, authenticate_worker(node_id), content_checksum, salt=salt)
+    if asset_cache.is_enabled():
+        content = asset_cache.get_content(content_checksum, salt=salt)
+        if content is not None:
+            return content
+
+    content = get_remote_file_content(channel_name, url, authenticate_worker(node_id), content_checksum, salt=salt,
+                                      session=get_node_session(node_id))
+
+    if asset_cache.is_enabled():
+        asset_cache.put_content(content_checksum, content)
+    return content
 
 
 def get_and_put_asset_content(channel_name, url, node_id, content_checksum, content_dst_path, hash_key):
-    return get_and_put_remote_file_content(channel_name, url, authenticate_worker(node_id), content_checksum,
-                                           content_dst_path=content_dst_path, hash_key=hash_key)
+    if asset_cache.is_enabled() and asset_cache.get_file(content_checksum, content_dst_path, hash_key=hash_key):
+        return
+
+    get_and_put_remote_file_content(channel_name, url, authenticate_worker(node_id), content_checksum,
+                                    content_dst_path=content_dst_path, hash_key=hash_key,
+                                    session=get_node_session(node_id))
+
+    if asset_cache.is_enabled():
+        asset_cache.put_file(content_checksum, content_dst_path)
 
 
 def path_to_dict(path):
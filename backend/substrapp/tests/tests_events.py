@@ -0,0 +1,499 @@
+import asyncio
+import concurrent.futures
+import json
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import mock
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django_celery_results.backends import DatabaseBackend
+from django_celery_results.models import TaskResult
+from prometheus_client import REGISTRY
+
+from events import dispatch
+from events.checkpoint import ChannelCheckpoint
+from events.dispatch_queue import DispatchQueue
+from events.server import start_events_server
+from events.service import Backoff, ChannelListener, EventsService, get_block_timestamp
+from substrapp.models import ComputePlanWorker, EventCheckpoint
+
+CHANNEL = 'mychannel'
+OWNER = 'MyOrg1MSP'
+
+
+def make_event(block_number, tx_id, payload, tx_status='VALID'):
+    return {
+        'chaincode_event': {'payload': json.dumps(payload).encode()},
+        'block_num': block_number,
+        'tx_id': tx_id,
+        'tx_status': tx_status,
+    }
+
+
+def make_tuple(key, worker=OWNER, status='todo'):
+    return {'key': key, 'status': status, 'dataset': {'worker': worker}}
+
+
+class ImmediateExecutor(concurrent.futures.Executor):
+    """Run the database work of the listener in the thread of the test, inside its transaction."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+@override_settings(LEDGER_EVENTS_CHECKPOINT_OVERLAP_BLOCKS=10)
+class EventCheckpointTests(TestCase):
+
+    def test_start_block(self):
+        checkpoint = ChannelCheckpoint(CHANNEL)
+        self.assertEqual(checkpoint.get_start_block(), 0)
+
+        EventCheckpoint.objects.create(channel=CHANNEL, block_number=5)
+        self.assertEqual(checkpoint.get_start_block(), 0)
+
+        EventCheckpoint.objects.filter(channel=CHANNEL).update(block_number=100)
+        self.assertEqual(checkpoint.get_start_block(), 91)
+        self.assertEqual(ChannelCheckpoint('otherchannel').get_start_block(), 0)
+
+    def test_save(self):
+        checkpoint = ChannelCheckpoint(CHANNEL)
+        checkpoint.get_start_block()
+        checkpoint.set_head(120)
+
+        checkpoint.save(100)
+        self.assertEqual(EventCheckpoint.objects.get(channel=CHANNEL).block_number, 100)
+        self.assertEqual(REGISTRY.get_sample_value('events_checkpoint_block', {'channel': CHANNEL}), 100)
+        self.assertEqual(REGISTRY.get_sample_value('events_lag_blocks', {'channel': CHANNEL}), 20)
+
+        # replayed blocks
+        checkpoint.save(95)
+        self.assertEqual(EventCheckpoint.objects.get(channel=CHANNEL).block_number, 100)
+
+        checkpoint.set_head(130)
+        checkpoint.save(125)
+        self.assertEqual(ChannelCheckpoint(CHANNEL).load(), 125)
+        self.assertEqual(REGISTRY.get_sample_value('events_lag_blocks', {'channel': CHANNEL}), 5)
+
+
+@override_settings(ORG_NAME='MyOrg1')
+class EventDispatchTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('events.dispatch.get_owner', return_value=OWNER)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_tasks(self):
+        events = [
+            make_event(3, 'tx1', {
+                'traintuple': [make_tuple('todo'), make_tuple('other', worker='MyOrg2MSP'),
+                               make_tuple('doing', status='doing')],
+                'aggregatetuple': [{'key': 'aggregate', 'status': 'todo', 'worker': OWNER}],
+                'testtuple': None,
+            }),
+            make_event(3, 'tx2', {'traintuple': [make_tuple('invalid')]}, tx_status='MVCC_READ_CONFLICT'),
+            make_event(3, 'tx3', {'traintuple': [make_tuple('todo')],
+                                  'compute_plan': [{'compute_plan_key': 'cp', 'status': 'done'}]}),
+        ]
+
+        stats = dispatch.DispatchStats()
+        tasks = dispatch.get_tasks(CHANNEL, events, stats)
+
+        self.assertEqual(list(tasks), ['todo', 'aggregate', 'cp_tx3'])
+        self.assertEqual(tasks['todo'][0], 'traintuple')
+        self.assertEqual(tasks['todo'][1].args, (CHANNEL, make_tuple('todo'), 'traintuple', None))
+        self.assertEqual(tasks['cp_tx3'][1].task, 'substrapp.tasks.tasks.on_compute_plan')
+        self.assertEqual(stats.outcomes, {
+            ('traintuple', dispatch.SKIPPED_NOT_OWNER): 1,
+            ('traintuple', dispatch.SKIPPED_STATUS): 1,
+            ('traintuple', dispatch.INVALID_TRANSACTION): 1,
+            ('traintuple', dispatch.SKIPPED_DUPLICATE): 1,
+        })
+        self.assertEqual(set(stats.durations), {'traintuple', 'aggregatetuple', 'compute_plan'})
+
+    @override_settings(TASK=dict(settings.TASK, PRIORITY_ENABLED=True))
+    def test_get_tasks_priority(self):
+        parent = {**make_tuple('parent'), 'compute_plan_key': 'cp', 'rank': 0}
+        child = {**make_tuple('child', status='waiting'), 'compute_plan_key': 'cp', 'rank': 1,
+                 'in_models': [{'traintuple_key': 'parent'}]}
+        events = [make_event(3, 'tx1', {'traintuple': [parent, child]})]
+
+        with mock.patch('substrapp.tasks.priority._load_plan_parents', return_value=({}, 0)):
+            tasks = dispatch.get_tasks(CHANNEL, events)
+
+        # 1 child created in the same block, first rank
+        self.assertEqual(tasks['parent'][1].args[3], 8)
+        self.assertEqual(tasks['parent'][1].options['priority'], 8)
+
+    def test_get_existing_task_ids(self):
+        TaskResult.objects.create(task_id='done')
+
+        with mock.patch.object(dispatch.app, 'backend', new=mock.Mock(spec=DatabaseBackend)):
+            self.assertEqual(dispatch.get_existing_task_ids(['done', 'new']), {'done'})
+
+        with mock.patch('events.dispatch.AsyncResult') as masync_result:
+            masync_result.side_effect = lambda task_id: mock.Mock(state='SUCCESS' if task_id == 'done' else 'PENDING')
+            self.assertEqual(dispatch.get_existing_task_ids(['done', 'new']), {'done'})
+
+    def test_dispatch_events(self):
+        events = [make_event(3, 'tx1', {'traintuple': [make_tuple('done'), make_tuple('new')]})]
+
+        with mock.patch('events.dispatch.get_existing_task_ids', return_value={'done'}) as mget_existing, \
+                mock.patch.object(dispatch.app, 'producer_or_acquire') as mproducer, \
+                mock.patch('celery.canvas.Signature.apply_async') as mapply_async:
+            stats = dispatch.dispatch_events(CHANNEL, events)
+
+        self.assertEqual(stats.as_dict()['outcomes'], {dispatch.ENQUEUED: 1, dispatch.SKIPPED_EXISTING: 1})
+        self.assertEqual(REGISTRY.get_sample_value(
+            'events_dispatch_outcomes_total',
+            {'channel': CHANNEL, 'event_type': 'traintuple', 'outcome': dispatch.ENQUEUED}), 1)
+        self.assertEqual(REGISTRY.get_sample_value(
+            'events_block_processing_seconds_count', {'channel': CHANNEL}), 1)
+
+        mget_existing.assert_called_once_with(['done', 'new'])
+        mproducer.assert_called_once()
+        mapply_async.assert_called_once_with(
+            task_id='new', queue='MyOrg1.worker', producer=mproducer.return_value.__enter__.return_value)
+
+    def test_prefetch(self):
+        def make_cp_tuple(key, status, worker=OWNER, compute_plan_key='cp'):
+            return {**make_tuple(key, worker=worker, status=status), 'compute_plan_key': compute_plan_key}
+
+        events = [make_event(3, 'tx1', {
+            'traintuple': [make_cp_tuple('waiting', 'waiting'), make_cp_tuple('other', 'waiting', worker='MyOrg2MSP'),
+                           make_cp_tuple('done', 'done', worker='MyOrg2MSP'), make_tuple('standalone', 'waiting'),
+                           make_cp_tuple('done_new', 'done', compute_plan_key='new_cp')],
+            'testtuple': [make_cp_tuple('test_done', 'done')],
+        })]
+
+        prefetch = []
+        dispatch.get_tasks(CHANNEL, events, prefetch=prefetch)
+        self.assertEqual(prefetch, [
+            ('cp', {'tuple_type': 'traintuple', 'tuple': make_cp_tuple('waiting', 'waiting')}),
+            ('cp', {'model': 'done'}),
+            ('new_cp', {'model': 'done_new'}),
+        ])
+
+        ComputePlanWorker.objects.create(compute_plan_key='cp', worker='MyOrg1.worker', queue='MyOrg1.worker')
+        with mock.patch('events.dispatch.request_prefetch') as mrequest_prefetch:
+            dispatch.publish_prefetch(CHANNEL, prefetch + [('new_cp', {'tuple_type': 'traintuple', 'tuple': {}})])
+
+        # the node does not take part in new_cp yet: its models are not prefetched
+        mrequest_prefetch.assert_has_calls([
+            mock.call(CHANNEL, [prefetch[0][1], prefetch[1][1]], 'MyOrg1.worker'),
+            mock.call(CHANNEL, [{'tuple_type': 'traintuple', 'tuple': {}}], None),
+        ])
+        self.assertEqual(REGISTRY.get_sample_value(
+            'events_prefetch_requests_total', {'channel': CHANNEL, 'kind': 'model'}), 1)
+
+
+@override_settings(
+    LEDGER_EVENTS_CHECKPOINT_OVERLAP_BLOCKS=10,
+    LEDGER_EVENTS_RECONNECT_MIN_SECONDS=1,
+    LEDGER_EVENTS_RECONNECT_MAX_SECONDS=8,
+    LEDGER_EVENTS_QUEUE_MAX_SIZE=2,
+    LEDGER_EVENTS_QUEUE_SPILL_DIR='',
+    LEDGER_MIRROR_ENABLED=False,
+)
+class EventsServiceTests(TestCase):
+
+    def make_listener(self, channel_name=CHANNEL):
+        listener = ChannelListener(channel_name, mock.Mock(), mock.Mock(), mock.Mock())
+        listener.executor.shutdown()
+        listener.executor = ImmediateExecutor()
+        return listener
+
+    def test_backoff(self):
+        backoff = Backoff(1, 8)
+        with mock.patch('events.service.random.uniform', return_value=1):
+            self.assertEqual([backoff.next() for _ in range(5)], [1, 2, 4, 8, 8])
+            backoff.reset()
+            self.assertEqual(backoff.next(), 1)
+
+    def test_reconnect(self):
+        listener = self.make_listener()
+        listener.backoff.attempts = 3
+
+        async def listen():
+            if listener.reconnections == 0:
+                raise ValueError('unavailable')
+            if listener.reconnections == 1:
+                # stream closed by the peer after a block
+                with mock.patch('events.service.ledger_cache.invalidate_block'):
+                    listener.on_channel_block({'header': {'number': 5}})
+                self.assertTrue(listener.get_health()['connected'])
+                return
+            raise asyncio.CancelledError()
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        sleep = asyncio.sleep
+
+        with mock.patch.object(listener, 'listen', side_effect=listen), \
+                mock.patch('events.service.asyncio.sleep', side_effect=lambda delay: sleep(0)) as msleep, \
+                mock.patch('events.service.random.uniform', return_value=1):
+            with self.assertRaises(asyncio.CancelledError):
+                loop.run_until_complete(listener.run())
+
+        # the backoff is reset once connected
+        self.assertEqual([c[0][0] for c in msleep.call_args_list], [8, 1])
+        health = listener.get_health()
+        self.assertFalse(health['connected'])
+        self.assertEqual(health['last_block'], 5)
+        self.assertEqual(health['checkpoint'], 4)
+        self.assertEqual(health['last_error'], 'stream closed')
+        self.assertEqual(health['reconnections'], 2)
+        self.assertEqual(REGISTRY.get_sample_value('events_channel_connected', {'channel': CHANNEL}), 0)
+
+    def test_dispatch(self):
+        listener = self.make_listener()
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        dispatched = []
+
+        def dispatch_events(channel_name, events):
+            if not dispatched:
+                dispatched.append(None)
+                raise ConnectionError('broker unavailable')
+            dispatched.append(events[0]['block_num'])
+            stats = dispatch.DispatchStats()
+            stats.add('traintuple', dispatch.ENQUEUED)
+            return stats
+
+        async def listen():
+            listener.queue = DispatchQueue(CHANNEL, 2)
+            worker = asyncio.ensure_future(listener.dispatch_worker())
+            with mock.patch('events.service.ledger_cache.invalidate_block'):
+                for block_number in (3, 4):
+                    listener.on_channel_block({'header': {'number': block_number}})
+                    listener.on_channel_events([make_event(block_number, 'tx', {})])
+                listener.on_channel_block({'header': {'number': 5}})
+            # the events of the blocks 3 and 4 are not dispatched yet
+            self.assertEqual(EventCheckpoint.objects.get(channel=CHANNEL).block_number, 2)
+
+            while listener.pending:
+                await asyncio.sleep(0.01)
+            worker.cancel()
+
+        with mock.patch('events.service.dispatch_events', side_effect=dispatch_events), \
+                mock.patch('events.service.random.uniform', return_value=0):
+            loop.run_until_complete(listen())
+
+        # retried after the failure
+        self.assertEqual(dispatched, [None, 3, 4])
+        status = listener.get_status()
+        self.assertEqual(status['last_dispatch']['block'], 4)
+        self.assertEqual(status['outcomes'], {dispatch.ENQUEUED: 2})
+        self.assertEqual(status['pending_blocks'], [])
+        self.assertEqual(EventCheckpoint.objects.get(channel=CHANNEL).block_number, 5)
+        self.assertEqual(REGISTRY.get_sample_value('events_dispatch_errors_total', {'channel': CHANNEL}), 1)
+
+    def test_block_off_loop(self):
+        listener = ChannelListener(CHANNEL, mock.Mock(), mock.Mock(), mock.Mock())
+        threads = []
+
+        with mock.patch('events.service.ledger_cache.invalidate_block',
+                        side_effect=lambda *args: threads.append(threading.current_thread())), \
+                mock.patch.object(listener.checkpoint, 'save',
+                                  side_effect=lambda *args: threads.append(threading.current_thread())):
+            listener.on_channel_block({'header': {'number': 3}})
+            listener.executor.shutdown()
+
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    @override_settings(LEDGER_MIRROR_ENABLED=True)
+    def test_mirror(self):
+        listener = self.make_listener()
+        applied = []
+
+        def apply_block(channel_name, block):
+            applied.append((block['header']['number'], threading.current_thread()))
+            if len(applied) == 1:
+                raise ValueError('unavailable')
+
+        with mock.patch('events.service.ledger_cache.invalidate_block'), \
+                mock.patch('events.service.ledger_indexer.apply_block', side_effect=apply_block), \
+                mock.patch('events.service.time.sleep') as msleep, \
+                mock.patch('events.service.ledger_mirror.set_head') as mset_head:
+            for block_number in (3, 4, 5):
+                listener.on_channel_block({'header': {'number': block_number}})
+            listener.mirror_executor.shutdown()
+
+        self.assertEqual(mset_head.call_args_list, [mock.call(CHANNEL, n) for n in (3, 4, 5)])
+
+        # in order, off the loop, and a failed block is retried before the next ones
+        self.assertEqual([block_number for block_number, _ in applied], [3, 3, 4, 5])
+        msleep.assert_called_once()
+        self.assertEqual(len({thread for _, thread in applied}), 1)
+        self.assertNotEqual(applied[0][1], threading.current_thread())
+
+    @override_settings(LEDGER_CHANNELS={CHANNEL: {'chaincode': {'name': 'mycc'}}})
+    def test_listen_ledger_height_timeout(self):
+        listener = self.make_listener()
+        listener.queue = mock.Mock()
+        channel_event_hub = listener.channel.newChannelEventHub.return_value
+        channel_event_hub.handle_stream.side_effect = lambda stream: asyncio.sleep(0)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        ticks = []
+
+        async def tick():
+            # the loop is not blocked by the query of the ledger height
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0.01)
+
+        async def listen():
+            ticker = asyncio.ensure_future(tick())
+            await listener.listen()
+            ticker.cancel()
+
+        with mock.patch('events.service.get_ledger_height', side_effect=lambda *args: time.sleep(0.2)), \
+                mock.patch('events.service.LEDGER_HEIGHT_TIMEOUT_SECONDS', 0.1):
+            loop.run_until_complete(listen())
+
+        channel_event_hub.handle_stream.assert_called_once()
+        self.assertGreater(len(ticks), 1)
+        self.assertIsNone(listener.checkpoint.head)
+
+    @override_settings(LEDGER_MIRROR_MAX_LAG_SECONDS=0.03)
+    def test_mirror_heartbeat(self):
+        listener = self.make_listener()
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def heartbeat():
+            task = asyncio.ensure_future(listener.mirror_heartbeat())
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        with mock.patch('events.service.get_ledger_height', return_value=8), \
+                mock.patch('events.service.ledger_mirror.set_head') as mset_head:
+            loop.run_until_complete(heartbeat())
+
+        mset_head.assert_called_with(CHANNEL, 7)
+
+    @override_settings(LEDGER_CHANNELS={CHANNEL: {'chaincode': {'name': 'mycc'}}})
+    def test_listen_start_block(self):
+        listener = self.make_listener()
+        listener.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(listener.executor.shutdown)
+        listener.queue = mock.Mock()
+        channel_event_hub = listener.channel.newChannelEventHub.return_value
+        channel_event_hub.handle_stream.side_effect = lambda stream: asyncio.sleep(0)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        threads = []
+
+        def get_start_block():
+            threads.append(threading.current_thread())
+            return 7
+
+        with mock.patch.object(listener.checkpoint, 'get_start_block', side_effect=get_start_block), \
+                mock.patch('events.service.db.close_old_connections'), \
+                mock.patch('events.service.get_ledger_height', return_value=10):
+            loop.run_until_complete(listener.listen())
+
+        # the checkpoint is read off the loop
+        self.assertNotIn(threading.current_thread(), threads)
+        channel_event_hub.connect.assert_called_once_with(start=7, filtered=False)
+
+    def test_block_timestamp(self):
+        block = {'data': {'data': [{'payload': {'header': {'channel_header': {'timestamp': '2020-09-01 12:00:00'}}}}]}}
+        self.assertEqual(get_block_timestamp(block), 1598961600)
+        self.assertIsNone(get_block_timestamp({'data': {'data': []}}))
+
+    def test_health(self):
+        service = EventsService([CHANNEL, 'otherchannel'])
+        service.listeners = {name: self.make_listener(name) for name in service.channel_names}
+        service.listeners[CHANNEL].connected = True
+
+        server = start_events_server(service, 0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(f'{url}/health')
+        self.assertEqual(cm.exception.code, 503)
+        health = json.loads(cm.exception.read())
+        self.assertFalse(health['healthy'])
+        self.assertTrue(health['channels'][CHANNEL]['connected'])
+
+        service.listeners['otherchannel'].connected = True
+        with urllib.request.urlopen(f'{url}/health') as response:
+            self.assertTrue(json.loads(response.read())['healthy'])
+
+        service.listeners[CHANNEL].checkpoint.set_head(12)
+        service.listeners[CHANNEL].checkpoint.block_number = 10
+        with urllib.request.urlopen(f'{url}/status') as response:
+            status = json.loads(response.read())
+        self.assertEqual(status['channels'][CHANNEL]['lag_blocks'], 2)
+        self.assertIsNone(status['channels']['otherchannel']['lag_blocks'])
+
+
+class DispatchQueueTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(self.loop.close)
+
+    def test_backpressure(self):
+        queue = DispatchQueue(CHANNEL, 2)
+        received = []
+
+        async def stream():
+            for i in range(4):
+                yield i
+
+        async def read():
+            async for message in queue.throttle(stream()):
+                received.append(message)
+                queue.put_nowait(message)
+
+        async def run():
+            reader = asyncio.ensure_future(read())
+            await asyncio.sleep(0.01)
+            # the next message is not read until there is space in the queue
+            self.assertEqual(received, [0, 1])
+            self.assertTrue(queue.full())
+
+            self.assertEqual(await queue.get(), 0)
+            await asyncio.sleep(0.01)
+            self.assertEqual(received, [0, 1, 2])
+
+            items = [await queue.get() for _ in range(3)]
+            await reader
+            return items
+
+        self.assertEqual(self.loop.run_until_complete(run()), [1, 2, 3])
+        self.assertEqual(queue.qsize(), 0)
+        self.assertEqual(REGISTRY.get_sample_value('events_queue_blocks', {'channel': CHANNEL}), 0)
+        self.assertGreater(
+            REGISTRY.get_sample_value('events_queue_backpressure_seconds_total', {'channel': CHANNEL}), 0)
+
+    def test_spill(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            queue = DispatchQueue(CHANNEL, 2, spill_dir=spill_dir)
+            self.addCleanup(queue.close)
+
+            for i in range(5):
+                queue.put_nowait((i, [make_event(i, 'tx', {})]))
+            self.assertFalse(queue.full())
+            self.assertEqual((len(queue.items), len(queue.spill)), (2, 3))
+
+            items = [self.loop.run_until_complete(queue.get())[0] for _ in range(3)]
+            queue.put_nowait((5, []))
+            items += [self.loop.run_until_complete(queue.get())[0] for _ in range(3)]
+
+        self.assertEqual(items, list(range(6)))
+        self.assertEqual(queue.qsize(), 0)
@@ -0,0 +1,112 @@
+import mock
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from hfc.protos.peer import chaincode_pb2
+
+from substrapp.ledger import cache as ledger_cache
+from substrapp.ledger.api import query_ledger, query_ledger_many, get_object_from_ledger, invoke_ledger
+
+from .assets import algo, objective
+
+CHANNEL = 'mychannel'
+
+
+def make_block(*fcns):
+    txs = []
+    for fcn in fcns:
+        spec = chaincode_pb2.ChaincodeInvocationSpec()
+        spec.chaincode_spec.input.args.extend([fcn.encode(), b'{}'])
+        txs.append({'payload': {'data': {'actions': [
+            {'payload': {'chaincode_proposal_payload': {'input': spec.SerializeToString()}}}
+        ]}}})
+    return {'header': {'number': 1}, 'data': {'data': txs}}
+
+
+@override_settings(
+    LEDGER_CACHE_ENABLED=True,
+    LEDGER_CACHE_TTL_SECONDS={},
+    LEDGER_CALL_RETRY=False,
+)
+class LedgerCacheTests(TestCase):
+
+    def setUp(self):
+        caches[ledger_cache.CACHE_ALIAS].clear()
+        patcher = mock.patch('substrapp.ledger.api.call_ledger')
+        self.mcall_ledger = patcher.start()
+        self.mcall_ledger.return_value = []
+        self.addCleanup(patcher.stop)
+
+    def test_query_is_cached(self):
+        self.mcall_ledger.return_value = algo
+
+        self.assertEqual(query_ledger(CHANNEL, fcn='queryAlgos', args=[]), algo)
+        self.assertEqual(query_ledger(CHANNEL, fcn='queryAlgos', args=[]), algo)
+        self.assertEqual(self.mcall_ledger.call_count, 1)
+
+        # other arguments, other channel or cache bypass
+        get_object_from_ledger(CHANNEL, algo[0]['key'], 'queryAlgo')
+        query_ledger('otherchannel', fcn='queryAlgos', args=[])
+        query_ledger(CHANNEL, fcn='queryAlgos', args=[], use_cache=False)
+        self.assertEqual(self.mcall_ledger.call_count, 4)
+
+    def test_query_not_cached(self):
+        query_ledger(CHANNEL, fcn='queryFilter', args={'indexName': 'traintuple~worker~status'})
+        query_ledger(CHANNEL, fcn='queryFilter', args={'indexName': 'traintuple~worker~status'})
+        self.assertEqual(self.mcall_ledger.call_count, 2)
+
+        with override_settings(LEDGER_CACHE_ENABLED=False):
+            query_ledger(CHANNEL, fcn='queryAlgos', args=[])
+            query_ledger(CHANNEL, fcn='queryAlgos', args=[])
+        self.assertEqual(self.mcall_ledger.call_count, 4)
+
+    def test_invoke_invalidates_asset_kinds(self):
+        self.mcall_ledger.return_value = {'key': 'key'}
+        query_ledger(CHANNEL, fcn='queryAlgos', args=[])
+        query_ledger(CHANNEL, fcn='queryObjectives', args=[])
+
+        invoke_ledger(CHANNEL, fcn='registerAlgo', args={})
+
+        query_ledger(CHANNEL, fcn='queryAlgos', args=[])
+        query_ledger(CHANNEL, fcn='queryObjectives', args=[])
+        fcns = [c[1]['fcn'] for c in self.mcall_ledger.call_args_list]
+        self.assertEqual(fcns, ['queryAlgos', 'queryObjectives', 'registerAlgo', 'queryAlgos'])
+
+    def test_block_invalidates_asset_kinds(self):
+        query_ledger(CHANNEL, fcn='queryObjectives', args=[])
+        query_ledger(CHANNEL, fcn='queryTraintuples', args=[])
+
+        ledger_cache.invalidate_block(CHANNEL, make_block('logStartTrain'))
+
+        query_ledger(CHANNEL, fcn='queryObjectives', args=[])
+        query_ledger(CHANNEL, fcn='queryTraintuples', args=[])
+        fcns = [c[1]['fcn'] for c in self.mcall_ledger.call_args_list]
+        self.assertEqual(fcns, ['queryObjectives', 'queryTraintuples', 'queryTraintuples'])
+
+        # unknown functions invalidate everything
+        ledger_cache.invalidate_block(CHANNEL, make_block('someNewFunction'))
+        query_ledger(CHANNEL, fcn='queryObjectives', args=[])
+        self.assertEqual(self.mcall_ledger.call_count, 4)
+
+    def test_ttl(self):
+        with override_settings(LEDGER_CACHE_TTL_SECONDS={'queryAlgos': 0}):
+            query_ledger(CHANNEL, fcn='queryAlgos', args=[])
+            query_ledger(CHANNEL, fcn='queryAlgos', args=[])
+        self.assertEqual(self.mcall_ledger.call_count, 2)
+
+    def test_query_ledger_many(self):
+        self.mcall_ledger.return_value = objective
+        query_ledger(CHANNEL, fcn='queryObjectives', args=[])
+
+        with mock.patch('substrapp.ledger.api.get_connection') as mget_connection:
+            mget_connection.return_value.run.side_effect = lambda coro: coro.close() or [algo]
+            results = query_ledger_many(CHANNEL, [('queryObjectives', []), ('queryAlgos', [])])
+
+        self.assertEqual(results, [objective, algo])
+        self.assertEqual(query_ledger(CHANNEL, fcn='queryAlgos', args=[]), algo)
+        self.assertEqual(self.mcall_ledger.call_count, 1)
+
+        with mock.patch('substrapp.ledger.api.get_connection') as mget_connection:
+            mget_connection.return_value.run.side_effect = lambda coro: coro.close() or [objective, algo]
+            query_ledger_many(CHANNEL, [('queryObjectives', []), ('queryAlgos', [])], use_cache=False)
+        mget_connection.return_value.run.assert_called_once()
@@ -0,0 +1,178 @@
+import asyncio
+
+from django.test import TestCase, override_settings
+from mock import MagicMock, patch
+
+from substrapp.ledger.commit_tracker import CommitTracker, invoke_and_wait
+
+CHANNEL = 'mychannel'
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def filtered_block(number, *transactions):
+    return {
+        'number': number,
+        'filtered_transactions': [
+            {'txid': tx_id, 'tx_validation_code': code} for tx_id, code in transactions
+        ],
+    }
+
+
+class FakeEventHub(object):
+    """Deliver `blocks` to the block listeners, then keep the stream open."""
+
+    instances = []
+    blocks = []
+
+    def __init__(self, peer, channel_name, requestor):
+        self.listeners = []
+        self.start = None
+        FakeEventHub.instances.append(self)
+
+    def registerBlockEvent(self, unregister, onEvent):
+        self.listeners.append(onEvent)
+
+    async def connect(self, filtered, start):
+        self.start = start
+        while FakeEventHub.blocks:
+            block = FakeEventHub.blocks.pop(0)
+            await asyncio.sleep(0.01)
+            for listener in self.listeners:
+                listener(block)
+        await asyncio.sleep(3600)
+
+    def disconnect(self):
+        pass
+
+
+sent_transactions = []
+
+
+async def send_transaction(orderers, tran_req, tx_context):
+    sent_transactions.append(tx_context)
+    yield MagicMock(status=200)
+
+
+@override_settings(LEDGER_PEER_NAME='peer')
+@patch('substrapp.ledger.commit_tracker.ChannelEventHub', FakeEventHub)
+class CommitTrackerTests(TestCase):
+
+    def setUp(self):
+        FakeEventHub.instances = []
+        FakeEventHub.blocks = []
+
+    def test_one_stream_for_all_transactions(self):
+        FakeEventHub.blocks = [
+            filtered_block(1, ('tx1', 'VALID')),
+            filtered_block(2, ('other', 'VALID'), ('tx2', 'MVCC_READ_CONFLICT')),
+        ]
+
+        async def wait():
+            tracker = CommitTracker(MagicMock(), MagicMock(), CHANNEL)
+            futures = [tracker.register('tx1'), tracker.register('tx2')]
+            try:
+                return await asyncio.gather(*futures), tracker
+            finally:
+                tracker.stop()
+
+        statuses, tracker = run(wait())
+        self.assertEqual(statuses, ['VALID', 'MVCC_READ_CONFLICT'])
+        self.assertEqual(len(FakeEventHub.instances), 1)
+        self.assertEqual(tracker.last_block, 2)
+        self.assertEqual(tracker.pending, {})
+
+    def test_reconnect_after_last_block(self):
+        class FailingEventHub(FakeEventHub):
+            async def connect(self, filtered, start):
+                self.start = start
+                if len(FakeEventHub.instances) == 1:
+                    for listener in self.listeners:
+                        listener(filtered_block(5))
+                    raise Exception('stream closed')
+                return await super().connect(filtered, start)
+
+        FakeEventHub.blocks = [filtered_block(6, ('tx1', 'VALID'))]
+
+        async def wait():
+            tracker = CommitTracker(MagicMock(), MagicMock(), CHANNEL)
+            try:
+                return await tracker.register('tx1')
+            finally:
+                tracker.stop()
+
+        with patch('substrapp.ledger.commit_tracker.ChannelEventHub', FailingEventHub), \
+                patch('substrapp.ledger.commit_tracker.RECONNECT_DELAY_SECONDS', 0):
+            self.assertEqual(run(wait()), 'VALID')
+
+        self.assertEqual([hub.start for hub in FakeEventHub.instances], ['newest', 6])
+
+
+@override_settings(LEDGER_PEER_NAME='peer')
+@patch('substrapp.ledger.commit_tracker.ChannelEventHub', FakeEventHub)
+@patch('substrapp.ledger.commit_tracker.utils.send_transaction', send_transaction)
+@patch('substrapp.ledger.commit_tracker.utils.build_tx_req')
+@patch('substrapp.ledger.commit_tracker.create_tx_prop_req')
+@patch('substrapp.ledger.commit_tracker.create_tx_context', return_value=MagicMock(tx_id='tx1'))
+@patch('substrapp.ledger.commit_tracker.decode_proposal_response_payload',
+       return_value={'extension': {'response': {'payload': b'{"key": "a"}'}}})
+class InvokeAndWaitTests(TestCase):
+
+    def setUp(self):
+        FakeEventHub.instances = []
+        FakeEventHub.blocks = []
+        sent_transactions.clear()
+
+    def invoke(self, proposal_response, timeout=1):
+        async def respond():
+            return proposal_response
+
+        client = MagicMock()
+        client.get_channel.return_value.send_tx_proposal.return_value = ([respond()], None, None)
+
+        async def invoke():
+            tracker = CommitTracker(client, MagicMock(), CHANNEL)
+            try:
+                return await invoke_and_wait(
+                    tracker, client, requestor=MagicMock(), channel_name=CHANNEL, peers=['peer'], args=[],
+                    cc_name='mycc', fcn='registerAlgo', wait_for_event_timeout=timeout, wait_for_event=True)
+            finally:
+                tracker.stop()
+
+        return run(invoke())
+
+    def test_committed(self, *_):
+        # the newest block is delivered first, when the stream is established
+        FakeEventHub.blocks = [filtered_block(0), filtered_block(1, ('tx1', 'VALID'))]
+        response = self.invoke(MagicMock(response=MagicMock(status=200)))
+        self.assertEqual(response, '{"key": "a"}')
+        self.assertEqual(FakeEventHub.instances[0].start, 'newest')
+
+    def test_invalid(self, *_):
+        FakeEventHub.blocks = [filtered_block(0), filtered_block(1, ('tx1', 'MVCC_READ_CONFLICT'))]
+        with self.assertRaises(Exception) as cm:
+            self.invoke(MagicMock(response=MagicMock(status=200)))
+        self.assertIn('MVCC_READ_CONFLICT', cm.exception.args[0])
+
+    def test_timeout(self, *_):
+        FakeEventHub.blocks = [filtered_block(0)]
+        with self.assertRaises(TimeoutError):
+            self.invoke(MagicMock(response=MagicMock(status=200)), timeout=0.1)
+        self.assertEqual(len(sent_transactions), 1)
+
+    def test_stream_not_established(self, *_):
+        # not sent: it could be committed before the stream starts
+        with self.assertRaisesRegex(TimeoutError, 'not established'):
+            self.invoke(MagicMock(response=MagicMock(status=200)), timeout=0.05)
+        self.assertEqual(sent_transactions, [])
+
+    def test_proposal_error(self, *_):
+        response = self.invoke(MagicMock(response=MagicMock(status=500, message='{"status": 409}')))
+        self.assertEqual(response, '{"status": 409}')
+        self.assertEqual(FakeEventHub.instances, [])
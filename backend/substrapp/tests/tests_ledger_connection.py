@@ -0,0 +1,237 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import mock
+from django.test import TestCase, override_settings
+
+from substrapp.ledger import connection as ledger_connection
+from substrapp.ledger.api import get_objects_from_ledger, query_ledger_many
+from substrapp.ledger.connection import (get_connection, get_current_connection, invalidate_connection,
+                                         invalidate_discovery, close_connections)
+
+CHANNEL = 'mychannel'
+
+
+class FakeClient:
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.closed = False
+
+    async def close_grpc_channels(self):
+        self.closed = True
+
+
+async def fake_create_client(channel_name, user, discover=True):
+    return FakeClient()
+
+
+async def fake_update_discovery(client, user, channel_name, previous_signature=None, retired=None):
+    return 'topology'
+
+
+@override_settings(
+    LEDGER_CONNECTION_HEALTH_CHECK_INTERVAL_SECONDS=3600,
+    LEDGER_CONNECTION_HEALTH_CHECK_TIMEOUT_SECONDS=1,
+    LEDGER_DISCOVERY_TTL_SECONDS=3600,
+)
+class LedgerConnectionTests(TestCase):
+
+    def setUp(self):
+        patchers = [
+            mock.patch('substrapp.ledger.connection.get_user', return_value=mock.MagicMock()),
+            mock.patch('substrapp.ledger.connection._create_client', side_effect=fake_create_client),
+            mock.patch('substrapp.ledger.connection._check_peer_channel', side_effect=self._check),
+            mock.patch('substrapp.ledger.connection._update_discovery', side_effect=self._discover),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(close_connections)
+        self.check_error = None
+        self.discovery_error = None
+        self.topology = 'topology-1'
+        self.discovery_delay = 0
+        self.retired = []
+
+    async def _check(self, client, user, channel_name):
+        if self.check_error:
+            raise self.check_error
+
+    async def _discover(self, client, user, channel_name, previous_signature=None, retired=None):
+        if self.discovery_error:
+            raise self.discovery_error
+        if self.discovery_delay:
+            await asyncio.sleep(self.discovery_delay)
+        retired.extend(self.retired)
+        return self.topology
+
+    def test_connection_is_reused(self):
+        connection = get_connection(CHANNEL)
+        self.assertIs(get_connection(CHANNEL), connection)
+        self.assertEqual(ledger_connection._create_client.call_count, 1)
+
+    def test_run_on_connection_loop(self):
+        connection = get_connection(CHANNEL)
+
+        async def current_thread():
+            return threading.current_thread()
+
+        self.assertIs(connection.run(current_thread()), connection.client.thread)
+        self.assertIsNot(connection.client.thread, threading.current_thread())
+
+    def test_broken_connection_is_recreated(self):
+        connection = get_connection(CHANNEL)
+        invalidate_connection(CHANNEL)
+
+        new_connection = get_connection(CHANNEL)
+        self.assertIsNot(new_connection, connection)
+        self.assertTrue(connection.client.closed)
+
+    def test_failed_health_check_recreates_connection(self):
+        connection = get_connection(CHANNEL)
+        connection.last_checked_at = 0
+        self.check_error = Exception('failed to connect to all addresses')
+
+        new_connection = get_connection(CHANNEL)
+        self.assertIsNot(new_connection, connection)
+
+    def test_connection_from_parent_process_is_not_reused(self):
+        connection = get_connection(CHANNEL)
+        connection.pid = -1
+
+        new_connection = get_connection(CHANNEL)
+        self.assertIsNot(new_connection, connection)
+        # The parent connection belongs to another process: it must not be closed from here.
+        self.assertFalse(connection.client.closed)
+        connection.pid = new_connection.pid
+        connection.close()
+
+    def test_discovery_is_cached(self):
+        connection = get_connection(CHANNEL)
+        get_connection(CHANNEL)
+        get_connection(CHANNEL)
+
+        self.assertEqual(ledger_connection._update_discovery.call_count, 1)
+        self.assertEqual(connection.discovery_stats['refreshes'], 1)
+
+    def test_discovery_ttl(self):
+        connection = get_connection(CHANNEL)
+        connection.discovered_at = 0
+        self.topology = 'topology-2'
+
+        self.assertIs(get_connection(CHANNEL), connection)
+        self.assertEqual(ledger_connection._update_discovery.call_count, 2)
+        self.assertEqual(connection.discovery_signature, 'topology-2')
+        self.assertEqual(connection.discovery_stats['changes'], 2)
+
+    def test_discovery_forced_refresh(self):
+        connection = get_connection(CHANNEL)
+        invalidate_discovery(CHANNEL)
+
+        self.assertIs(get_connection(CHANNEL), connection)
+        self.assertEqual(ledger_connection._update_discovery.call_count, 2)
+        self.assertFalse(connection.discovery_expired)
+        # unchanged topology
+        self.assertEqual(connection.discovery_stats['changes'], 1)
+
+    @override_settings(LEDGER_DISCOVERY_TIMEOUT_SECONDS=0.1)
+    def test_discovery_timeout(self):
+        connection = get_connection(CHANNEL)
+        self.discovery_delay = 1
+
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            connection.refresh_discovery()
+        self.assertTrue(connection.broken)
+
+    def test_retired_nodes_closed_later(self):
+        closed = []
+
+        async def close():
+            closed.append(None)
+
+        node = mock.Mock()
+        node._channel.close = close
+        self.retired = [node]
+        connection = get_connection(CHANNEL)
+        self.retired = []
+
+        # in-flight calls may still use it
+        connection.refresh_discovery()
+        self.assertEqual(closed, [])
+
+        connection.retired_nodes = [(0, node)]
+        connection.refresh_discovery()
+        self.assertEqual(closed, [None])
+        self.assertEqual(connection.retired_nodes, [])
+
+    def test_failed_discovery_recreates_connection(self):
+        connection = get_connection(CHANNEL)
+        invalidate_discovery(CHANNEL)
+        self.discovery_error = Exception('failed to connect to all addresses')
+
+        with self.assertRaises(Exception):
+            get_connection(CHANNEL)
+        self.assertTrue(connection.broken)
+
+        self.discovery_error = None
+        self.assertIsNot(get_connection(CHANNEL), connection)
+
+
+@override_settings(
+    LEDGER_CONNECTION_HEALTH_CHECK_INTERVAL_SECONDS=3600,
+    LEDGER_CONNECTION_HEALTH_CHECK_TIMEOUT_SECONDS=1,
+    LEDGER_DISCOVERY_TTL_SECONDS=3600,
+    LEDGER_MAX_CONCURRENT_QUERIES=10,
+    LEDGER_CALL_RETRY=False,
+)
+class LedgerAsyncQueryTests(TestCase):
+
+    def setUp(self):
+        patchers = [
+            mock.patch('substrapp.ledger.connection.get_user', return_value=mock.MagicMock()),
+            mock.patch('substrapp.ledger.connection._create_client', side_effect=fake_create_client),
+            mock.patch('substrapp.ledger.connection._update_discovery', side_effect=fake_update_discovery),
+            mock.patch('substrapp.ledger.api._call_ledger_async', side_effect=self._call_ledger),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(close_connections)
+        self.running = 0
+        self.max_running = 0
+
+    async def _call_ledger(self, channel_name, call_type, fcn, args=None, kwargs=None):
+        get_current_connection(channel_name)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.1)
+        finally:
+            self.running -= 1
+        return {'fcn': fcn, 'args': args}
+
+    def test_query_ledger_many(self):
+        start = time.time()
+        results = query_ledger_many(CHANNEL, [('queryAlgos', []), ('queryModels', []), ('queryObjectives', [])])
+        elapsed = time.time() - start
+
+        self.assertEqual([r['fcn'] for r in results], ['queryAlgos', 'queryModels', 'queryObjectives'])
+        self.assertEqual(self.max_running, 3)
+        self.assertLess(elapsed, 0.25)
+
+    def test_get_objects_from_ledger_max_concurrency(self):
+        keys = [f'key{i}' for i in range(6)]
+        results = get_objects_from_ledger(CHANNEL, keys, 'queryTraintuple', max_concurrency=2)
+
+        self.assertEqual([r['args'] for r in results], [{'key': key} for key in keys])
+        self.assertEqual(self.max_running, 2)
+
+    def test_query_ledger_many_no_query(self):
+        self.assertEqual(query_ledger_many(CHANNEL, []), [])
+        self.assertNotIn(CHANNEL, ledger_connection.connections)
+
+    def test_current_connection_outside_loop(self):
+        with self.assertRaises(RuntimeError):
+            get_current_connection(CHANNEL)
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from mock import patch
+
+from hfc.protos.peer import chaincode_pb2
+
+from substrapp.ledger.debug_tools import analyze_conflicts, dump_all_transactions, get_mvcc_transactions, scan_blocks
+from substrapp.ledger.fake import FakeLedgerConnection
+
+CHANNEL = 'mychannel'
+VALID = 0
+MVCC_READ_CONFLICT = 11
+
+
+def make_block(number):
+    txs = [
+        {'payload': {
+            'header': {'channel_header': {'tx_id': f'tx-{number}-{index}'}},
+            'data': {'actions': [{'payload': {'chaincode_proposal_payload': {'input': 'logStartTrain'}}}]},
+        }}
+        for index in range(2)
+    ]
+    codes = [VALID, MVCC_READ_CONFLICT if number % 3 == 0 else VALID]
+    return {'header': {'number': number}, 'data': {'data': txs}, 'metadata': {'metadata': [[], 0, codes]}}
+
+
+def make_rwset_tx(fcn, reads=(), writes=()):
+    invocation_spec = chaincode_pb2.ChaincodeInvocationSpec()
+    invocation_spec.chaincode_spec.input.args.extend([fcn.encode()])
+    rwset = {
+        'reads': [
+            {'key': key, 'version': {'block_num': str(version[0]), 'tx_num': str(version[1])}}
+            for key, version in reads
+        ],
+        'writes': [{'key': key} for key in writes],
+        'range_queries_info': [],
+    }
+    return {'payload': {
+        'header': {'channel_header': {'tx_id': fcn}},
+        'data': {'actions': [{'payload': {
+            'chaincode_proposal_payload': {'input': invocation_spec.SerializeToString()},
+            'action': {'proposal_response_payload': {'extension': {'results': {'ns_rwset': [
+                {'namespace': 'lscc', 'rwset': {'reads': [{'key': 'mycc', 'version': None}], 'writes': [],
+                                                'range_queries_info': []}},
+                {'namespace': 'mycc', 'rwset': rwset},
+            ]}}}},
+        }}]},
+    }}
+
+
+# block number -> [(transaction, validation code)]
+CONFLICT_BLOCKS = {
+    0: [(make_rwset_tx('logStartTrain', reads=[('t1', (0, 0))], writes=['t1']), VALID)],
+    1: [
+        (make_rwset_tx('logSuccessTrain', reads=[('t1', (0, 0))], writes=['t1']), VALID),
+        # read t1 before the write of the first transaction of the block
+        (make_rwset_tx('logSuccessTrain', reads=[('t1', (0, 0)), ('cp', (0, 0))], writes=['t1']),
+         MVCC_READ_CONFLICT),
+    ],
+    2: [(make_rwset_tx('updateComputePlan', reads=[('t1', (1, 0)), ('cp', (0, 0))], writes=['cp']), VALID)],
+    30: [(make_rwset_tx('logFailTrain', reads=[('t1', (0, 0))], writes=['t1']), MVCC_READ_CONFLICT)],
+}
+
+
+class FakeBlockClient(object):
+
+    def __init__(self, blocks=None):
+        self.blocks = blocks
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.queried = []
+
+    async def query_block(self, requestor, channel_name, peers, block_number, decode=True):
+        self.queried.append(int(block_number))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # later blocks answer first
+        await asyncio.sleep(0.01 / (int(block_number) + 1))
+        self.in_flight -= 1
+        if self.blocks is not None:
+            txs = self.blocks.get(int(block_number), [])
+            return {'header': {'number': int(block_number)}, 'data': {'data': [tx for tx, _ in txs]},
+                    'metadata': {'metadata': [[], 0, [code for _, code in txs]]}}
+        return make_block(int(block_number))
+
+    async def close_grpc_channels(self):
+        pass
+
+
+@override_settings(LEDGER_PEER_NAME='peer', LEDGER_MAX_CONCURRENT_QUERIES=4,
+                   LEDGER_CONNECTION_HEALTH_CHECK_TIMEOUT_SECONDS=1)
+class BlockScannerTests(TestCase):
+
+    def setUp(self):
+        self.client = FakeBlockClient()
+        self.connection = FakeLedgerConnection(CHANNEL, self.client)
+        self.connection.connect()
+        self.addCleanup(self.connection.close)
+
+        patcher = patch('substrapp.ledger.debug_tools.get_connection', return_value=self.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.out_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out_folder)
+
+    def test_scan_blocks(self):
+        blocks = list(scan_blocks(CHANNEL, 0, 19))
+        self.assertEqual([number for number, _ in blocks], list(range(20)))
+        self.assertEqual(self.client.max_in_flight, 4)
+
+    def test_get_mvcc_transactions(self):
+        txs = get_mvcc_transactions(CHANNEL, 0, 6)
+        self.assertEqual([tx['tx_id'] for tx in txs], ['tx-0-1', 'tx-3-1', 'tx-6-1'])
+
+    def test_dump_ndjson_and_resume(self):
+        dump_all_transactions(CHANNEL, 0, 4, self.out_folder, output_format='ndjson')
+        self.client.queried = []
+        dump_all_transactions(CHANNEL, 0, 9, self.out_folder, output_format='ndjson', resume=True)
+        self.assertEqual(self.client.queried, list(range(5, 10)))
+
+        with open(os.path.join(self.out_folder, 'transactions.ndjson')) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([(r['block_number'], r['tx_index']) for r in records],
+                         [(number, index) for number in range(10) for index in range(2)])
+
+    def test_dump_json(self):
+        dump_all_transactions(CHANNEL, 0, 1, self.out_folder)
+        self.assertEqual(sorted(os.listdir(self.out_folder)),
+                         ['.checkpoint', '0000,0.json', '0000,1.json', '0001,0.json', '0001,1.json'])
+
+    def test_analyze_conflicts(self):
+        self.client.blocks = CONFLICT_BLOCKS
+        report = analyze_conflicts(CHANNEL, 0, 30)
+
+        self.assertEqual(report['validation_codes'], {'VALID': 3, 'MVCC_READ_CONFLICT': 2})
+        self.assertEqual(report['keys'], [{
+            'namespace': 'mycc',
+            'key': 't1',
+            'conflicts': 2,
+            'functions': {'logSuccessTrain': 1, 'logFailTrain': 1},
+            'windows': [{'start_block': 1, 'end_block': 1, 'conflicts': 1},
+                        {'start_block': 30, 'end_block': 30, 'conflicts': 1}],
+        }])
+        self.assertEqual(report['functions'][0]['call_site'], 'log_success_tuple')
+        self.assertEqual(report['functions'][0]['conflict_rate'], 0.5)
+        self.assertEqual(report['call_sites'], [{'call_site': 'log_success_tuple', 'conflicts': 1},
+                                                {'call_site': 'log_fail_tuple', 'conflicts': 1}])
@@ -0,0 +1,105 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from io import StringIO
+
+from substrapp.ledger.api import get_object_from_ledger, invoke_ledger, iter_tuples, log_start_tuple, query_ledger
+from substrapp.ledger.exceptions import LedgerAssetNotFound, LedgerConflict, LedgerMVCCError, LedgerStatusError
+from substrapp.ledger.fake import ORG, FakeChaincode, generate_chaincode, use_fake_ledger
+
+CHANNEL = 'mychannel'
+
+LEDGER_SETTINGS = {
+    'LEDGER_CHANNELS': {CHANNEL: {'chaincode': {'name': 'mycc'}}},
+    'LEDGER_PEER_NAME': 'peer',
+    'LEDGER_INVOKE_STRATEGY': 'SELF',
+    'LEDGER_QUERY_STRATEGY': 'SELF',
+    'LEDGER_CALL_RETRY': False,
+    'LEDGER_WAIT_FOR_EVENT_TIMEOUT_SECONDS': 5,
+    'LEDGER_COMMIT_TRACKER_ENABLED': True,
+    'LEDGER_CIRCUIT_BREAKER_FAILURE_THRESHOLD': 5,
+    'LEDGER_CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS': 30,
+    'LEDGER_CONNECTION_HEALTH_CHECK_TIMEOUT_SECONDS': 1,
+    'LEDGER_MAX_CONCURRENT_QUERIES': 10,
+}
+
+
+@override_settings(**LEDGER_SETTINGS)
+class FakeLedgerTests(TestCase):
+
+    def test_queries(self):
+        chaincode = generate_chaincode(traintuples=25, testtuples=0, page_size=10, todo_ratio=0.4)
+        key = next(iter(chaincode.keys_by_kind['traintuple']))
+
+        with use_fake_ledger({CHANNEL: chaincode}):
+            # bookmarks are followed
+            self.assertEqual(len(query_ledger(CHANNEL, 'queryTraintuples', use_cache=False)), 25)
+            self.assertEqual(len(list(iter_tuples(CHANNEL, 'traintuple', ORG))), 10)
+
+            traintuple = get_object_from_ledger(CHANNEL, key, 'queryTraintuple', use_cache=False)
+            self.assertEqual(traintuple['key'], key)
+
+            details = get_object_from_ledger(CHANNEL, key, 'queryModelDetails', use_cache=False)
+            self.assertEqual(details['traintuple']['key'], key)
+
+            with self.assertRaises(LedgerAssetNotFound):
+                get_object_from_ledger(CHANNEL, 'unknown', 'queryTraintuple', use_cache=False)
+
+    def test_invokes(self):
+        chaincode = FakeChaincode()
+
+        with use_fake_ledger({CHANNEL: chaincode}):
+            invoke_ledger(CHANNEL, fcn='registerAlgo', args={'key': 'algo', 'name': 'algo'}, sync=True)
+            with self.assertRaises(LedgerConflict):
+                invoke_ledger(CHANNEL, fcn='registerAlgo', args={'key': 'algo', 'name': 'algo'}, sync=True)
+
+            compute_plan = invoke_ledger(CHANNEL, fcn='createComputePlan', sync=True, only_key=False, args={
+                'key': 'cp',
+                'traintuples': [{'key': 'train', 'algo_key': 'algo', 'data_manager_key': 'dm',
+                                 'data_sample_keys': ['ds'], 'id': 'train-id'}],
+            })
+            self.assertEqual(compute_plan['traintuple_keys'], ['train'])
+            self.assertEqual(compute_plan['id_to_key'], {'train-id': 'train'})
+            self.assertEqual(len(list(iter_tuples(CHANNEL, 'traintuple', ORG))), 1)
+
+            log_start_tuple(CHANNEL, 'traintuple', 'train')
+            self.assertEqual(get_object_from_ledger(CHANNEL, 'train', 'queryTraintuple')['status'], 'doing')
+            with self.assertRaises(LedgerStatusError):
+                log_start_tuple(CHANNEL, 'traintuple', 'train')
+
+    def test_mvcc_read_conflict(self):
+        chaincode = FakeChaincode()
+        chaincode.add('traintuple', {'key': 'train', 'status': 'todo'})
+
+        first, first_tx = chaincode.execute('logStartTrain', {'key': 'train'})
+        second, second_tx = chaincode.execute('logStartTrain', {'key': 'train'})
+        self.assertEqual(chaincode.commit(first_tx), 'VALID')
+        self.assertEqual(chaincode.commit(second_tx), 'MVCC_READ_CONFLICT')
+        self.assertEqual(chaincode.assets['train'][1]['status'], 'doing')
+
+        chaincode.add('traintuple', {'key': 'train', 'status': 'todo'})
+        with use_fake_ledger({CHANNEL: chaincode}):
+            with self.assertRaises(LedgerMVCCError):
+                _commit_during_invoke(chaincode)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_ledger', traintuples=20, requests=10, threads=2, latency_ms=0, commit_delay_ms=0,
+                     page_size=5, stdout=out)
+        self.assertIn('logStartTrain', out.getvalue())
+        self.assertNotIn('nan', out.getvalue())
+
+
+def _commit_during_invoke(chaincode):
+    """Invoke logStartTrain while another transaction writes the same key."""
+    execute = chaincode.execute
+
+    def execute_and_write(fcn, args):
+        response, tx = execute(fcn, args)
+        chaincode.add('traintuple', {'key': 'train', 'status': 'todo'})
+        return response, tx
+
+    chaincode.execute = execute_and_write
+    try:
+        log_start_tuple(CHANNEL, 'traintuple', 'train')
+    finally:
+        chaincode.execute = execute
@@ -0,0 +1,106 @@
+import itertools
+
+import mock
+from django.core.cache import caches
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+
+from substrapp.ledger import locks as ledger_locks
+from substrapp.ledger.api import invoke_ledger, log_start_tuple
+
+CHANNEL = 'mychannel'
+
+
+@override_settings(
+    LEDGER_INVOKE_LOCK_ENABLED=True,
+    LEDGER_INVOKE_LOCK_TIMEOUT_SECONDS=1,
+    LEDGER_CALL_RETRY=False,
+    LEDGER_WAIT_FOR_EVENT_TIMEOUT_SECONDS=5,
+)
+class InvokeLockTests(TestCase):
+
+    def setUp(self):
+        caches['ledger'].clear()
+
+    def test_get_lock_keys(self):
+        self.assertEqual(ledger_locks.get_lock_keys('updateComputePlan', {'key': 'cp'}), ['cp'])
+        self.assertEqual(
+            ledger_locks.get_lock_keys('updateDataSample', {'keys': ['ds'], 'data_manager_keys': ['dm1', 'dm2']}),
+            ['dm1', 'dm2'])
+        self.assertEqual(ledger_locks.get_lock_keys('registerAlgo', {'key': 'algo'}), [])
+        self.assertEqual(ledger_locks.get_lock_keys('updateDataManager', {}), [])
+
+    def test_invoke_lock(self):
+        with ledger_locks.invoke_lock(CHANNEL, 'updateComputePlan', ['cp']):
+            # held by another invoke: sent anyway after the timeout
+            with mock.patch('substrapp.ledger.locks.time.sleep') as msleep, \
+                    mock.patch('substrapp.ledger.locks.time.monotonic', side_effect=itertools.count(0, 0.1)):
+                with ledger_locks.invoke_lock(CHANNEL, 'updateComputePlan', ['cp', 'other']) as acquired:
+                    self.assertIsNone(acquired)
+            self.assertIsNone(caches['ledger'].get(f'ledger:{CHANNEL}:lock:other'))
+            # exponential backoff
+            delays = [c[0][0] for c in msleep.call_args_list]
+            self.assertEqual(delays[:4], [0.05, 0.1, 0.2, 0.4])
+
+            # other keys and channels are independent
+            with ledger_locks.invoke_lock(CHANNEL, 'updateComputePlan', ['other']):
+                pass
+            with ledger_locks.invoke_lock('otherchannel', 'updateComputePlan', ['cp']):
+                pass
+
+        with ledger_locks.invoke_lock(CHANNEL, 'updateComputePlan', ['cp']):
+            pass
+        self.assertIsNone(caches['ledger'].get(f'ledger:{CHANNEL}:lock:cp'))
+
+    def test_invoke_lock_released_on_error(self):
+        with self.assertRaises(ValueError):
+            with ledger_locks.invoke_lock(CHANNEL, 'updateComputePlan', ['cp']):
+                raise ValueError()
+        self.assertIsNone(caches['ledger'].get(f'ledger:{CHANNEL}:lock:cp'))
+
+    def test_advisory_lock(self):
+        with mock.patch('substrapp.ledger.locks.connection') as mconnection, \
+                mock.patch('substrapp.ledger.locks.time.monotonic', return_value=0):
+            mconnection.vendor = 'postgresql'
+            cursor = mconnection.cursor.return_value.__enter__.return_value
+
+            with ledger_locks.invoke_lock(CHANNEL, 'updateComputePlan', ['cp']):
+                lock_id = ledger_locks.AdvisoryLock(CHANNEL, 'cp').lock_id
+                # waited for by the database
+                self.assertEqual(cursor.execute.call_args_list, [
+                    mock.call("SELECT set_config('lock_timeout', %s, false)", ['1000ms']),
+                    mock.call('SELECT pg_advisory_lock(%s)', [lock_id]),
+                    mock.call('RESET lock_timeout'),
+                ])
+
+            cursor.execute.assert_called_with('SELECT pg_advisory_unlock(%s)', [lock_id])
+            self.assertNotEqual(lock_id, ledger_locks.AdvisoryLock('otherchannel', 'cp').lock_id)
+
+            # lock_timeout expired: sent without the lock, which is not released
+            cursor.execute.reset_mock()
+            cursor.execute.side_effect = lambda sql, *args: self.fail_lock(sql)
+            with ledger_locks.invoke_lock(CHANNEL, 'updateComputePlan', ['cp']):
+                pass
+            self.assertEqual(cursor.execute.call_args_list[-1], mock.call('RESET lock_timeout'))
+            self.assertNotIn(mock.call('SELECT pg_advisory_unlock(%s)', [lock_id]), cursor.execute.call_args_list)
+
+    @staticmethod
+    def fail_lock(sql):
+        if sql.startswith('SELECT pg_advisory_lock'):
+            raise OperationalError('canceling statement due to lock timeout')
+
+    def test_invokes_hold_locks(self):
+        with mock.patch('substrapp.ledger.api.call_ledger', return_value={'key': 'key'}), \
+                mock.patch('substrapp.ledger.api.ledger_locks.invoke_lock') as minvoke_lock:
+            invoke_ledger(CHANNEL, fcn='updateComputePlan', args={'key': 'cp'}, sync=True)
+            minvoke_lock.assert_called_with(CHANNEL, 'updateComputePlan', ['cp'])
+
+            # not ordered by a lock
+            invoke_ledger(CHANNEL, fcn='updateComputePlan', args={'key': 'cp'}, sync=False)
+            minvoke_lock.assert_called_with(CHANNEL, 'updateComputePlan', [])
+
+            log_start_tuple(CHANNEL, 'traintuple', 'key', compute_plan_key='cp')
+            minvoke_lock.assert_called_with(CHANNEL, 'logStartTrain', ['cp'])
+
+            log_start_tuple(CHANNEL, 'traintuple', 'key')
+            minvoke_lock.assert_called_with(CHANNEL, 'logStartTrain', [None])
@@ -0,0 +1,178 @@
+import datetime
+
+import mock
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from hfc.protos.peer import chaincode_pb2
+
+from substrapp.ledger import indexer, mirror
+from substrapp.ledger.api import invoke_ledger, query_ledger
+from substrapp.ledger.debug_tools import MVCC_READ_CONFLICT, VALID
+from substrapp.ledger.fake import generate_chaincode, use_fake_ledger
+from substrapp.models import LedgerAsset, LedgerIndexState
+from substrapp.views.filters_utils import list_assets
+
+from .tests_ledger_fake import CHANNEL, LEDGER_SETTINGS
+
+
+def make_block(number, *transactions, codes=None):
+    """Return a decoded block of (fcn, written keys) transactions."""
+    txs = []
+    for fcn, keys in transactions:
+        spec = chaincode_pb2.ChaincodeInvocationSpec()
+        spec.chaincode_spec.input.args.extend([fcn.encode(), b'{}'])
+        rwset = {'reads': [], 'range_queries_info': [], 'writes': [{'key': key, 'is_delete': False} for key in keys]}
+        txs.append({'payload': {'data': {'actions': [{'payload': {
+            'chaincode_proposal_payload': {'input': spec.SerializeToString()},
+            'action': {'proposal_response_payload': {'extension': {'results': {'ns_rwset': [
+                {'namespace': 'mycc', 'rwset': rwset},
+            ]}}}},
+        }}]}}})
+    codes = codes or [VALID] * len(txs)
+    return {'header': {'number': number}, 'data': {'data': txs}, 'metadata': {'metadata': [[], [], codes]}}
+
+
+@override_settings(LEDGER_MIRROR_ENABLED=True, **LEDGER_SETTINGS)
+class LedgerMirrorTests(TestCase):
+
+    def setUp(self):
+        self.chaincode = generate_chaincode(traintuples=4, testtuples=0, compute_plans=1)
+        self.traintuple_keys = list(self.chaincode.keys_by_kind['traintuple'])
+
+        patcher = mock.patch('substrapp.ledger.indexer.get_ledger_height', return_value=10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lists_served_once_indexed(self):
+        with use_fake_ledger({CHANNEL: self.chaincode}):
+            self.assertIsNone(mirror.lookup(CHANNEL, 'queryTraintuples', []))
+
+            indexer.apply_block(CHANNEL, make_block(3))
+            self.assertEqual(mirror.get_block_number(CHANNEL), 9)
+            self.assertEqual(LedgerAsset.objects.filter(kind='traintuple').count(), 4)
+            self.assertEqual(LedgerAsset.objects.filter(kind='model').count(), 4)
+            self.assertEqual(LedgerAsset.objects.filter(kind='data_sample').count(), 100)
+
+            with mock.patch('substrapp.ledger.api.call_ledger') as mcall_ledger:
+                traintuples = query_ledger(CHANNEL, fcn='queryTraintuples', args=[])
+                self.assertEqual(sorted(t['key'] for t in traintuples), sorted(self.traintuple_keys))
+                self.assertFalse(mcall_ledger.called)
+
+                # not mirrored, or the latest state is needed
+                query_ledger(CHANNEL, fcn='queryNodes', args=[])
+                query_ledger(CHANNEL, fcn='queryTraintuples', args=[], use_cache=False)
+                self.assertEqual(mcall_ledger.call_count, 2)
+
+            with override_settings(LEDGER_MIRROR_ENABLED=False):
+                self.assertIsNone(mirror.lookup(CHANNEL, 'queryTraintuples', []))
+
+    def test_search(self):
+        with use_fake_ledger({CHANNEL: self.chaincode}):
+            indexer.index_channel(CHANNEL)
+        todo_keys = sorted(k for k in self.traintuple_keys if self.chaincode.assets[k][1]['status'] == 'todo')
+        query_list = mock.Mock(return_value=[])
+
+        data, count = list_assets(CHANNEL, 'traintuple', QueryDict('search=traintuple%3Astatus%3Atodo&limit=1'),
+                                  query_list)
+        self.assertEqual([t['key'] for t in data], todo_keys[:1])
+        self.assertEqual(count, len(todo_keys))
+
+        data, count = list_assets(CHANNEL, 'traintuple', QueryDict('offset=1'), query_list)
+        self.assertEqual([t['key'] for t in data], sorted(self.traintuple_keys)[1:])
+        self.assertEqual(count, len(self.traintuple_keys))
+        query_list.assert_not_called()
+
+        # not indexed
+        list_assets(CHANNEL, 'traintuple', QueryDict('search=traintuple%3Arank%3A0'), query_list)
+        query_list.assert_called_once()
+
+    def test_lookup_behind(self):
+        with use_fake_ledger({CHANNEL: self.chaincode}):
+            indexer.index_channel(CHANNEL)
+        self.assertIsNotNone(mirror.lookup(CHANNEL, 'queryTraintuples', []))
+
+        # blocks not applied yet
+        mirror.set_head(CHANNEL, 20)
+        self.assertIsNone(mirror.lookup(CHANNEL, 'queryTraintuples', []))
+        mirror.set_head(CHANNEL, 19)
+        self.assertIsNotNone(mirror.lookup(CHANNEL, 'queryTraintuples', []))
+
+        # head not reported
+        LedgerIndexState.objects.update(head_checked_at=timezone.now() - datetime.timedelta(seconds=61))
+        self.assertIsNone(mirror.lookup(CHANNEL, 'queryTraintuples', []))
+
+    def test_apply_block(self):
+        todo_key = next(k for k in self.traintuple_keys if self.chaincode.assets[k][1]['status'] == 'todo')
+
+        with use_fake_ledger({CHANNEL: self.chaincode}):
+            indexer.index_channel(CHANNEL)
+
+            invoke_ledger(CHANNEL, fcn='logStartTrain', args={'key': todo_key}, sync=True)
+            invoke_ledger(CHANNEL, fcn='registerAlgo', args={'key': 'new-algo', 'name': 'algo'}, sync=True)
+
+            # blocks already applied are skipped
+            indexer.apply_block(CHANNEL, make_block(9, ('logStartTrain', [todo_key])))
+            self.assertEqual(LedgerAsset.objects.get(kind='traintuple', key=todo_key).asset['status'], 'todo')
+
+            indexer.apply_block(CHANNEL, make_block(
+                10,
+                ('logStartTrain', [todo_key, '\x00traintuple~worker~status\x00']),
+                ('registerAlgo', ['new-algo']),
+                ('registerAlgo', ['invalid-algo']),
+                codes=[VALID, VALID, MVCC_READ_CONFLICT],
+            ))
+
+        self.assertEqual(mirror.get_block_number(CHANNEL), 10)
+        self.assertEqual(LedgerAsset.objects.get(kind='traintuple', key=todo_key).asset['status'], 'doing')
+        self.assertEqual(LedgerAsset.objects.get(key='new-algo').kind, 'algo')
+        # listed again
+        self.assertEqual(LedgerAsset.objects.get(kind='model', key=todo_key).asset['traintuple']['status'], 'doing')
+        self.assertFalse(LedgerAsset.objects.filter(key='invalid-algo').exists())
+
+    def test_apply_block_failure(self):
+        key = self.traintuple_keys[0]
+        with use_fake_ledger({CHANNEL: self.chaincode}):
+            indexer.index_channel(CHANNEL)
+
+            with mock.patch('substrapp.ledger.indexer.query_ledger', side_effect=Exception('unavailable')):
+                with self.assertRaises(Exception):
+                    indexer.apply_block(CHANNEL, make_block(10, ('logStartTrain', [key])))
+
+            # the mirror is kept, the block can be applied again
+            self.assertEqual(mirror.get_block_number(CHANNEL), 9)
+            with mock.patch('substrapp.ledger.indexer.index_channel') as mindex_channel:
+                indexer.apply_block(CHANNEL, make_block(10, ('logStartTrain', [key])))
+                mindex_channel.assert_not_called()
+            self.assertEqual(mirror.get_block_number(CHANNEL), 10)
+
+            # missing block
+            with mock.patch('substrapp.ledger.indexer.index_channel') as mindex_channel:
+                indexer.apply_block(CHANNEL, make_block(12))
+                mindex_channel.assert_called_once_with(CHANNEL)
+
+    def test_written_kinds(self):
+        new_key = 'new-traintuple'
+        with use_fake_ledger({CHANNEL: self.chaincode}):
+            indexer.index_channel(CHANNEL)
+
+            with mock.patch('substrapp.ledger.indexer.query_ledger', return_value={'key': 'k'}) as mquery_ledger:
+                indexer.apply_block(CHANNEL, make_block(
+                    10,
+                    # known key: its kind
+                    ('updateComputePlan', [self.traintuple_keys[0]]),
+                    # new key: the kind created by the function
+                    ('createTraintuple', [new_key]),
+                    ('registerDataSample', ['sample']),
+                ))
+
+        self.assertEqual([c[1]['fcn'] for c in mquery_ledger.call_args_list], ['queryTraintuple', 'queryTraintuple'])
+        self.assertEqual(LedgerAsset.objects.get(key=new_key).kind, 'traintuple')
+
+    def test_created_kinds(self):
+        args = '{"key": "cp", "traintuples": [{"key": "t1"}], "testtuples": [{"key": "t2"}], "aggregatetuples": null}'
+        self.assertEqual(indexer.get_created_kinds('createComputePlan', args),
+                         {'cp': 'compute_plan', 't1': 'traintuple', 't2': 'testtuple'})
+        self.assertEqual(indexer.get_created_kinds('createComputePlan', 'invalid'), {})
+        self.assertEqual(indexer.get_created_kinds('createTraintuple', args), {})
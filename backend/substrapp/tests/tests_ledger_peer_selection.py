@@ -0,0 +1,126 @@
+import asyncio
+
+from django.test import TestCase, override_settings
+from mock import MagicMock, patch
+
+from substrapp.ledger.api import _adaptive_query, get_query_endorsing_peers
+from substrapp.ledger.peer_selection import PeerSelector, get_peer_selector
+
+CHANNEL = 'mychannel'
+
+
+class FakeClient(object):
+    """Answer queries after a per peer delay, or fail with the per peer exception."""
+
+    def __init__(self, delays, errors=None):
+        self.delays = delays
+        self.errors = errors or {}
+        self.called = []
+
+    async def chaincode_query(self, peers, **kwargs):
+        peer = peers[0]
+        self.called.append(peer)
+        await asyncio.sleep(self.delays[peer])
+        if peer in self.errors:
+            raise self.errors[peer]
+        return peer
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@patch('substrapp.ledger.peer_selection.EXPLORATION_RATE', 0)
+class PeerSelectorTests(TestCase):
+
+    def test_rank(self):
+        selector = PeerSelector(CHANNEL)
+        # unknown peers first, the preferred one wins ties
+        self.assertEqual(selector.rank(['a', 'b', 'peer'], preferred='peer'), ['peer', 'a', 'b'])
+
+        selector.record('peer', 0.5)
+        selector.record('a', 0.1)
+        selector.record('b', 0.2)
+        self.assertEqual(selector.rank(['a', 'b', 'peer'], preferred='peer'), ['a', 'b', 'peer'])
+
+        # errors make a fast peer worse than a slower one
+        for _ in range(5):
+            selector.record('a', 0.1, error=True)
+        self.assertEqual(selector.rank(['a', 'b', 'peer'], preferred='peer'), ['b', 'peer', 'a'])
+
+    def test_hedge_delay(self):
+        selector = PeerSelector(CHANNEL)
+        for latency in range(1, 10):
+            selector.record('a', latency)
+        self.assertIsNone(selector.hedge_delay('a', 95))
+
+        for latency in range(10, 101):
+            selector.record('a', latency)
+        self.assertEqual(selector.hedge_delay('a', 95), 96)
+        self.assertEqual(selector.hedge_delay('a', 50), 51)
+
+    @override_settings(LEDGER_QUERY_STRATEGY='ADAPTIVE')
+    def test_query_endorsing_peers(self):
+        with patch.dict('substrapp.ledger.peer_selection._selectors', clear=True):
+            get_peer_selector(CHANNEL).record('a', 1)
+            peers = get_query_endorsing_peers('peer', ['a', 'peer'], channel_name=CHANNEL)
+        self.assertEqual(peers, ['peer', 'a'])
+
+        with self.assertRaises(Exception):
+            get_query_endorsing_peers('peer', ['a', 'peer'])
+
+
+class AdaptiveQueryTests(TestCase):
+
+    def setUp(self):
+        patcher = patch.dict('substrapp.ledger.peer_selection._selectors', clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(LEDGER_QUERY_HEDGING_ENABLED=False)
+    def test_query_best_peer_only(self):
+        client = FakeClient({'a': 0, 'b': 0})
+        self.assertEqual(run(_adaptive_query(client, CHANNEL, {'peers': ['b', 'a']})), 'b')
+        self.assertEqual(client.called, ['b'])
+        self.assertEqual(get_peer_selector(CHANNEL).stats['b'].error_rate, 0)
+
+        client = FakeClient({'b': 0}, errors={'b': Exception('failed to connect')})
+        with self.assertRaises(Exception):
+            run(_adaptive_query(client, CHANNEL, {'peers': ['b', 'a']}))
+        self.assertGreater(get_peer_selector(CHANNEL).stats['b'].error_rate, 0)
+
+    def test_answered_error_is_not_a_peer_error(self):
+        not_found = Exception([MagicMock(response=MagicMock(status=404))])
+        client = FakeClient({'a': 0}, errors={'a': not_found})
+        with self.assertRaises(Exception):
+            run(_adaptive_query(client, CHANNEL, {'peers': ['a']}))
+        self.assertEqual(get_peer_selector(CHANNEL).stats['a'].error_rate, 0)
+
+    @override_settings(LEDGER_QUERY_HEDGING_ENABLED=True, LEDGER_QUERY_HEDGING_PERCENTILE=95)
+    def test_hedging(self):
+        selector = get_peer_selector(CHANNEL)
+        for _ in range(10):
+            selector.record('slow', 0.01)
+
+        client = FakeClient({'slow': 1, 'fast': 0})
+        self.assertEqual(run(_adaptive_query(client, CHANNEL, {'peers': ['slow', 'fast']})), 'fast')
+        self.assertEqual(client.called, ['slow', 'fast'])
+
+        # no hedge when the first peer answers in time
+        client = FakeClient({'slow': 0, 'fast': 0})
+        self.assertEqual(run(_adaptive_query(client, CHANNEL, {'peers': ['slow', 'fast']})), 'slow')
+        self.assertEqual(client.called, ['slow'])
+
+    @override_settings(LEDGER_QUERY_HEDGING_ENABLED=True, LEDGER_QUERY_HEDGING_PERCENTILE=95)
+    def test_hedging_both_fail(self):
+        selector = get_peer_selector(CHANNEL)
+        for _ in range(10):
+            selector.record('a', 0.01)
+
+        client = FakeClient({'a': 0.05, 'b': 0}, errors={'a': TimeoutError(), 'b': TimeoutError()})
+        with self.assertRaises(TimeoutError):
+            run(_adaptive_query(client, CHANNEL, {'peers': ['a', 'b']}))
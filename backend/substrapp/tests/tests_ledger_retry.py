@@ -0,0 +1,171 @@
+from django.test import TestCase, override_settings
+from mock import patch
+
+from substrapp.ledger.api import retry_on_error
+from substrapp.ledger.exceptions import (LedgerAssetNotFound, LedgerCircuitOpen, LedgerMVCCError, LedgerStatusError,
+                                         LedgerTimeout, LedgerUnavailable)
+from substrapp.ledger.retry import CircuitBreaker, RetryBudget, get_backoff_delay
+
+
+@override_settings(LEDGER_CALL_RETRY=True, LEDGER_RETRY_MAX_DELAY_SECONDS=10)
+class RetryOnErrorTests(TestCase):
+
+    def setUp(self):
+        patchers = [
+            patch('substrapp.ledger.retry._budget', RetryBudget(max_tokens=10, token_ratio=0.5)),
+            patch('substrapp.ledger.api.time.sleep'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_backoff_delay(self):
+        with patch('substrapp.ledger.retry.random.uniform', side_effect=lambda a, b: b):
+            delays = [get_backoff_delay(attempt, delay=1, backoff=2) for attempt in range(1, 7)]
+        self.assertEqual(delays, [1, 2, 4, 8, 10, 10])
+
+        for attempt in range(1, 10):
+            self.assertLessEqual(get_backoff_delay(attempt, delay=1, backoff=2), 10)
+
+    def test_retry_until_nbtries(self):
+        calls = []
+
+        @retry_on_error(nbtries=3)
+        def fail():
+            calls.append(1)
+            raise LedgerMVCCError('conflict')
+
+        with self.assertRaises(LedgerMVCCError):
+            fail()
+        self.assertEqual(len(calls), 3)
+
+    def test_no_retry_on_other_errors(self):
+        calls = []
+
+        @retry_on_error()
+        def fail():
+            calls.append(1)
+            raise LedgerAssetNotFound('not found')
+
+        with self.assertRaises(LedgerAssetNotFound):
+            fail()
+        self.assertEqual(len(calls), 1)
+
+    def test_retry_budget(self):
+        calls = []
+
+        @retry_on_error(nbtries=15)
+        def fail():
+            calls.append(1)
+            raise LedgerUnavailable('unavailable')
+
+        # 10 tokens, retries stop when less than half of them are left
+        with self.assertRaises(LedgerUnavailable):
+            fail()
+        self.assertEqual(len(calls), 5)
+
+        # the budget is shared by all the calls of the process
+        with self.assertRaises(LedgerUnavailable):
+            fail()
+        self.assertEqual(len(calls), 6)
+
+        @retry_on_error()
+        def succeed():
+            return True
+
+        # successful calls refill the budget
+        succeed()
+        succeed()
+        with self.assertRaises(LedgerUnavailable):
+            fail()
+        self.assertEqual(len(calls), 8)
+
+    def test_retry_budget_not_used_by_conflicts(self):
+        conflicts = []
+
+        @retry_on_error(nbtries=15)
+        def conflict():
+            conflicts.append(1)
+            raise LedgerMVCCError('conflict')
+
+        # a burst of conflicts
+        for _ in range(10):
+            with self.assertRaises(LedgerMVCCError):
+                conflict()
+        self.assertEqual(len(conflicts), 150)
+
+        calls = []
+
+        @retry_on_error(nbtries=15)
+        def update_status():
+            calls.append(1)
+            if len(calls) < 3:
+                raise LedgerStatusError('status lag')
+            return True
+
+        # still retried
+        self.assertTrue(update_status())
+        self.assertEqual(len(calls), 3)
+
+    def test_no_retry_when_circuit_open(self):
+        calls = []
+
+        @retry_on_error()
+        def fail():
+            calls.append(1)
+            raise LedgerCircuitOpen('open')
+
+        with self.assertRaises(LedgerCircuitOpen):
+            fail()
+        self.assertEqual(len(calls), 1)
+
+
+class CircuitBreakerTests(TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('mychannel', failure_threshold=3, reset_timeout=30)
+
+    def test_open_after_consecutive_failures(self):
+        for _ in range(2):
+            self.breaker.before_call()
+            self.breaker.on_failure(LedgerUnavailable('unavailable'))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        # errors returned by the peer do not count
+        self.breaker.on_failure(LedgerMVCCError('conflict'))
+        for _ in range(2):
+            self.breaker.on_failure(LedgerUnavailable('unavailable'))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        self.breaker.on_failure(LedgerUnavailable('unavailable'))
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(LedgerCircuitOpen):
+            self.breaker.before_call()
+
+    def test_commit_timeouts_not_counted(self):
+        for _ in range(5):
+            self.breaker.before_call()
+            self.breaker.on_failure(LedgerTimeout('waitForEvent timed out.'))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_half_open(self):
+        for _ in range(3):
+            self.breaker.on_failure(LedgerUnavailable('unavailable'))
+
+        with patch('substrapp.ledger.retry.time.time', return_value=self.breaker.opened_at + 31):
+            # a single trial call
+            self.breaker.before_call()
+            self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+            with self.assertRaises(LedgerCircuitOpen):
+                self.breaker.before_call()
+
+            # it fails: open again
+            self.breaker.on_failure(LedgerUnavailable('unavailable'))
+            self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        with patch('substrapp.ledger.retry.time.time', return_value=self.breaker.opened_at + 31):
+            self.breaker.before_call()
+            self.breaker.on_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.before_call()
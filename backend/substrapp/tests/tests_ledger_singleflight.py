@@ -0,0 +1,84 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import mock
+from django.test import TestCase, override_settings
+
+from substrapp.ledger.api import get_object_from_ledger
+from substrapp.ledger.connection import get_connection
+from substrapp.ledger.fake import generate_chaincode, use_fake_ledger
+from substrapp.ledger.singleflight import SingleFlight
+
+from .tests_ledger_fake import CHANNEL, LEDGER_SETTINGS
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_identical_calls_coalesced(self):
+        single_flight = SingleFlight()
+        call = mock.Mock()
+
+        async def query():
+            call()
+            await asyncio.sleep(0.01)
+            return {'results': [1]}
+
+        async def run():
+            return await asyncio.gather(
+                single_flight.do('queryAlgos', [], query),
+                single_flight.do('queryAlgos', [], query),
+                single_flight.do('queryAlgo', {'key': 'algo'}, query),
+            )
+
+        responses = self.loop.run_until_complete(run())
+
+        self.assertEqual(call.call_count, 2)
+        self.assertEqual(responses, [{'results': [1]}] * 3)
+        self.assertIsNot(responses[0], responses[1])
+        self.assertEqual(single_flight.stats, {'calls': 3, 'coalesced': 1})
+        self.assertEqual(single_flight.calls, {})
+
+        # calls after the response are sent again
+        self.loop.run_until_complete(single_flight.do('queryAlgos', [], query))
+        self.assertEqual(call.call_count, 3)
+
+    def test_errors_shared(self):
+        single_flight = SingleFlight()
+
+        async def query():
+            await asyncio.sleep(0.01)
+            raise ValueError('unavailable')
+
+        async def run():
+            return await asyncio.gather(
+                single_flight.do('queryAlgos', [], query),
+                single_flight.do('queryAlgos', [], query),
+                return_exceptions=True,
+            )
+
+        errors = self.loop.run_until_complete(run())
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors))
+        self.assertEqual(single_flight.calls, {})
+
+
+@override_settings(**LEDGER_SETTINGS)
+class LedgerSingleFlightTests(TestCase):
+
+    def test_concurrent_queries(self):
+        chaincode = generate_chaincode(traintuples=1, testtuples=0)
+        key = next(iter(chaincode.keys_by_kind['traintuple']))
+
+        with use_fake_ledger({CHANNEL: chaincode}, latency=0.05):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                traintuples = list(executor.map(
+                    lambda _: get_object_from_ledger(CHANNEL, key, 'queryTraintuple', use_cache=False),
+                    range(4)))
+            stats = get_connection(CHANNEL).single_flight.stats
+
+        self.assertEqual([t['key'] for t in traintuples], [key] * 4)
+        self.assertEqual(stats['calls'], 4)
+        self.assertGreater(stats['coalesced'], 0)
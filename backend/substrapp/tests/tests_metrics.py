@@ -0,0 +1,63 @@
+from django.test import TestCase, override_settings
+from mock import patch
+
+from prometheus_client import REGISTRY
+
+from substrapp.ledger.api import query_ledger
+from substrapp.ledger.exceptions import LedgerMVCCError, LedgerTimeout
+from substrapp.ledger.retry import RetryBudget
+
+CHANNEL = 'mychannel'
+
+
+def get_sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class LedgerMetricsTests(TestCase):
+
+    @override_settings(LEDGER_CALL_RETRY=False)
+    def test_call_duration_and_errors(self):
+        count = get_sample('ledger_call_duration_seconds_count', call_type='query', fcn='queryAlgos')
+        errors = get_sample('ledger_call_errors_total', call_type='query', fcn='queryAlgos', error='LedgerMVCCError')
+
+        with patch('substrapp.ledger.api._call_ledger') as m_call_ledger:
+            m_call_ledger.return_value = []
+            query_ledger(CHANNEL, 'queryAlgos', use_cache=False)
+
+            m_call_ledger.side_effect = LedgerMVCCError('conflict')
+            with self.assertRaises(LedgerMVCCError):
+                query_ledger(CHANNEL, 'queryAlgos', use_cache=False)
+
+        self.assertEqual(
+            get_sample('ledger_call_duration_seconds_count', call_type='query', fcn='queryAlgos'), count + 2)
+        self.assertEqual(
+            get_sample('ledger_call_errors_total', call_type='query', fcn='queryAlgos', error='LedgerMVCCError'),
+            errors + 1)
+
+    @override_settings(LEDGER_CALL_RETRY=True, LEDGER_RETRY_MAX_DELAY_SECONDS=0)
+    def test_retries(self):
+        labels = {'function': '_query_ledger', 'error': 'LedgerTimeout', 'decision': 'retry'}
+        retries = get_sample('ledger_call_retries_total', **labels)
+
+        with patch('substrapp.ledger.api._call_ledger') as m_call_ledger, \
+                patch('substrapp.ledger.retry._budget', RetryBudget(max_tokens=100, token_ratio=0.1)), \
+                patch('substrapp.ledger.api.time.sleep'):
+            m_call_ledger.side_effect = [LedgerTimeout('timeout'), LedgerTimeout('timeout'), []]
+            query_ledger(CHANNEL, 'queryAlgos', use_cache=False)
+
+        self.assertEqual(get_sample('ledger_call_retries_total', **labels), retries + 2)
+
+
+class MetricsEndpointTests(TestCase):
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_metrics(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'ledger_call_duration_seconds', response.content)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_metrics_disabled(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 404)
@@ -1,4 +1,6 @@
-from django.test import TestCase
+import asyncio
+
+from django.test import TestCase, override_settings
 
 from mock import patch
 
@@ -7,7 +9,7 @@ from substrapp.utils import raise_if_path_traversal, uncompress_path
 from substrapp.ledger.exceptions import LedgerAssetNotFound, LedgerInvalidResponse
 
 from substrapp.ledger.api import get_object_from_ledger, log_fail_tuple, log_start_tuple, \
-    log_success_tuple, query_tuples, call_ledger
+    log_success_tuple, query_tuples, call_ledger, call_ledger_async, iter_ledger
 
 from .assets import traintuple
 
@@ -148,3 +150,48 @@ class MiscTests(TestCase):
             ] + [{'results': "", 'bookmark': 'bookmark_end'}]
             response = call_ledger(CHANNEL, 'query', 'queryTraintuples')
             self.assertEqual(response, traintuple)
+
+    def test_call_ledger_async_with_bookmark(self):
+        responses = [
+            {'results': traintuple[i:i + 2], 'bookmark': f'bookmark_{i}'}
+            for i in range(0, len(traintuple), 2)
+        ] + [{'results': "", 'bookmark': 'bookmark_end'}]
+        calls = []
+
+        async def _call_ledger_async(*args, **kwargs):
+            calls.append(kwargs.get('args'))
+            return responses[len(calls) - 1]
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        with patch('substrapp.ledger.api._call_ledger_async', side_effect=_call_ledger_async):
+            response = loop.run_until_complete(call_ledger_async(CHANNEL, 'query', 'queryTraintuples'))
+
+        self.assertEqual(response, traintuple)
+        self.assertEqual(calls, [None] + [{'bookmark': r['bookmark']} for r in responses[:-1]])
+
+    @override_settings(LEDGER_CALL_RETRY=False)
+    def test_iter_ledger_with_bookmark(self):
+
+        with patch('substrapp.ledger.api._call_ledger') as m_call_ledger:
+            m_call_ledger.side_effect = [
+                {'results': traintuple[i:i + 2], 'bookmark': f'bookmark_{i}'}
+                for i in range(0, len(traintuple), 2)
+            ] + [{'results': "", 'bookmark': 'bookmark_end'}]
+            pages = iter_ledger(CHANNEL, 'queryTraintuples')
+
+            # pages are requested lazily
+            self.assertEqual(next(pages), traintuple[0:2])
+            self.assertEqual(m_call_ledger.call_count, 1)
+
+            self.assertEqual(traintuple[0:2] + sum(pages, []), traintuple)
+
+    @override_settings(LEDGER_CALL_RETRY=False)
+    def test_iter_ledger_without_bookmark(self):
+
+        with patch('substrapp.ledger.api._call_ledger') as m_call_ledger:
+            m_call_ledger.return_value = traintuple
+            self.assertEqual(list(iter_ledger(CHANNEL, 'queryTraintuples')), [traintuple])
+
+            m_call_ledger.return_value = None
+            self.assertEqual(list(iter_ledger(CHANNEL, 'queryTraintuples')), [])
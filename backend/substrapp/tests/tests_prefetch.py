@@ -0,0 +1,192 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+import mock
+from django.test import TestCase, override_settings
+
+from backend.celery import register_control_commands
+from substrapp import tasks
+from substrapp.tasks import asset_cache
+from substrapp.tasks.prefetch import Prefetcher, get_parent_keys, prefetch_inputs, prefetch_model, request_prefetch
+from substrapp.tasks.utils import get_asset_content
+from substrapp.utils import compute_hash, get_hash
+
+CHANNEL = 'mychannel'
+TASK = {'PREFETCH_ENABLED': True, 'PREFETCH_CONCURRENCY': 2, 'PREFETCH_CACHE_MAX_SIZE': 1024}
+
+
+class PrefetchTestCase(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, TASK=TASK)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class AssetCacheTests(PrefetchTestCase):
+
+    def test_content(self):
+        content = b'algo'
+        checksum = compute_hash(content)
+        self.assertIsNone(asset_cache.get_content(checksum))
+
+        asset_cache.put_content(checksum, content)
+        self.assertTrue(asset_cache.contains(checksum))
+        self.assertEqual(asset_cache.get_content(checksum), content)
+
+        # corrupted
+        with open(asset_cache.get_cache_path(checksum), 'wb') as f:
+            f.write(b'other')
+        self.assertIsNone(asset_cache.get_content(checksum))
+        self.assertFalse(asset_cache.contains(checksum))
+
+        with self.assertRaises(Exception):
+            asset_cache.get_cache_path('../secret')
+
+    def test_file(self):
+        src_path = os.path.join(self.media_root, 'model')
+        with open(src_path, 'wb') as f:
+            f.write(b'model')
+        checksum = get_hash(src_path, key='traintuple_key')
+        dst_path = os.path.join(self.media_root, 'dst')
+
+        self.assertFalse(asset_cache.get_file(checksum, dst_path, hash_key='traintuple_key'))
+
+        asset_cache.put_file(checksum, src_path)
+        self.assertTrue(asset_cache.get_file(checksum, dst_path, hash_key='traintuple_key'))
+        with open(dst_path, 'rb') as f:
+            self.assertEqual(f.read(), b'model')
+
+        # wrong key
+        self.assertFalse(asset_cache.get_file(checksum, dst_path, hash_key='other_key'))
+        self.assertFalse(asset_cache.contains(checksum))
+
+    def test_evict(self):
+        checksums = []
+        for i in range(3):
+            content = bytes([i]) * 300
+            checksums.append(compute_hash(content))
+            asset_cache.put_content(checksums[-1], content)
+            os.utime(asset_cache.get_cache_path(checksums[-1]), (i, i))
+
+        # the least recently used first
+        asset_cache.get_content(checksums[0])
+        asset_cache.evict(max_size=700)
+        self.assertEqual([asset_cache.contains(checksum) for checksum in checksums], [True, False, True])
+
+        asset_cache.evict(max_size=0)
+        self.assertEqual(os.listdir(asset_cache.get_cache_directory()), [])
+
+
+@mock.patch('substrapp.tasks.utils.authenticate_worker')
+class PrefetchTests(PrefetchTestCase):
+
+    def test_get_asset_content(self, mauthenticate):
+        content = b'algo'
+        checksum = compute_hash(content)
+
+        with mock.patch('substrapp.tasks.utils.get_remote_file_content', return_value=content) as mget:
+            self.assertEqual(get_asset_content(CHANNEL, 'url', 'node', checksum), content)
+            self.assertEqual(get_asset_content(CHANNEL, 'url', 'node', checksum), content)
+        mget.assert_called_once()
+
+        with override_settings(TASK={**TASK, 'PREFETCH_ENABLED': False}), \
+                mock.patch('substrapp.tasks.utils.get_remote_file_content', return_value=content) as mget:
+            get_asset_content(CHANNEL, 'url', 'node', checksum)
+        mget.assert_called_once()
+
+    def test_prefetch_model(self, mauthenticate):
+        model_path = os.path.join(self.media_root, 'model')
+        with open(model_path, 'wb') as f:
+            f.write(b'model')
+        checksum = get_hash(model_path, key='parent')
+        metadata = {'key': 'parent', 'status': 'done', 'dataset': {'worker': 'MyOrg2MSP'},
+                    'out_model': {'key': 'model', 'checksum': checksum, 'storage_address': 'url'}}
+
+        def get_and_put(channel_name, url, auth, content_checksum, content_dst_path, hash_key, session=None):
+            shutil.copyfile(model_path, content_dst_path)
+
+        with mock.patch('substrapp.tasks.prefetch.find_training_step_tuple_from_key',
+                        return_value=('traintuple', metadata)), \
+                mock.patch('substrapp.tasks.utils.get_and_put_remote_file_content',
+                           side_effect=get_and_put) as mget_and_put:
+            prefetch_model(CHANNEL, 'parent')
+            # already cached
+            prefetch_model(CHANNEL, 'parent')
+
+        mget_and_put.assert_called_once()
+        self.assertTrue(asset_cache.contains(checksum))
+        # only the cached model is left
+        self.assertEqual(os.listdir(asset_cache.get_cache_directory()), [checksum])
+
+    def test_parent_keys(self, mauthenticate):
+        self.assertEqual(get_parent_keys('traintuple', {'in_models': [{'traintuple_key': 'a'},
+                                                                      {'traintuple_key': 'b'}]}), ['a', 'b'])
+        self.assertEqual(get_parent_keys('traintuple', {'in_models': None}), [])
+        self.assertEqual(get_parent_keys('composite_traintuple', {'in_head_model': {'traintuple_key': 'head'},
+                                                                  'in_trunk_model': {'traintuple_key': 'trunk'}}),
+                         ['trunk'])
+        self.assertEqual(get_parent_keys('testtuple', {'traintuple_key': 'a'}), ['a'])
+
+    def test_prefetcher(self, mauthenticate):
+        prefetcher = Prefetcher(2)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch(channel_name, key):
+            calls.append(key)
+            started.set()
+            release.wait(5)
+
+        tuple_request = {'tuple_type': 'traintuple', 'tuple': {'key': 'tuple'}}
+        with mock.patch('substrapp.tasks.prefetch.prefetch_tuple') as mprefetch_tuple, \
+                mock.patch('substrapp.tasks.prefetch.prefetch_model', side_effect=fetch):
+            self.assertEqual(prefetcher.schedule(CHANNEL, [{'model': 'parent'}, tuple_request]), 2)
+            started.wait(5)
+            # in progress
+            self.assertEqual(prefetcher.schedule(CHANNEL, [{'model': 'parent'}]), 0)
+            release.set()
+            prefetcher.executor.shutdown()
+
+        self.assertEqual(calls, ['parent'])
+        mprefetch_tuple.assert_called_once_with(CHANNEL, 'traintuple', {'key': 'tuple'})
+        self.assertEqual(prefetcher.in_progress, set())
+
+    def test_control_command(self, mauthenticate):
+        with mock.patch('substrapp.tasks.prefetch.get_prefetcher') as mget_prefetcher:
+            mget_prefetcher.return_value.schedule.return_value = 1
+            self.assertEqual(prefetch_inputs(None, CHANNEL, [{'model': 'parent'}]), {'ok': '1 prefetch scheduled'})
+            with override_settings(TASK={**TASK, 'PREFETCH_ENABLED': False}):
+                self.assertIn('error', prefetch_inputs(None, CHANNEL, [{'model': 'parent'}]))
+        mget_prefetcher.return_value.schedule.assert_called_once_with(CHANNEL, [{'model': 'parent'}])
+
+        with mock.patch('substrapp.tasks.prefetch.app') as mapp:
+            request_prefetch(CHANNEL, [])
+            mapp.control.broadcast.assert_not_called()
+
+            request_prefetch(CHANNEL, [{'model': 'parent'}], worker='MyOrg1.worker')
+            mapp.control.broadcast.assert_called_once_with(
+                'prefetch_inputs', arguments={'channel_name': CHANNEL, 'requests': [{'model': 'parent'}]},
+                pattern='*@MyOrg1.worker', matcher='glob')
+
+            # the compute workers, not the scheduler
+            with override_settings(ORG_NAME='MyOrg2'):
+                request_prefetch(CHANNEL, [{'model': 'parent'}])
+            mapp.control.broadcast.assert_called_with(
+                'prefetch_inputs', arguments={'channel_name': CHANNEL, 'requests': [{'model': 'parent'}]},
+                pattern='*@MyOrg2.worker', matcher='glob')
+
+    def test_register_control_command(self, mauthenticate):
+        # the module imported again is not kept
+        with mock.patch.dict(sys.modules), mock.patch.object(tasks, 'prefetch', tasks.prefetch):
+            sys.modules.pop('substrapp.tasks.prefetch')
+            register_control_commands(sender=mock.Mock(hostname='celery@MyOrg1.scheduler'))
+            self.assertNotIn('substrapp.tasks.prefetch', sys.modules)
+            register_control_commands(sender=mock.Mock(hostname='celery@MyOrg1.worker'))
+            self.assertIn('substrapp.tasks.prefetch', sys.modules)
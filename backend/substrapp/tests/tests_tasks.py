@@ -1,21 +1,25 @@
 import os
 import shutil
+import threading
 import mock
 import uuid
-from unittest.mock import MagicMock
 
-from django.test import override_settings
+from django.conf import settings
+from django.test import TestCase, override_settings
 from rest_framework import status
 from rest_framework.test import APITestCase
-from django_celery_results.models import TaskResult
 
-from substrapp.models import DataSample
+from substrapp.models import ComputePlanWorker, DataSample
 from substrapp.ledger.api import LedgerStatusError
 from substrapp.utils import store_datasamples_archive
 from substrapp.utils import compute_hash, get_remote_file_content, get_hash, create_directory
 from substrapp.tasks.tasks import (build_subtuple_folders, get_algo, get_objective, prepare_opener,
                                    uncompress_content, prepare_data_sample, prepare_task, do_task,
-                                   compute_task, remove_subtuple_materials, prepare_materials)
+                                   compute_task, remove_subtuple_materials, prepare_materials,
+                                   get_compute_plan_worker, set_compute_plan_worker,
+                                   run_materials_stages, fetch_models, TasksError)
+from substrapp.tasks.utils import get_node_session
+from substrapp.tasks.priority import get_plan_dependencies, get_priority, get_tuple_priority, record_plan_dependencies
 
 from .common import (get_sample_algo, get_sample_script, get_sample_zip_data_sample, get_sample_tar_data_sample,
                      get_sample_model)
@@ -348,9 +352,8 @@ class TasksTests(APITestCase):
         subtuple = [{'key': 'subtuple_test', 'compute_plan_key': 'flkey', 'status': 'todo'}]
 
         with mock.patch('substrapp.tasks.tasks.settings') as msettings, \
-                mock.patch.object(TaskResult.objects, 'filter') as mtaskresult, \
                 mock.patch('substrapp.tasks.tasks.get_hash') as mget_hash, \
-                mock.patch('substrapp.tasks.tasks.query_tuples') as mquery_tuples, \
+                mock.patch('substrapp.tasks.tasks.iter_tuples') as miter_tuples, \
                 mock.patch('substrapp.tasks.tasks.get_objective') as mget_objective, \
                 mock.patch('substrapp.tasks.tasks.get_algo') as mget_algo, \
                 mock.patch('substrapp.tasks.tasks.prepare_models'), \
@@ -358,14 +361,13 @@ class TasksTests(APITestCase):
                 mock.patch('substrapp.tasks.tasks.prepare_opener') as mprepare_opener, \
                 mock.patch('substrapp.tasks.tasks.prepare_data_sample') as mprepare_data_sample, \
                 mock.patch('substrapp.tasks.tasks.uncompress_content'), \
-                mock.patch('substrapp.tasks.tasks.json.loads') as mjson_loads, \
                 mock.patch('substrapp.tasks.tasks.AsyncResult') as masyncres, \
                 mock.patch('substrapp.tasks.tasks.get_owner') as get_owner,\
                 mock.patch('substrapp.tasks.tasks.find_training_step_tuple_from_key') as gettuple:
 
             msettings.return_value = FakeSettings()
             mget_hash.return_value = 'owkinhash'
-            mquery_tuples.return_value = subtuple
+            miter_tuples.return_value = subtuple
             mget_objective.return_value = 'objective'
             mget_algo.return_value = 'algo', 'algo_key'
             mbuild_subtuple_folders.return_value = MEDIA_ROOT
@@ -376,11 +378,7 @@ class TasksTests(APITestCase):
 
             masyncres.return_value.state = 'PENDING'
 
-            mock_filter = MagicMock()
-            mock_filter.count.return_value = 1
-            mtaskresult.return_value = mock_filter
-
-            mjson_loads.return_value = {'worker': 'worker'}
+            ComputePlanWorker.objects.create(compute_plan_key='flkey', worker='worker', queue='queue')
 
             with mock.patch('substrapp.tasks.tasks.log_start_tuple') as mlog_start_tuple:
                 mlog_start_tuple.side_effect = LedgerStatusError('Bad Response')
@@ -392,6 +390,9 @@ class TasksTests(APITestCase):
                 mapply_async.return_value = 'do_task'
                 prepare_task(CHANNEL, 'traintuple')
 
+            # sent to the worker of the compute plan
+            self.assertEqual(mapply_async.call_args[1]['queue'], 'worker')
+
     def test_do_task(self):
 
         class FakeSettings(object):
@@ -462,6 +463,14 @@ class TasksTests(APITestCase):
                 mlog_success_tuple.return_value = 'data', 404
                 compute_task(CHANNEL, 'traintuple', subtuple, None)
 
+                # the latest worker of a compute plan is recorded
+                compute_task(CHANNEL, 'traintuple', subtuple, 'cpkey')
+                self.assertEqual(get_compute_plan_worker('cpkey'), ComputePlanWorker.objects.get().worker)
+                set_compute_plan_worker('cpkey', 'otherworker', 'otherqueue')
+                self.assertEqual(get_compute_plan_worker('cpkey'), 'otherworker')
+                self.assertEqual(ComputePlanWorker.objects.get().queue, 'otherqueue')
+                self.assertIsNone(get_compute_plan_worker('otherkey'))
+
                 with mock.patch('substrapp.tasks.tasks.log_fail_tuple') as mlog_fail_tuple:
                     mdo_task.side_effect = Exception("Test")
                     mlog_fail_tuple.return_value = 'data', 404
@@ -484,7 +493,7 @@ class TasksTests(APITestCase):
 
         with mock.patch('substrapp.tasks.tasks.settings') as msettings, \
                 mock.patch('substrapp.tasks.tasks.get_hash') as mget_hash, \
-                mock.patch('substrapp.tasks.tasks.query_tuples') as mquery_tuples, \
+                mock.patch('substrapp.tasks.tasks.iter_tuples') as miter_tuples, \
                 mock.patch('substrapp.tasks.tasks.get_objective') as mget_objective, \
                 mock.patch('substrapp.tasks.tasks.get_algo') as mget_algo, \
                 mock.patch('substrapp.tasks.tasks.prepare_models'), \
@@ -495,10 +504,127 @@ class TasksTests(APITestCase):
 
             msettings.return_value = FakeSettings()
             mget_hash.return_value = 'owkinhash'
-            mquery_tuples.return_value = subtuple, 200
+            miter_tuples.return_value = subtuple, 200
             mget_objective.return_value = 'objective'
             mget_algo.return_value = 'algo', 'algo_key'
             mbuild_subtuple_folders.return_value = MEDIA_ROOT
 
             prepare_materials(CHANNEL, subtuple[0], 'traintuple')
             prepare_materials(CHANNEL, subtuple[0], 'testtuple')
+
+    def test_run_materials_stages(self):
+        # the stages only finish if they run concurrently
+        barrier = threading.Barrier(3, timeout=5)
+        finished = []
+
+        def stage(name):
+            barrier.wait()
+            finished.append(name)
+
+        durations = run_materials_stages(
+            'traintuple',
+            {'algo': (stage, ('algo', )), 'opener': (stage, ('opener', )), 'models': (stage, ('models', ))})
+        self.assertEqual(set(durations), {'algo', 'opener', 'models'})
+        self.assertEqual(set(finished), {'algo', 'opener', 'models'})
+
+        def fail():
+            raise Exception('algo failed')
+
+        def slow():
+            threading.Event().wait(0.2)
+            finished.append('slow')
+
+        with self.assertRaisesRegex(Exception, 'algo failed'):
+            run_materials_stages('traintuple', {'algo': (fail, ()), 'opener': (slow, ())})
+        # raised once the other stages are finished
+        self.assertEqual(finished[-1], 'slow')
+
+    def test_fetch_models(self):
+        input_models = [{'traintuple_key': f'model{i}'} for i in range(4)]
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def fetch_model(channel_name, tuple_type, authorized_types, input_model, directory):
+            with lock:
+                running.append(input_model['traintuple_key'])
+                max_running.append(len(running))
+            threading.Event().wait(0.05)
+            with lock:
+                running.remove(input_model['traintuple_key'])
+            if input_model['traintuple_key'] == 'model2':
+                raise LedgerStatusError('model2 not found')
+
+        # the models stage runs in a thread of the materials pool: no fork
+        with mock.patch('substrapp.tasks.tasks.fetch_model', side_effect=fetch_model) as mfetch_model, \
+                mock.patch('substrapp.tasks.tasks.MODELS_FETCH_CONCURRENCY', 2), \
+                mock.patch('os.fork', side_effect=AssertionError('fork')) as mfork:
+            with self.assertRaisesRegex(TasksError, r'1/4 input models failed: model2: LedgerStatusError') as cm:
+                fetch_models(CHANNEL, 'aggregatetuple', ('traintuple', ), input_models, MEDIA_ROOT)
+
+        self.assertEqual(mfetch_model.call_count, 4)
+        self.assertEqual(max(max_running), 2)
+        mfork.assert_not_called()
+        self.assertIsInstance(cm.exception.__cause__, LedgerStatusError)
+
+    def test_get_node_session(self):
+        session = get_node_session('node1')
+        self.assertIs(get_node_session('node1'), session)
+        self.assertIsNot(get_node_session('node2'), session)
+
+        with mock.patch('substrapp.tasks.utils.os.getpid', return_value=-1):
+            self.assertIsNot(get_node_session('node1'), session)
+
+
+class TaskPriorityTests(TestCase):
+
+    def test_get_tuple_priority(self):
+        self.assertIsNone(get_tuple_priority('traintuple', {}))
+
+        with override_settings(TASK=dict(settings.TASK, PRIORITY_ENABLED=True)):
+            self.assertEqual(get_tuple_priority('testtuple', {'compute_plan_key': 'cp', 'rank': 0}), 0)
+            self.assertEqual(get_tuple_priority('traintuple', {}), 5)
+            self.assertEqual(get_tuple_priority('traintuple', {'compute_plan_key': 'cp', 'rank': 4}, 0, 4), 5)
+            self.assertEqual(get_tuple_priority('traintuple', {'compute_plan_key': 'cp', 'rank': 1}, 1, 1), 6)
+            self.assertEqual(get_tuple_priority('aggregatetuple', {'compute_plan_key': 'cp', 'rank': 2}, 3, 4), 8)
+            self.assertEqual(get_tuple_priority('traintuple', {'compute_plan_key': 'cp', 'rank': 0}, 1000, 10), 9)
+            # last rank unknown
+            self.assertEqual(get_tuple_priority('traintuple', {'compute_plan_key': 'cp', 'rank': 0}), 7)
+            self.assertEqual(get_tuple_priority('traintuple', {'compute_plan_key': 'cp', 'rank': 3}), 5)
+
+    def test_get_plan_dependencies(self):
+        tuples = [
+            ('traintuple', {'key': 'a', 'rank': 0, 'in_models': None}),
+            ('composite_traintuple', {'key': 'b', 'rank': 1, 'in_head_model': {'traintuple_key': 'c0'},
+                                      'in_trunk_model': {'traintuple_key': 'a'}}),
+            ('aggregatetuple', {'key': 'c', 'rank': 2, 'in_models': [{'traintuple_key': 'a'},
+                                                                     {'traintuple_key': 'b'}]}),
+        ]
+        children_counts, last_rank = get_plan_dependencies(tuples)
+        self.assertEqual(children_counts, {'a': 2, 'b': 1, 'c0': 1})
+        self.assertEqual(last_rank, 2)
+
+    def test_record_plan_dependencies(self):
+        compute_plan = {'traintuple_keys': ['parent'], 'testtuple_keys': ['test']}
+        tuples = {'parent': {'key': 'parent', 'rank': 0}}
+
+        def get_objects(channel_name, keys, query, use_cache=True):
+            return [tuples[key] for key in keys]
+
+        subtuple = {'key': 'key', 'compute_plan_key': 'cp', 'rank': 1, 'in_models': [{'traintuple_key': 'parent'}]}
+        child = {'key': 'child', 'compute_plan_key': 'cp', 'rank': 2, 'in_models': [{'traintuple_key': 'key'}]}
+
+        with mock.patch('substrapp.ledger.api.get_object_from_ledger', return_value=compute_plan) as mget_object, \
+                mock.patch('substrapp.ledger.api.get_objects_from_ledger', side_effect=get_objects):
+            # the tuples created before are loaded from the ledger, once
+            dependencies = record_plan_dependencies(CHANNEL, [('traintuple', subtuple)])
+            self.assertEqual(dependencies, {'cp': ({'parent': 1}, 1)})
+            dependencies = record_plan_dependencies(CHANNEL, [('aggregatetuple', child), ('traintuple', subtuple)])
+            self.assertEqual(dependencies, {'cp': ({'parent': 1, 'key': 1}, 2)})
+            mget_object.assert_called_once_with(CHANNEL, 'cp', 'queryComputePlan', use_cache=False)
+
+        with override_settings(TASK=dict(settings.TASK, PRIORITY_ENABLED=True)):
+            # 1 child, halfway through the plan
+            self.assertEqual(get_priority('composite_traintuple', subtuple), 7)
+            self.assertEqual(get_priority('aggregatetuple', child), 5)
+            self.assertEqual(get_priority('testtuple', subtuple), 0)
@@ -104,9 +104,9 @@ class AlgoViewTests(APITestCase):
     def test_algo_list_filter_datamanager_fail(self):
         url = reverse('substrapp:algo-list')
         with mock.patch('substrapp.views.algo.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = algo
-            mquery_ledger2.return_value = datamanager
+            mquery_ledger2.return_value = [datamanager]
 
             search_params = '?search=dataset%253Aname%253ASimplified%2520ISIC%25202018'
             response = self.client.get(url + search_params, **self.extra)
@@ -117,9 +117,9 @@ class AlgoViewTests(APITestCase):
     def test_algo_list_filter_objective_fail(self):
         url = reverse('substrapp:algo-list')
         with mock.patch('substrapp.views.algo.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = algo
-            mquery_ledger2.return_value = objective
+            mquery_ledger2.return_value = [objective]
 
             search_params = '?search=objective%253Aname%253ASkin%2520Lesion%2520Classification%2520Objective'
             response = self.client.get(url + search_params, **self.extra)
@@ -132,9 +132,9 @@ class AlgoViewTests(APITestCase):
         done_model = [m for m in model if 'traintuple' in m and m['traintuple']['status'] == 'done'][0]
 
         with mock.patch('substrapp.views.algo.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = algo
-            mquery_ledger2.return_value = model
+            mquery_ledger2.return_value = [model]
 
             key = done_model['traintuple']['out_model']['key']
             search_params = f'?search=model%253Akey%253A{key}'
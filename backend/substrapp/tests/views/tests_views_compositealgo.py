@@ -116,9 +116,9 @@ class CompositeAlgoViewTests(APITestCase):
     def test_composite_algo_list_filter_datamanager_fail(self):
         url = reverse('substrapp:composite_algo-list')
         with mock.patch('substrapp.views.compositealgo.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = compositealgo
-            mquery_ledger2.return_value = datamanager
+            mquery_ledger2.return_value = [datamanager]
 
             search_params = '?search=dataset%253Aname%253ASimplified%2520ISIC%25202018'
             response = self.client.get(url + search_params, **self.extra)
@@ -129,9 +129,9 @@ class CompositeAlgoViewTests(APITestCase):
     def test_composite_algo_list_filter_objective_fail(self):
         url = reverse('substrapp:composite_algo-list')
         with mock.patch('substrapp.views.compositealgo.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = compositealgo
-            mquery_ledger2.return_value = objective
+            mquery_ledger2.return_value = [objective]
 
             search_params = '?search=objective%253Aname%253ASkin%2520Lesion%2520Classification%2520Objective'
             response = self.client.get(url + search_params, **self.extra)
@@ -146,9 +146,9 @@ class CompositeAlgoViewTests(APITestCase):
         ][0]
 
         with mock.patch('substrapp.views.compositealgo.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = compositealgo
-            mquery_ledger2.return_value = model
+            mquery_ledger2.return_value = [model]
 
             key = done_model['composite_traintuple']['out_trunk_model']['out_model']['key']
             search_params = f'?search=model%253Akey%253A{key}'
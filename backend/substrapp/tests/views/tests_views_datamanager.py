@@ -96,9 +96,9 @@ class DataManagerViewTests(APITestCase):
                                              if o['key'] == objective_key].pop()['name'])
 
         with mock.patch('substrapp.views.datamanager.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = datamanager
-            mquery_ledger2.return_value = objective
+            mquery_ledger2.return_value = [objective]
 
             search_params = f'?search=objective%253Aname%253A{objective_to_filter}'
             response = self.client.get(url + search_params, **self.extra)
@@ -114,9 +114,9 @@ class DataManagerViewTests(APITestCase):
         ][0]
 
         with mock.patch('substrapp.views.datamanager.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = datamanager
-            mquery_ledger2.return_value = model
+            mquery_ledger2.return_value = [model]
             key = done_model['traintuple']['out_model']['key']
             search_params = f'?search=model%253Akey%253A{key}'
             response = self.client.get(url + search_params, **self.extra)
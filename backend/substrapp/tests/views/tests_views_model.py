@@ -83,9 +83,9 @@ class ModelViewTests(APITestCase):
 
         url = reverse('substrapp:model-list')
         with mock.patch('substrapp.views.model.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = model
-            mquery_ledger2.return_value = datamanager
+            mquery_ledger2.return_value = [datamanager]
 
             search_params = f'?search=dataset%253Aname%253A{encode_filter(datamanager[0]["name"])}'
             response = self.client.get(url + search_params, **self.extra)
@@ -96,9 +96,9 @@ class ModelViewTests(APITestCase):
     def test_model_list_filter_objective(self):
         url = reverse('substrapp:model-list')
         with mock.patch('substrapp.views.model.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = model
-            mquery_ledger2.return_value = objective
+            mquery_ledger2.return_value = [objective]
 
             search_params = f'?search=objective%253Aname%253A{encode_filter(objective[0]["name"])}'
             response = self.client.get(url + search_params, **self.extra)
@@ -109,9 +109,9 @@ class ModelViewTests(APITestCase):
     def test_model_list_filter_algo(self):
         url = reverse('substrapp:model-list')
         with mock.patch('substrapp.views.model.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = model
-            mquery_ledger2.return_value = algo
+            mquery_ledger2.return_value = [algo]
 
             search_params = f'?search=algo%253Aname%253A{encode_filter(algo[0]["name"])}'
             response = self.client.get(url + search_params, **self.extra)
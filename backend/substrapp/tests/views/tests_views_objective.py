@@ -126,9 +126,9 @@ class ObjectiveViewTests(APITestCase):
         datamanager_to_filter = encode_filter([dm for dm in datamanager
                                                if dm['key'] == datamanager_key].pop()['name'])
         with mock.patch('substrapp.views.objective.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = objective
-            mquery_ledger2.return_value = datamanager
+            mquery_ledger2.return_value = [datamanager]
 
             search_params = f'?search=dataset%253Aname%253A{datamanager_to_filter}'
             response = self.client.get(url + search_params, **self.extra)
@@ -143,9 +143,9 @@ class ObjectiveViewTests(APITestCase):
             if 'traintuple' in m and m['traintuple']['status'] == 'done' and m['testtuple']['objective']
         ][0]
         with mock.patch('substrapp.views.objective.query_ledger') as mquery_ledger, \
-                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+                mock.patch('substrapp.views.filters_utils.query_ledger_many') as mquery_ledger2:
             mquery_ledger.return_value = objective
-            mquery_ledger2.return_value = model
+            mquery_ledger2.return_value = [model]
 
             key = done_model['traintuple']['out_model']['key']
             search_params = f'?search=model%253Akey%253A{key}'
@@ -107,6 +107,18 @@ class TraintupleViewTests(APITestCase):
 
             self.assertEqual(len(r), 2)
 
+    def test_traintuple_list_page(self):
+        url = reverse('substrapp:traintuple-list')
+        with mock.patch('substrapp.views.traintuple.query_ledger') as mquery_ledger:
+            mquery_ledger.return_value = traintuple
+            response = self.client.get(url + '?offset=1&limit=2', **self.extra)
+
+            self.assertEqual(response.json(), traintuple[1:3])
+            self.assertEqual(response['X-Total-Count'], str(len(traintuple)))
+
+            response = self.client.get(url + '?limit=-1', **self.extra)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_traintuple_list_filter_compute_plan_key(self):
         url = reverse('substrapp:traintuple-list')
         with mock.patch('substrapp.views.traintuple.query_ledger') as mquery_ledger:
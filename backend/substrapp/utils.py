@@ -214,7 +214,7 @@ class NodeError(Exception):
     pass
 
 
-def get_remote_file(channel_name, url, auth, content_dst_path=None, **kwargs):
+def get_remote_file(channel_name, url, auth, content_dst_path=None, session=None, **kwargs):
 
     kwargs.update({
         'headers': {
@@ -227,26 +227,29 @@ def get_remote_file(channel_name, url, auth, content_dst_path=None, **kwargs):
     if settings.DEBUG:
         kwargs['verify'] = False
 
+    # a keep-alive session reuses the connections to the node
+    http_get = session.get if session is not None else requests.get
+
     try:
         if kwargs.get('stream', False) and content_dst_path is not None:
             chunk_size = 1024 * 1024
 
-            with requests.get(url, **kwargs) as response:
+            with http_get(url, **kwargs) as response:
                 response.raise_for_status()
 
                 with open(content_dst_path, 'wb') as fp:
                     fp.writelines(response.iter_content(chunk_size))
         else:
-            response = requests.get(url, **kwargs)
+            response = http_get(url, **kwargs)
     except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
         raise NodeError(f'Failed to fetch {url}') from e
 
     return response
 
 
-def get_remote_file_content(channel_name, url, auth, content_checksum, salt=None):
+def get_remote_file_content(channel_name, url, auth, content_checksum, salt=None, session=None):
 
-    response = get_remote_file(channel_name, url, auth)
+    response = get_remote_file(channel_name, url, auth, session=session)
 
     if response.status_code != status.HTTP_200_OK:
         logger.error(f'Url: {url} returned status code: {response.status_code}: {response.text}')
@@ -258,9 +261,10 @@ def get_remote_file_content(channel_name, url, auth, content_checksum, salt=None
     return response.content
 
 
-def get_and_put_remote_file_content(channel_name, url, auth, content_checksum, content_dst_path, hash_key):
+def get_and_put_remote_file_content(channel_name, url, auth, content_checksum, content_dst_path, hash_key,
+                                    session=None):
 
-    response = get_remote_file(channel_name, url, auth, content_dst_path, stream=True)
+    response = get_remote_file(channel_name, url, auth, content_dst_path, session=session, stream=True)
 
     if response.status_code != status.HTTP_200_OK:
         logger.error(f'Url: {url} returned status code: {response.status_code}: {response.text}')
@@ -16,7 +16,7 @@ from substrapp.ledger.exceptions import LedgerError, LedgerTimeout, LedgerConfli
 from substrapp.views.utils import (PermissionMixin,
                                    validate_key, get_success_create_code, LedgerException, ValidationException,
                                    get_remote_asset, node_has_process_permission, get_channel_name)
-from substrapp.views.filters_utils import filter_list
+from substrapp.views.filters_utils import list_assets
 
 
 def replace_storage_addresses(request, composite_algo):
@@ -169,27 +169,18 @@ class CompositeAlgoViewSet(mixins.CreateModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
+        channel_name = get_channel_name(request)
         try:
-            data = query_ledger(get_channel_name(request), fcn='queryCompositeAlgos', args=[])
+            data, count = list_assets(
+                channel_name, 'composite_algo', request.query_params,
+                lambda: query_ledger(channel_name, fcn='queryCompositeAlgos', args=[]))
         except LedgerError as e:
             return Response({'message': str(e.msg)}, status=e.status)
 
-        # parse filters
-        query_params = request.query_params.get('search')
-        if query_params is not None:
-            try:
-                data = filter_list(
-                    channel_name=get_channel_name(request),
-                    object_type='composite_algo',
-                    data=data,
-                    query_params=query_params)
-            except LedgerError as e:
-                return Response({'message': str(e.msg)}, status=e.status)
-
         for composite_algo in data:
             replace_storage_addresses(request, composite_algo)
 
-        return Response(data, status=status.HTTP_200_OK)
+        return Response(data, status=status.HTTP_200_OK, headers={'X-Total-Count': count})
 
 
 class CompositeAlgoPermissionViewSet(PermissionMixin,
@@ -8,7 +8,7 @@ from substrapp.serializers import LedgerCompositeTraintupleSerializer
 from substrapp.ledger.api import query_ledger, get_object_from_ledger
 from substrapp.views.computeplan import create_compute_plan
 from substrapp.ledger.exceptions import LedgerError
-from substrapp.views.filters_utils import filter_list
+from substrapp.views.filters_utils import list_assets
 from substrapp.views.utils import (validate_key, get_success_create_code, LedgerException, get_channel_name)
 
 
@@ -71,23 +71,15 @@ class CompositeTraintupleViewSet(mixins.CreateModelMixin,
             return Response(data, status=st, headers=headers)
 
     def list(self, request, *args, **kwargs):
+        channel_name = get_channel_name(request)
         try:
-            data = query_ledger(get_channel_name(request), fcn='queryCompositeTraintuples', args=[])
+            data, count = list_assets(
+                channel_name, 'composite_traintuple', request.query_params,
+                lambda: query_ledger(channel_name, fcn='queryCompositeTraintuples', args=[]))
         except LedgerError as e:
             return Response({'message': str(e.msg)}, status=e.status)
 
-        query_params = request.query_params.get('search')
-        if query_params is not None:
-            try:
-                data = filter_list(
-                    channel_name=get_channel_name(request),
-                    object_type='composite_traintuple',
-                    data=data,
-                    query_params=query_params)
-            except LedgerError as e:
-                return Response({'message': str(e.msg)}, status=e.status)
-
-        return Response(data, status=status.HTTP_200_OK)
+        return Response(data, status=status.HTTP_200_OK, headers={'X-Total-Count': count})
 
     def _retrieve(self, channel_name, key):
         validate_key(key)
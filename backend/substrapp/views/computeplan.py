@@ -9,7 +9,7 @@ from substrapp.serializers import LedgerComputePlanSerializer
 from substrapp.ledger.api import invoke_ledger, query_ledger, get_object_from_ledger
 from substrapp.ledger.exceptions import LedgerError
 from substrapp.views.utils import get_success_create_code, validate_key, get_channel_name
-from substrapp.views.filters_utils import filter_list
+from substrapp.views.filters_utils import list_assets
 
 
 def create_compute_plan(channel_name, data):
@@ -55,25 +55,15 @@ class ComputePlanViewSet(mixins.CreateModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
+        channel_name = get_channel_name(request)
         try:
-            data = query_ledger(get_channel_name(request), fcn='queryComputePlans', args=[])
+            data, count = list_assets(
+                channel_name, 'compute_plan', request.query_params,
+                lambda: query_ledger(channel_name, fcn='queryComputePlans', args=[]))
         except LedgerError as e:
             return Response({'message': str(e.msg)}, status=e.status)
 
-        data = data or []
-
-        query_params = request.query_params.get('search')
-        if query_params is not None:
-            try:
-                data = filter_list(
-                    channel_name=get_channel_name(request),
-                    object_type='compute_plan',
-                    data=data,
-                    query_params=query_params)
-            except LedgerError as e:
-                return Response({'message': str(e.msg)}, status=e.status)
-
-        return Response(data, status=status.HTTP_200_OK)
+        return Response(data, status=status.HTTP_200_OK, headers={'X-Total-Count': count})
 
     @action(detail=True, methods=['POST'])
     def cancel(self, request, *args, **kwargs):
@@ -3,7 +3,8 @@ import itertools
 
 from urllib.parse import unquote
 
-from substrapp.ledger.api import query_ledger
+from substrapp.ledger import mirror as ledger_mirror
+from substrapp.ledger.api import query_ledger_many
 from substrapp import exceptions
 
 logger = logging.getLogger(__name__)
@@ -110,7 +111,7 @@ def flatten_without_duplicates(list_of_list):
     return res
 
 
-def filter_list(channel_name, object_type, data, query_params):
+def _parse_filters(object_type, query_params):
     try:
         filters = get_filters(query_params)
     except Exception:
@@ -119,16 +120,86 @@ def filter_list(channel_name, object_type, data, query_params):
         logger.exception(message)
         raise exceptions.BadRequestError(message)
 
+    for user_filter in filters:
+        for filter_key in user_filter:
+            if filter_key not in AUTHORIZED_FILTERS[object_type]:
+                raise exceptions.BadRequestError(
+                    f'Malformed search filters: not authorized filter key {filter_key} for asset {object_type}')
+
+    return filters
+
+
+def _get_mirror_filters(object_type, filters):
+    """Return the filters as filters of the ledger mirror, None if they aren't all on its indexed attributes."""
+    mirror_filters = []
+    for user_filter in filters:
+        for filter_key, subfilters in user_filter.items():
+            if not _same_nature(filter_key, object_type) or filter_key == 'model':
+                return None
+            if not set(subfilters) <= set(ledger_mirror.INDEXED_ATTRIBUTES):
+                return None
+            mirror_filters.append(subfilters)
+    return mirror_filters
+
+
+def get_page(query_params):
+    """Return the (offset, limit) of the `offset` and `limit` query parameters, limit None for the whole list."""
+    try:
+        offset = int(query_params.get('offset', 0))
+        limit = query_params.get('limit')
+        limit = None if limit is None else int(limit)
+    except ValueError:
+        raise exceptions.BadRequestError('Malformed pagination: offset and limit must be integers')
+    if offset < 0 or (limit is not None and limit < 0):
+        raise exceptions.BadRequestError('Malformed pagination: offset and limit must be positive')
+    return offset, limit
+
+
+def list_assets(channel_name, object_type, query_params, query_list):
+    """Return the assets of a list endpoint and their total count, filtered by the `search` query parameter
+    and paginated by the `offset` and `limit` ones.
+
+    The ledger mirror serves them from its indexed columns if it can, else `query_list()` returns the whole
+    list, filtered and paginated here.
+    """
+    search = query_params.get('search')
+    offset, limit = get_page(query_params)
+    filters = _parse_filters(object_type, search) if search is not None else []
+
+    mirror_filters = _get_mirror_filters(object_type, filters)
+    if mirror_filters is not None:
+        result = ledger_mirror.search(channel_name, object_type, mirror_filters, offset, limit)
+        if result is not None:
+            return result
+
+    data = query_list() or []
+    if search is not None:
+        data = filter_list(channel_name, object_type, data, search)
+    end = None if limit is None else offset + limit
+    return data[offset:end], len(data)
+
+
+def filter_list(channel_name, object_type, data, query_params):
+    filters = _parse_filters(object_type, query_params)
+
+    # Get other asset lists concurrently, each one once
+    filter_keys = sorted({
+        filter_key
+        for user_filter in filters
+        for filter_key in user_filter
+        if not _same_nature(filter_key, object_type)
+    })
+    other_assets = dict(zip(
+        filter_keys,
+        query_ledger_many(channel_name, [(FILTER_QUERIES[filter_key], []) for filter_key in filter_keys])
+    ))
+
     object_list = []
 
     for user_filter in filters:
 
         for filter_key, subfilters in user_filter.items():
 
-            if filter_key not in AUTHORIZED_FILTERS[object_type]:
-                raise exceptions.BadRequestError(
-                    f'Malformed search filters: not authorized filter key {filter_key} for asset {object_type}')
-
             # Will be appended in object_list after been filtered
             filtered_list = data
 
@@ -150,10 +221,7 @@ def filter_list(channel_name, object_type, data, query_params):
             else:
                 # Filter by other asset
 
-                # Get other asset list
-                filtering_data = query_ledger(channel_name, fcn=FILTER_QUERIES[filter_key], args=[])
-
-                filtering_data = filtering_data if filtering_data else []
+                filtering_data = other_assets[filter_key] or []
 
                 if filter_key in ('algo', 'composite_algo', 'aggregate_algo'):
                     for attribute, val in subfilters.items():
@@ -13,7 +13,7 @@ from substrapp.models import Model
 from substrapp.ledger.api import query_ledger, get_object_from_ledger
 from substrapp.ledger.exceptions import LedgerError
 from substrapp.views.utils import validate_key, get_remote_asset, PermissionMixin, get_channel_name
-from substrapp.views.filters_utils import filter_list
+from substrapp.views.filters_utils import list_assets
 
 logger = logging.getLogger(__name__)
 
@@ -73,22 +73,15 @@ class ModelViewSet(mixins.RetrieveModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
+        channel_name = get_channel_name(request)
         try:
-            data = query_ledger(get_channel_name(request), fcn='queryModels', args=[])
+            data, count = list_assets(
+                channel_name, 'model', request.query_params,
+                lambda: query_ledger(channel_name, fcn='queryModels', args=[]))
         except LedgerError as e:
             return Response({'message': str(e.msg)}, status=e.status)
-        query_params = request.query_params.get('search')
-        if query_params is not None:
-            try:
-                data = filter_list(
-                    channel_name=get_channel_name(request),
-                    object_type='model',
-                    data=data,
-                    query_params=query_params)
-            except LedgerError as e:
-                return Response({'message': str(e.msg)}, status=e.status)
-
-        return Response(data, status=status.HTTP_200_OK)
+
+        return Response(data, status=status.HTTP_200_OK, headers={'X-Total-Count': count})
 
 
 def gzip_action(func):
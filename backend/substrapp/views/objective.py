@@ -19,7 +19,7 @@ from substrapp.views.utils import (PermissionMixin, validate_key,
                                    get_success_create_code, ValidationException,
                                    LedgerException, get_remote_asset, validate_sort,
                                    node_has_process_permission, get_channel_name)
-from substrapp.views.filters_utils import filter_list
+from substrapp.views.filters_utils import list_assets
 
 
 def replace_storage_addresses(request, objective):
@@ -173,26 +173,18 @@ class ObjectiveViewSet(mixins.CreateModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
+        channel_name = get_channel_name(request)
         try:
-            data = query_ledger(get_channel_name(request), fcn='queryObjectives', args=[])
+            data, count = list_assets(
+                channel_name, 'objective', request.query_params,
+                lambda: query_ledger(channel_name, fcn='queryObjectives', args=[]))
         except LedgerError as e:
             return Response({'message': str(e.msg)}, status=e.status)
 
-        query_params = request.query_params.get('search')
-        if query_params is not None:
-            try:
-                data = filter_list(
-                    channel_name=get_channel_name(request),
-                    object_type='objective',
-                    data=data,
-                    query_params=query_params)
-            except LedgerError as e:
-                return Response({'message': str(e.msg)}, status=e.status)
-
         for objective in data:
             replace_storage_addresses(request, objective)
 
-        return Response(data, status=status.HTTP_200_OK)
+        return Response(data, status=status.HTTP_200_OK, headers={'X-Total-Count': count})
 
     @action(detail=True)
     def data(self, request, *args, **kwargs):